@@ -2,25 +2,24 @@ import argparse
 import configparser
 import sys
 import os
-import pandas as pd
+import numpy as np
 sys.path.append( "../scripts_labtest")
-from vcasb2threshold import extract_vcasb_threshold, draw_vcasb_threshold
+from vcasb_lookup import VcasbLookup, ROUNDING, chip_from_path
 
-def modify_vcasb_values(args, threshold, df):
+def modify_vcasb_values(template, lookup, chip, threshold, rounding="floor"):
     config = configparser.ConfigParser(allow_no_value=True, delimiters=("=", ":"))
     config.optionxform = str  # 대소문자 구분
-    config.read(args.input_conf)
+    config.read_string(template)
 
     section = "Producer.MOSSRAISER_0"
     if section in config:
         for key in config[section]:
             if "VCASB" in key:
-                region_index = key[0:2] + key[9]
-                new_vcasb = df[df['threshold']==threshold][region_index].iloc[0]
+                new_vcasb = lookup.vcasb(chip, key[0:2], int(key[9]), threshold, rounding=rounding)
                 config[section][key] = str(new_vcasb)
 
     else:
-        print(f"Section [{section}] not found in {args.input_conf}.")
+        print(f"Section [{section}] not found in the template.")
     return config
 
 
@@ -36,39 +35,49 @@ if __name__ == "__main__":
         "-s", "--scan",
         type=str,
         default="/Users/yoonha/cernbox/babyMOSS-2_4_W21D4/ThresholdScan/ScanCollection_20241126_113714",
-        help="ScanCollection folder for VCASB value."
+        help="ScanCollection folder for VCASB value (refitted only if its results changed since they were stored)."
+    )
+    parser.add_argument(
+        "--chip",
+        type=str, default=None,
+        help="Chip name in the lookup store (default: taken from --scan)"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Refit --scan even if its results did not change"
     )
     parser.add_argument(
         "-T", "--threshold",
-        type=int, nargs=2, 
+        type=float, nargs=2, 
         default = [15, 30],
         help="Range for threshold"
     )
-    
+    parser.add_argument("--step", type=float, default=1, help="Threshold step")
+    parser.add_argument("--rounding", choices=list(ROUNDING)[:-1], default="floor", help="VCASB rounding")
+
     args = parser.parse_args()
 
-    df_all_results = extract_vcasb_threshold(args.scan)
-    fit_parameters = draw_vcasb_threshold(df_all_results, fig=False)
+    lookup = VcasbLookup()
+    chip = args.chip or chip_from_path(args.scan)
+    # the stored fit is checked against the scan hash every run, as the csv import of config_generator_2DUT
+    if os.path.isdir(args.scan):
+        chip = lookup.build(args.scan, force=args.refresh)
+    elif chip in lookup.entries:
+        print(f"WARNING: {args.scan} not found, using the stored fit of {chip} without checking it")
 
-    arr_thr_vcasb = []
-    for threshold in range(args.threshold[0], args.threshold[1], 1):
-        for_each_thr = {}
-        for_each_thr['threshold'] = threshold
-        for region, value in fit_parameters.items():
-            vcasb = (threshold - fit_parameters[region]['intercept']) / fit_parameters[region]['slope']
-            for_each_thr[region] = int(vcasb)
-        arr_thr_vcasb.append( for_each_thr )
-    
-    df_thr = pd.DataFrame(arr_thr_vcasb)
-    print(df_thr.head(5))
-    #print(df_thr[df_thr['threshold']==12]['tb0'].iloc[0])
+    thresholds = np.arange(args.threshold[0], args.threshold[1], args.step)
+    print(chip)
+    for region in sorted(lookup.fit_parameters(chip)):
+        print(region, lookup.vcasb(chip, region[0:2], int(region[2]), thresholds[:5], rounding=args.rounding))
 
     input_name = os.path.basename( args.input_conf )[:-5]
     if not os.path.exists(input_name): os.mkdir(input_name)
     print( f"Saving at dir {input_name}")
 
-    for thr in range( args.threshold[0], args.threshold[1], 1):
-        config = modify_vcasb_values( args, thr, df_thr )
-        with open(f"{input_name}/{input_name}_THR{thr}.conf", "w") as file:
+    with open(args.input_conf) as file:
+        template = file.read()
+    for thr in thresholds:
+        config = modify_vcasb_values( template, lookup, chip, thr, rounding=args.rounding )
+        with open(f"{input_name}/{input_name}_THR{thr:g}.conf", "w") as file:
             config.write(file, space_around_delimiters=False)
-    
\ No newline at end of file
@@ -2,20 +2,16 @@ import argparse
 import configparser
 import sys
 import os
-import pandas as pd
+import numpy as np
 sys.path.append( "../scripts_labtest")
-from vcasb2threshold import extract_vcasb_threshold, draw_vcasb_threshold
-
-def modify_vcasb_values(conf, df, threshold, moss_idx):
-    config = configparser.ConfigParser(allow_no_value=True, delimiters=("=", ":"))
-    config.optionxform = str  
-    config.read( conf )
+from vcasb_lookup import VcasbLookup, ROUNDING
 
+def modify_vcasb_values(config, lookup, chip, threshold, moss_idx, rounding="floor"):
     section = f"Producer.MOSSRAISER_{moss_idx}"
     if section in config:
         for key in config[section]:
             if "VCASB" in key:
-                new_vcasb = df[df['Threshold']==threshold][key[:-6]].iloc[0]
+                new_vcasb = lookup.vcasb(chip, key[0:2], int(key[9]), threshold, rounding=rounding)
                 config[section][key] = str(new_vcasb)
 
             # suppression for tokyo babyMOSS(idx=1)
@@ -23,7 +19,7 @@ def modify_vcasb_values(conf, df, threshold, moss_idx):
                 config[section][key] = str(50)
 
     else:
-        print(f"Section [{section}] not found in {conf}.")
+        print(f"Section [{section}] not found in the template.")
     return config
 
 
@@ -39,36 +35,42 @@ if __name__ == "__main__":
         "-c", "--csv",
         type=str, nargs=2,
         default=["../scripts_labtest/babyMOSS-2_4_W21D4_vcasb_values.csv", "../scripts_labtest/babyMOSS-3_4_W17E6_vcasb_values.csv"],
-        help="VCASB value of DUT0 & DUT1"
+        help="VCASB value of DUT0 & DUT1 (imported into the lookup store once)"
+    )
+    parser.add_argument(
+        "--chips",
+        type=str, nargs=2, default=None,
+        help="Chip names of DUT0 & DUT1 already in the lookup store (instead of --csv)"
     )
     parser.add_argument(
         "-T", "--threshold",
-        type=int, nargs=2, 
+        type=float, nargs=2, 
         default = [15, 30],
         help="Range for threshold"
     )
-    
+    parser.add_argument("--step", type=float, default=1, help="Threshold step")
+    parser.add_argument("--rounding", choices=list(ROUNDING)[:-1], default="floor", help="VCASB rounding")
+
     args = parser.parse_args()
-    df_thr = pd.read_csv( args.csv[0])
-    print(df_thr.head(5))
-    #print(df_thr[df_thr['threshold']==12]['tb0'].iloc[0])
+
+    lookup = VcasbLookup()
+    chips = args.chips or [lookup.import_csv(csv) for csv in args.csv]
+    thresholds = np.arange(args.threshold[0], args.threshold[1], args.step)
+    for chip in chips:
+        print(chip, {region: lookup.vcasb(chip, region[0:2], int(region[2]), thresholds[0], rounding=args.rounding)
+                     for region in sorted(lookup.fit_parameters(chip))})
 
     input_name = os.path.basename( args.input_conf )[:-5]
     if not os.path.exists(input_name): os.mkdir(input_name)
     print( f"Saving at dir {input_name}")
 
-    for thr in range( args.threshold[0], args.threshold[1], 1):
-        config = modify_vcasb_values( conf = args.input_conf,
-                                      df = pd.read_csv(args.csv[0]),
-                                      threshold = thr,
-                                      moss_idx=0 )
-        with open(f"{input_name}/{input_name}_THR{thr}.conf", "w") as file:
-            config.write(file, space_around_delimiters=False)
-
-        config = modify_vcasb_values( conf = f"{input_name}/{input_name}_THR{thr}.conf",
-                                      df = pd.read_csv(args.csv[1]),
-                                      threshold = thr,
-                                      moss_idx=1 )
-        with open(f"{input_name}/{input_name}_THR{thr}.conf", "w") as file:
+    with open(args.input_conf) as file:
+        template = file.read()
+    for thr in thresholds:
+        config = configparser.ConfigParser(allow_no_value=True, delimiters=("=", ":"))
+        config.optionxform = str
+        config.read_string(template)
+        for moss_idx, chip in enumerate(chips):
+            modify_vcasb_values( config, lookup, chip, thr, moss_idx, rounding=args.rounding )
+        with open(f"{input_name}/{input_name}_THR{thr:g}.conf", "w") as file:
             config.write(file, space_around_delimiters=False)
-    
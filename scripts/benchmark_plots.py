@@ -0,0 +1,197 @@
+"""
+Benchmark for the hitmap plotting scripts on synthetic ROOT files
+
+Synthetic files follow the monitoring layout
+    Hitmaps/ALPIDE_<n>/h_hitmap_ALPIDE_<n>, h_hitYmap_ALPIDE_<n>              (1024 x 512)
+    Hitmaps/babyMOSS_<unit>_reg<r>_<m>/h_hitmap_..., h_hitYmap_...          (tb 256 x 256, bb 320 x 320)
+and are written with uproot, so no ROOT installation is needed to generate them.
+
+Stages timed separately per file and backend: open, extract, flip, draw, save.
+
+    python benchmark_plots.py --alpide 6 --babymoss 1 2 4 --backend root mpl -o bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import hitmap_reader
+
+ALPIDE_SHAPE = (1024, 512)
+REGION_SHAPE = {"tb": (256, 256), "bb": (320, 320)}
+
+
+def babymoss_name(unit, region, det_index):
+    return f"babyMOSS_{unit}_reg{region}_{det_index}"
+
+
+def make_synthetic_file(path, n_alpide, n_babymoss, mean_hits=5.0, scale=1.0, seed=1):
+    """Write a ROOT file with n_alpide ALPIDE planes and n_babymoss babyMOSS (8 regions each).
+    scale multiplies the number of pixels per axis (for histogram-size scans)."""
+    import uproot  # pylint: disable=import-outside-toplevel
+    rng = np.random.default_rng(seed)
+
+    def hitmap_pair(nx, ny):
+        nx, ny = max(1, int(nx * scale)), max(1, int(ny * scale))
+        counts = rng.poisson(mean_hits, size=(nx, ny)).astype(np.float64)
+        xedges, yedges = np.arange(nx + 1, dtype=float), np.arange(ny + 1, dtype=float)
+        return (counts, xedges, yedges), (counts.sum(axis=0), yedges)
+
+    names = [f"ALPIDE_{plane}" for plane in range(n_alpide)]
+    shapes = [ALPIDE_SHAPE] * n_alpide
+    for det_index in range(n_babymoss):
+        for unit in ("tb", "bb"):
+            for region in range(4):
+                names.append(babymoss_name(unit, region, det_index))
+                shapes.append(REGION_SHAPE[unit])
+
+    with uproot.recreate(path) as f:
+        for name, (nx, ny) in zip(names, shapes):
+            hitmap, projection = hitmap_pair(nx, ny)
+            f[f"Hitmaps/{name}/h_hitmap_{name}"] = hitmap
+            f[f"Hitmaps/{name}/h_hitYmap_{name}"] = projection
+    return path
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+
+def bench_root(path, outdir):
+    """hitmap.py ROOT path, split into stages"""
+    import ROOT
+    from hitmap import flip_y
+    ROOT.gROOT.SetBatch(True)
+    timer = StageTimer()
+
+    with timer.stage("open"):
+        root_file = ROOT.TFile.Open(path)
+        hitmaps_dir = root_file.Get("Hitmaps")
+    with timer.stage("extract"):
+        hitmaps = {}
+        for key in hitmaps_dir.GetListOfKeys():
+            detector = hitmap_reader.parse_detector_name(key.GetName())
+            if detector is not None:
+                hitmaps[detector] = hitmaps_dir.Get(detector.name).Get(f"h_hitmap_{detector.name}")
+    with timer.stage("flip"):
+        hitmaps = {detector: flip_y(hist) if detector.unit == "bb" else hist for detector, hist in hitmaps.items()}
+
+    canvases = []
+    with timer.stage("draw"):
+        for det_index in sorted({d.det_index for d in hitmaps if d.kind == "babyMOSS"}):
+            canvas = ROOT.TCanvas(f"bench_{det_index}", "", 2000, 1000)
+            canvas.Divide(4, 2)
+            for detector, hist in hitmaps.items():
+                if detector.kind == "babyMOSS" and detector.det_index == det_index:
+                    canvas.cd(detector.pad_index + 1)
+                    hist.Draw("COLZ")
+            canvas.Update()
+            canvases.append((f"babyMOSS_{det_index}", canvas))
+        for detector, hist in hitmaps.items():
+            if detector.kind == "ALPIDE":
+                canvas = ROOT.TCanvas(f"bench_{detector.name}", "", 2000, 1000)
+                hist.Draw("COLZ")
+                canvas.Update()
+                canvases.append((detector.name, canvas))
+    with timer.stage("save"):
+        for name, canvas in canvases:
+            canvas.SaveAs(os.path.join(outdir, f"root_{name}.pdf"))
+    root_file.Close()
+    return timer.times
+
+
+def bench_mpl(path, outdir):
+    """hitmap.py --backend mpl path, split into stages"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import mpl_draw
+    timer = StageTimer()
+
+    with timer.stage("open"):
+        reader = hitmap_reader.HitmapReader(path)
+        detectors = reader.detectors()
+    with timer.stage("extract"):
+        hitmaps = {detector: reader.hitmap(detector, flip_bb=False) for detector in detectors}
+    with timer.stage("flip"):
+        hitmaps = {detector: hitmap_reader.flip_y(hist) if detector.unit == "bb" else hist
+                   for detector, hist in hitmaps.items()}
+    reader.close()
+
+    figures = []
+    with timer.stage("draw"):
+        for det_index in sorted({d.det_index for d in hitmaps if d.kind == "babyMOSS"}):
+            fig, axes = plt.subplots(2, 4, figsize=(20, 10))
+            for detector, hist in hitmaps.items():
+                if detector.kind == "babyMOSS" and detector.det_index == det_index:
+                    mpl_draw.draw_hist2d(axes.flat[detector.pad_index], hist)
+            figures.append((f"babyMOSS_{det_index}", fig))
+        for detector, hist in hitmaps.items():
+            if detector.kind == "ALPIDE":
+                fig, ax = plt.subplots(figsize=(10, 5))
+                mpl_draw.draw_hist2d(ax, hist)
+                figures.append((detector.name, fig))
+    with timer.stage("save"):
+        for name, fig in figures:
+            fig.savefig(os.path.join(outdir, f"mpl_{name}.pdf"))
+            plt.close(fig)
+    return timer.times
+
+
+BACKENDS = {"root": bench_root, "mpl": bench_mpl}
+
+
+def run_benchmarks(alpide_counts, babymoss_counts, scales, backends, repeat, workdir):
+    results = []
+    for n_alpide in alpide_counts:
+        for n_babymoss in babymoss_counts:
+            for scale in scales:
+                path = os.path.join(workdir, f"synthetic_A{n_alpide}_M{n_babymoss}_s{scale:g}.root")
+                make_synthetic_file(path, n_alpide, n_babymoss, scale=scale)
+                for backend in backends:
+                    for iteration in range(repeat):
+                        times = BACKENDS[backend](path, workdir)
+                        times["total"] = sum(times.values())
+                        results.append({"backend": backend, "n_alpide": n_alpide, "n_babymoss": n_babymoss,
+                                        "scale": scale, "iteration": iteration, "file_size": os.path.getsize(path),
+                                        "times": times})
+                        print(f"{backend:<4} A={n_alpide} M={n_babymoss} scale={scale:g} #{iteration}: "
+                              + "  ".join(f"{stage} {seconds*1e3:7.1f} ms" for stage, seconds in times.items()))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hitmap plotting on synthetic ROOT files",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--alpide", type=int, nargs="+", default=[6], help="numbers of ALPIDE planes to scan")
+    parser.add_argument("--babymoss", type=int, nargs="+", default=[1, 2], help="numbers of babyMOSS to scan")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1.0], help="pixel-count scale factors per axis")
+    parser.add_argument("--backend", nargs="+", choices=list(BACKENDS), default=["mpl"], help="backends to time")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per configuration")
+    parser.add_argument("--workdir", default=None, help="where to put synthetic files and figures (default: temp dir)")
+    parser.add_argument("-o", "--output", default="bench_plots.json", help="machine-readable results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        results = run_benchmarks(args.alpide, args.babymoss, args.scale, args.backend, args.repeat, workdir)
+
+    with open(args.output, "w") as f:
+        json.dump({"host": platform.node(), "python": platform.python_version(),
+                   "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
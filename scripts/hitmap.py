@@ -1,11 +1,86 @@
-import ROOT
-import sys
+import argparse
+import functools
+import hashlib
 import os
+import re
+import time
+import numpy as np
+import hitmap_reader
+from plot_batch import collect_root_files, run_batch, run_name
+# PyROOT은 import에 수 초가 걸리므로 ROOT backend를 쓸 때만 함수 안에서 불러온다
 
-def plot_hitmaps(root_file_path):
+
+def _array_dtype(hist):
+    """NumPy dtype of the bin content array (TH2F -> TArrayF -> float32 등)"""
+    import ROOT
+    for array_class, dtype in ((ROOT.TArrayD, np.float64), (ROOT.TArrayF, np.float32), (ROOT.TArrayI, np.int32),
+                               (ROOT.TArrayS, np.int16), (ROOT.TArrayC, np.int8)):
+        if isinstance(hist, array_class):
+            return dtype
+    raise TypeError(f"Unsupported histogram type {hist.ClassName()}")
+
+
+def _bin_buffer(hist):
+    """Return a writable NumPy view of the bin contents of hist, shaped (ny+2, nx+2)."""
+    buffer = np.frombuffer(hist.GetArray(), dtype=_array_dtype(hist), count=hist.GetSize())
+    return buffer.reshape(hist.GetNbinsY() + 2, hist.GetNbinsX() + 2)
+
+
+def flip_y(hitmap):
+    """Clone hitmap with its Y axis reversed, as one array operation.
+    Under/overflow bins are left untouched, errors are flipped together with the contents."""
+    flipped_hitmap = hitmap.Clone(f"flipped_{hitmap.GetName()}")
+    y_bins = hitmap.GetNbinsY()
+
+    contents = _bin_buffer(flipped_hitmap)
+    contents[1:y_bins + 1] = contents[y_bins:0:-1].copy()
+
+    if flipped_hitmap.GetSumw2N() > 0:
+        sumw2 = np.frombuffer(flipped_hitmap.GetSumw2().GetArray(), dtype=np.float64, count=flipped_hitmap.GetSize())
+        sumw2 = sumw2.reshape(contents.shape)
+        sumw2[1:y_bins + 1] = sumw2[y_bins:0:-1].copy()
+
+    entries = hitmap.GetEntries()
+    flipped_hitmap.ResetStats()
+    flipped_hitmap.SetEntries(entries)
+    return flipped_hitmap
+
+
+def _flip_y_loop(hitmap):
+    """Reference implementation of flip_y with per-bin Get/SetBinContent (kept for timing comparison)"""
+    flipped_hitmap = hitmap.Clone(f"loop_flipped_{hitmap.GetName()}")
+    y_bins = hitmap.GetNbinsY()
+    for x_bin in range(1, hitmap.GetNbinsX() + 1):
+        for y_bin in range(1, y_bins + 1):
+            flipped_hitmap.SetBinContent(x_bin, y_bins - y_bin + 1, hitmap.GetBinContent(x_bin, y_bin))
+    return flipped_hitmap
+
+
+def compare_flip_timing(hitmap, repeat=3):
+    """Time flip_y against the per-bin loop on hitmap and check that both agree"""
+    t_loop = min(_timed(_flip_y_loop, hitmap) for _ in range(repeat))
+    t_vec = min(_timed(flip_y, hitmap) for _ in range(repeat))
+
+    loop_contents = _bin_buffer(_flip_y_loop(hitmap))[1:-1, 1:-1]
+    vec_contents = _bin_buffer(flip_y(hitmap))[1:-1, 1:-1]
+    same = np.array_equal(loop_contents, vec_contents)
+
+    print(f"{hitmap.GetName()}: loop {t_loop*1e3:.2f} ms, vectorized {t_vec*1e3:.2f} ms, "
+          f"speedup x{t_loop / t_vec:.1f}, identical={same}")
+    return t_loop, t_vec
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def plot_hitmaps(root_file_path, time_flip=False, draw=True):
+    import ROOT
     # ROOT 파일 열기
     root_file = ROOT.TFile.Open(root_file_path)
-    root_file_name = os.path.basename(root_file_path)[:-5]
+    root_file_name = run_name(root_file_path)
     if not root_file or root_file.IsZombie():
         print(f"Failed to open {root_file_path}")
         return
@@ -41,26 +116,21 @@ def plot_hitmaps(root_file_path):
 
         # babyMOSS의 경우 처리
         elif "reg" in detector_name:
-            det_index = int(detector_name.split('_')[-1])
-            reg_index = int(detector_name.split('_reg')[1].split('_')[0])
+            detector = hitmap_reader.parse_detector_name(detector_name)
+            det_index, reg_index = detector.det_index, detector.pad_index
 
             hitmap_name = f"h_hitmap_{detector_name}"
             hitmap = detector_dir.Get(hitmap_name)
-            if "bb" in detector_name: 
-                hitmap.SetTitle(f"BB_reg{reg_index}")
-                reg_index = reg_index + 4
- # Y축 데이터 반전
+            hitmap.SetTitle(detector.title)
+            if detector.unit == "bb":  # Y축 데이터 반전
                 hitmap.GetYaxis().SetTitle("320-Y")
-                flipped_hitmap = hitmap.Clone(f"flipped_{hitmap.GetName()}")
-                y_bins = hitmap.GetNbinsY()
-                for x_bin in range(1, hitmap.GetNbinsX() + 1):
-                    for y_bin in range(1, y_bins + 1):
-                        flipped_hitmap.SetBinContent(x_bin, y_bins - y_bin + 1, hitmap.GetBinContent(x_bin, y_bin))
+                if time_flip:
+                    compare_flip_timing(hitmap)
+                flipped_hitmap = flip_y(hitmap)
 
                 babyMOSS_hitmaps[(det_index, reg_index)] = flipped_hitmap
 
             else:
-                hitmap.SetTitle(f"TB_reg{reg_index}")
                 babyMOSS_hitmaps[(det_index, reg_index)] = hitmap
 
         else:
@@ -83,7 +153,8 @@ def plot_hitmaps(root_file_path):
         
         # 각 detector별 canvas 저장
         individual_canvas.SaveAs(f"./fig/{root_file_name}_babyMOSS_{det_index}.pdf")
-        individual_canvas.Draw()
+        if draw:
+            individual_canvas.Draw()
 
             
 
@@ -92,15 +163,201 @@ def plot_hitmaps(root_file_path):
     root_file.Close()
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python plot_hitmaps.py <input_root_file>")
-        sys.exit(1)
+def plot_hitmaps_mpl(root_file_path):
+    """Same figures as plot_hitmaps, read with uproot and drawn with matplotlib (no ROOT import)"""
+    import mpl_draw
+    root_file_name = run_name(root_file_path)
+    babyMOSS_hitmaps, alpide_hitmaps = hitmap_reader.read_babymoss_hitmaps(root_file_path)
+
+    for detector_name, hitmap in alpide_hitmaps.items():
+        mpl_draw.save_single(hitmap, mpl_draw.draw_hist2d, f"./fig/{root_file_name}_{detector_name}.pdf")
+
+    for det_index in sorted(set(det for det, reg in babyMOSS_hitmaps)):
+        hists_by_pad = {reg: hist for (det, reg), hist in babyMOSS_hitmaps.items() if det == det_index}
+        mpl_draw.save_babymoss_grid(hists_by_pad, mpl_draw.draw_hist2d, f"./fig/{root_file_name}_babyMOSS_{det_index}.pdf")
+
+
+class HitmapWatcher:
+    """Live hitmaps of a growing monitoring ROOT file.
 
-    root_file_path = sys.argv[1]
+    The file handle and one canvas per ALPIDE plane / babyMOSS unit stay open between
+    refreshes. The file is only re-read when its size or mtime changed, and only the
+    pads whose histogram changed (entries or content hash) are redrawn."""
 
+    def __init__(self, root_file_path, interval=5.0, save=False):
+        import ROOT
+        self.root_file_path = root_file_path
+        self.root_file_name = run_name(root_file_path)
+        self.interval = interval
+        self.save = save
+        self.root_file = ROOT.TFile.Open(root_file_path)
+        if not self.root_file or self.root_file.IsZombie():
+            raise OSError(f"Failed to open {root_file_path}")
+        self.canvases = {}      # canvas key -> TCanvas
+        self.drawn = {}         # detector name -> histogram currently drawn
+        self.fingerprints = {}  # detector name -> (entries, content hash)
+        self.file_stamp = None
+        self.latencies = []
+
+    def _canvas(self, key, title, divide):
+        import ROOT
+        if key not in self.canvases:
+            canvas = ROOT.TCanvas(f"watch_{key}", title, 2000, 1000)
+            if divide:
+                canvas.Divide(4, 2)
+            self.canvases[key] = canvas
+        return self.canvases[key]
+
+    def _read_hitmap(self, detector_dir, detector_name):
+        # ReadObj: Get() would return the copy cached in memory from the previous refresh
+        key = detector_dir.GetKey(f"h_hitmap_{detector_name}")
+        if not key:
+            return None
+        hitmap = key.ReadObj()
+        hitmap.SetDirectory(0)
+        return hitmap
+
+    @staticmethod
+    def _fingerprint(hitmap):
+        return hitmap.GetEntries(), hashlib.blake2b(_bin_buffer(hitmap).tobytes(), digest_size=16).hexdigest()
+
+    def refresh(self):
+        """Re-read the file if it changed and redraw changed detectors. Returns the changed detector names."""
+        import ROOT
+        stat = os.stat(self.root_file_path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if stamp == self.file_stamp:
+            return []
+        self.file_stamp = stamp
+
+        self.root_file.ReadKeys(True)
+        hitmaps_dir = self.root_file.Get("Hitmaps")
+        if not hitmaps_dir:
+            return []
+        hitmaps_dir.ReadKeys(True)
+
+        changed, updated_canvases = [], set()
+        for key in hitmaps_dir.GetListOfKeys():
+            detector = hitmap_reader.parse_detector_name(key.GetName())
+            detector_dir = hitmaps_dir.Get(key.GetName())
+            if detector is None or not isinstance(detector_dir, ROOT.TDirectoryFile):
+                continue
+            detector_dir.ReadKeys(True)
+            hitmap = self._read_hitmap(detector_dir, detector.name)
+            if hitmap is None:
+                continue
+            fingerprint = self._fingerprint(hitmap)
+            if self.fingerprints.get(detector.name) == fingerprint:
+                continue
+            self.fingerprints[detector.name] = fingerprint
+            changed.append(detector.name)
+
+            if detector.kind == "ALPIDE":
+                canvas_key = detector.name
+                canvas = self._canvas(canvas_key, detector.name, divide=False)
+                pad = canvas.cd()
+            else:
+                hitmap.SetTitle(detector.title)
+                if detector.unit == "bb":  # Y축 데이터 반전
+                    hitmap.GetYaxis().SetTitle("320-Y")
+                    hitmap = flip_y(hitmap)
+                canvas_key = f"babyMOSS_{detector.det_index}"
+                canvas = self._canvas(canvas_key, canvas_key, divide=True)
+                pad = canvas.cd(detector.pad_index + 1)
+                pad.SetRightMargin(0.14)
+            pad.Clear()  # drop the previous hitmap, or primitives pile up on long watches
+            hitmap.Draw("COLZ")
+            pad.Modified()
+            self.drawn[detector.name] = hitmap  # keep the drawn object alive
+            updated_canvases.add(canvas_key)
+
+        for canvas_key in updated_canvases:
+            self.canvases[canvas_key].Update()
+            if self.save:
+                self.canvases[canvas_key].SaveAs(f"./fig/{self.root_file_name}_{canvas_key}.pdf")
+        return changed
+
+    def run(self, max_refreshes=None):
+        """Poll every interval seconds until interrupted; report latency of each refresh"""
+        import ROOT
+        n_refresh = 0
+        try:
+            while max_refreshes is None or n_refresh < max_refreshes:
+                start = time.perf_counter()
+                changed = self.refresh()
+                latency = time.perf_counter() - start
+                if changed:
+                    self.latencies.append(latency)
+                    print(f"[{time.strftime('%H:%M:%S')}] {len(changed)}/{len(self.fingerprints)} detector(s) "
+                          f"redrawn in {latency*1e3:.0f} ms (max {max(self.latencies)*1e3:.0f} ms)")
+                n_refresh += 1
+                # keep the canvases responsive while waiting for the next poll
+                deadline = start + self.interval
+                while time.perf_counter() < deadline:
+                    ROOT.gSystem.ProcessEvents()
+                    time.sleep(0.05)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.latencies:
+                print(f"{len(self.latencies)} refresh(es), redraw latency mean {np.mean(self.latencies)*1e3:.0f} ms, "
+                      f"max {max(self.latencies)*1e3:.0f} ms (polling every {self.interval:.1f} s)")
+            self.root_file.Close()
+
+
+def _set_style():
+    import ROOT
     ROOT.gStyle.SetOptStat(0)       # 원하는 statbox 옵션 설정 (e.g., 1110: entries, mean, RMS)
     ROOT.gStyle.SetFillStyle(0)
     #ROOT.gStyle.SetStatFillStyle(0)        # statbox 배경 투명하게 (0 = 투명)
 
-    plot_hitmaps(root_file_path)
\ No newline at end of file
+
+def _init_batch_worker():
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    _set_style()
+
+
+def _plot_batch(root_file_path, backend="root"):
+    if backend == "mpl":
+        plot_hitmaps_mpl(root_file_path)
+    else:
+        plot_hitmaps(root_file_path, draw=False)
+
+
+def _outputs(root_file_path):
+    return rf"{re.escape(run_name(root_file_path))}_(ALPIDE\w*|babyMOSS_\d+)\.pdf"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw ALPIDE and babyMOSS hitmaps from ROOT files")
+    parser.add_argument("inputs", nargs="+", help="ROOT file(s), glob(s) or directories (directories/globs imply --batch)")
+    parser.add_argument("--time-flip", action="store_true",
+                        help="compare vectorized bb Y-flip against the per-bin loop")
+    parser.add_argument("-b", "--batch", action="store_true", help="process all inputs on a process pool, ROOT in batch mode")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true", help="redraw even if the figures are newer than the ROOT file")
+    parser.add_argument("--backend", choices=["root", "mpl"], default="root",
+                        help="root: PyROOT + TCanvas, mpl: uproot + matplotlib (fast start-up, no ROOT needed)")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="keep polling the (growing) ROOT file and redraw detectors whose hitmap changed")
+    parser.add_argument("--interval", type=float, default=5.0, help="polling interval in seconds for --watch")
+    parser.add_argument("--save", action="store_true", help="with --watch, also save changed canvases to ./fig")
+    args = parser.parse_args()
+
+    root_files = collect_root_files(args.inputs)
+    if args.watch:
+        if len(root_files) != 1:
+            parser.error("--watch takes exactly one ROOT file")
+        _set_style()
+        HitmapWatcher(root_files[0], interval=args.interval, save=args.save).run()
+    elif args.batch or len(root_files) != 1 or os.path.isdir(args.inputs[0]):
+        initializer = _init_batch_worker if args.backend == "root" else None
+        run_batch(functools.partial(_plot_batch, backend=args.backend), root_files, _outputs,
+                  jobs=args.jobs, force=args.force, initializer=initializer)
+    elif args.backend == "mpl":
+        os.makedirs("./fig", exist_ok=True)
+        plot_hitmaps_mpl(root_files[0])
+    else:
+        _set_style()
+        plot_hitmaps(root_files[0], time_flip=args.time_flip)
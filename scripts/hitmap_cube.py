@@ -0,0 +1,207 @@
+"""
+Memory-mapped babyMOSS hitmap cube across a run series
+
+    <cube_dir>/hitmaps_tb.dat  raw float32 array (run, detector, region, x, y) of the top half-units
+    <cube_dir>/hitmaps_bb.dat  same for the bottom half-units (own pixel matrix size, e.g. 320 x 320)
+    <cube_dir>/cube.json       dtype, block shape per half-unit, detector indices and the run list
+    <cube_dir>/runs.csv        run number -> ROOT file, config file (e.g. kek-2MOSS_thr_scan_THR20.conf)
+
+Region index follows the hitmap canvas convention (tb 0-3, bb 4-7); within a half-unit
+file the regions are 0-3. Hitmaps are stored as in the ROOT file, i.e. without the bb
+Y-flip; HitmapCube.hitmap() applies it. Appending a run only appends one block per
+half-unit and rewrites the small sidecars.
+
+    python hitmap_cube.py append cube/ run*.root --config-map thr_scan_runs.csv
+    python hitmap_cube.py info cube/
+"""
+import argparse
+import csv
+import json
+import os
+import re
+
+import numpy as np
+
+import hitmap_reader
+from plot_batch import collect_root_files
+
+UNITS = ("tb", "bb")
+REGIONS_PER_UNIT = 4
+DTYPE = "float32"
+
+
+def unit_of(pad_index):
+    """(unit, region within the unit) of a canvas region index 0-7"""
+    return UNITS[pad_index // REGIONS_PER_UNIT], pad_index % REGIONS_PER_UNIT
+
+
+def run_number(root_file_path):
+    """EUDAQ file names look like run123456_240905123456.root"""
+    match = re.search(r"run(\d+)", os.path.basename(root_file_path))
+    if not match:
+        raise ValueError(f"Cannot find a run number in {root_file_path}")
+    return int(match.group(1))
+
+
+def read_run_block(root_file_path, det_indices=None, unit_shapes=None):
+    """(det_indices, {unit: block}) with block shaped (n_det, REGIONS_PER_UNIT, nx, ny) for the pixel
+    matrix of that half-unit; missing regions are NaN. unit_shapes ({unit: (nx, ny)}) are the shapes
+    of the cube, by default the ones of the first region of each half-unit found."""
+    with hitmap_reader.HitmapReader(root_file_path) as reader:
+        hitmaps = {(detector.det_index, detector.pad_index): reader.hitmap(detector, flip_bb=False).values
+                   for detector in reader.detectors() if detector.kind == "babyMOSS"}
+    if not hitmaps:
+        raise ValueError(f"No babyMOSS hitmaps in {root_file_path}")
+    if det_indices is None:
+        det_indices = sorted(set(det for det, reg in hitmaps))
+    unit_shapes = dict(unit_shapes or {})
+    for (det, reg), values in sorted(hitmaps.items()):
+        unit_shapes.setdefault(unit_of(reg)[0], tuple(values.shape))
+
+    blocks = {unit: np.full((len(det_indices), REGIONS_PER_UNIT, *shape), np.nan, dtype=DTYPE)
+              for unit, shape in unit_shapes.items()}
+    for (det, reg), values in hitmaps.items():
+        if det not in det_indices:
+            print(f"{root_file_path}: babyMOSS {det} is not part of the cube, skipped")
+            continue
+        unit, region = unit_of(reg)
+        if values.shape != tuple(unit_shapes[unit]):
+            raise ValueError(f"{root_file_path}: babyMOSS {det} {unit} region {region} has shape {values.shape}, "
+                             f"expected {tuple(unit_shapes[unit])}")
+        blocks[unit][det_indices.index(det), region] = values
+    return det_indices, blocks
+
+
+class HitmapCube:
+    """Read-only view of a cube directory.
+
+    cube = HitmapCube("cube/")
+    cube.data["bb"][:, 0, 2]             # babyMOSS 0, bb_reg2, all runs (x, y as stored)
+    cube.hitmap(run=123456, det_index=0, region=6)   # bb region with the Y-flip applied
+    """
+
+    def __init__(self, cube_dir):
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir, "cube.json")) as f:
+            self.meta = json.load(f)
+        if "units" not in self.meta:
+            raise ValueError(f"{cube_dir} has the old single-block layout (one shape for tb and bb), re-create it")
+        self.runs = self.meta["runs"]
+        self.det_indices = self.meta["det_indices"]
+        self.data = {}
+        for unit, unit_meta in self.meta["units"].items():
+            shape = (len(self.runs), *unit_meta["block_shape"])
+            self.data[unit] = np.memmap(os.path.join(cube_dir, unit_meta["file"]), dtype=self.meta["dtype"],
+                                        mode="r", shape=shape) \
+                if self.runs else np.empty(shape, dtype=self.meta["dtype"])
+
+    def run_index(self, run):
+        for index, entry in enumerate(self.runs):
+            if entry["run"] == run:
+                return index
+        raise KeyError(f"Run {run} not in cube {self.cube_dir}")
+
+    def hitmap(self, run, det_index, region, flip_bb=True):
+        """region: canvas index, tb 0-3, bb 4-7"""
+        unit, unit_region = unit_of(region)
+        values = self.data[unit][self.run_index(run), self.det_indices.index(det_index), unit_region]
+        return values[:, ::-1] if flip_bb and unit == "bb" else values
+
+    def config_of(self, run):
+        return self.runs[self.run_index(run)]["config"]
+
+
+def _write_sidecars(cube_dir, meta):
+    tmp_path = os.path.join(cube_dir, "cube.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(cube_dir, "cube.json"))
+
+    with open(os.path.join(cube_dir, "runs.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["index", "run", "root_file", "config"])
+        writer.writeheader()
+        for index, entry in enumerate(meta["runs"]):
+            writer.writerow({"index": index, **entry})
+
+
+def append_runs(cube_dir, root_files, configs=None):
+    """Append the babyMOSS hitmaps of root_files to the cube (created if needed).
+    configs maps run number -> config file name. Runs already in the cube are skipped."""
+    configs = configs or {}
+    os.makedirs(cube_dir, exist_ok=True)
+    meta_path = os.path.join(cube_dir, "cube.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if "units" not in meta:
+            raise ValueError(f"{cube_dir} has the old single-block layout (one shape for tb and bb), re-create it")
+    else:
+        meta = {"dtype": DTYPE, "det_indices": None, "units": None, "runs": []}
+    known_runs = {entry["run"] for entry in meta["runs"]}
+
+    for root_file_path in root_files:
+        run = run_number(root_file_path)
+        if run in known_runs:
+            print(f"run {run} already in cube, skipped")
+            continue
+        unit_shapes = None if meta["units"] is None else \
+            {unit: unit_meta["block_shape"][2:] for unit, unit_meta in meta["units"].items()}
+        det_indices, blocks = read_run_block(root_file_path, meta["det_indices"], unit_shapes)
+        if meta["units"] is None:
+            meta["det_indices"] = det_indices
+            meta["units"] = {unit: {"file": f"hitmaps_{unit}.dat", "block_shape": list(block.shape)}
+                             for unit, block in sorted(blocks.items())}
+        elif set(blocks) != set(meta["units"]):
+            raise ValueError(f"{root_file_path}: half-units {sorted(blocks)} do not match cube {sorted(meta['units'])}")
+
+        for unit, block in blocks.items():
+            path = os.path.join(cube_dir, meta["units"][unit]["file"])
+            # drop a block left by an append interrupted before its sidecars were written
+            expected_size = len(meta["runs"]) * block.nbytes
+            if os.path.exists(path) and os.path.getsize(path) > expected_size:
+                os.truncate(path, expected_size)
+            with open(path, "ab") as dat:
+                dat.write(block.tobytes())
+        meta["runs"].append({"run": run, "root_file": os.path.abspath(root_file_path),
+                             "config": configs.get(run, "")})
+        known_runs.add(run)
+        # sidecars after every run: an interrupted append leaves a consistent cube
+        _write_sidecars(cube_dir, meta)
+        print(f"run {run} appended ({configs.get(run, 'no config')})")
+    return HitmapCube(cube_dir)
+
+
+def read_config_map(csv_path):
+    """CSV with columns run,config"""
+    with open(csv_path) as f:
+        return {int(row["run"]): row["config"] for row in csv.DictReader(f)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped babyMOSS hitmap cube across runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    append_parser = subparsers.add_parser("append", help="append runs to a cube (creates it if needed)")
+    append_parser.add_argument("cube_dir")
+    append_parser.add_argument("inputs", nargs="+", help="ROOT file(s), glob(s) or directories")
+    append_parser.add_argument("--config-map", help="CSV with columns run,config")
+    append_parser.add_argument("--config", help="config file of a single appended run")
+
+    info_parser = subparsers.add_parser("info", help="print the run list of a cube")
+    info_parser.add_argument("cube_dir")
+    args = parser.parse_args()
+
+    if args.command == "append":
+        root_files = collect_root_files(args.inputs)
+        configs = read_config_map(args.config_map) if args.config_map else {}
+        if args.config:
+            if len(root_files) != 1:
+                parser.error("--config needs exactly one input run")
+            configs[run_number(root_files[0])] = os.path.basename(args.config)
+        cube = append_runs(args.cube_dir, root_files, configs)
+    else:
+        cube = HitmapCube(args.cube_dir)
+    shapes = ", ".join(f"{unit} {data.shape}" for unit, data in cube.data.items())
+    print(f"{args.cube_dir}: {len(cube.runs)} run(s), shape {shapes}, babyMOSS {cube.det_indices}")
+    for entry in cube.runs:
+        print(f"  run {entry['run']}: {entry['config']}")
@@ -0,0 +1,167 @@
+"""
+ROOT-free reader for the Hitmaps directory of the monitoring ROOT files
+    Hitmaps/<detector>/h_hitmap_<detector>   (TH2)
+    Hitmaps/<detector>/h_hitYmap_<detector>  (TH1)
+Histograms are returned as NumPy arrays plus axis metadata (uproot backend),
+detector names (ALPIDE*, *_reg<N>_<det>, tb/bb) are parsed here only.
+"""
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Detector(NamedTuple):
+    name: str           # directory name in Hitmaps
+    kind: str           # "ALPIDE" or "babyMOSS"
+    det_index: int      # ALPIDE plane / babyMOSS unit number
+    unit: str = ""      # "tb" or "bb" (babyMOSS only)
+    region: int = -1    # region within the half unit (babyMOSS only)
+
+    @property
+    def pad_index(self):
+        """Region index on the 4x2 babyMOSS canvas: tb 0-3, bb 4-7"""
+        return self.region + 4 if self.unit == "bb" else self.region
+
+    @property
+    def title(self):
+        return f"{self.unit.upper()}_reg{self.region}" if self.kind == "babyMOSS" else self.name
+
+
+class Hist(NamedTuple):
+    values: np.ndarray   # shape (nx,) or (nx, ny), x first
+    errors: np.ndarray
+    xedges: np.ndarray
+    yedges: np.ndarray   # empty for 1D histograms
+    entries: float
+    title: str
+    xlabel: str
+    ylabel: str
+
+
+def parse_detector_name(name):
+    """Return a Detector for ALPIDE and babyMOSS directory names, None for anything else"""
+    if name.startswith("ALPIDE"):
+        match = re.search(r"(\d+)$", name)
+        return Detector(name, "ALPIDE", int(match.group(1)) if match else 0)
+    if "reg" in name:
+        region = int(name.split("_reg")[1].split("_")[0])
+        det_index = int(name.split("_")[-1])
+        unit = "bb" if "bb" in name else "tb"
+        return Detector(name, "babyMOSS", det_index, unit, region)
+    return None
+
+
+def flip_y(hist):
+    """Bottom-barrel convention: Y axis reversed (drawn as 320-Y)"""
+    return hist._replace(values=hist.values[:, ::-1], errors=hist.errors[:, ::-1], ylabel="320-Y")
+
+
+class HitmapReader:
+    """Read the Hitmaps directory of one run.
+
+    with HitmapReader("run.root") as reader:
+        for detector in reader.detectors():
+            hitmap = reader.hitmap(detector)
+    """
+
+    def __init__(self, root_file_path):
+        import uproot  # pylint: disable=import-outside-toplevel
+        self.path = root_file_path
+        self.file = uproot.open(root_file_path)
+        if "Hitmaps" not in self.file:
+            self.file.close()
+            raise KeyError(f"TDirectory 'Hitmaps' not found in {root_file_path}")
+        self.hitmaps_dir = self.file["Hitmaps"]
+        self._detectors = None
+        # I/O bookkeeping, reported by report.py
+        self.counters = {"file_opens": 1, "directory_walks": 0, "detector_reads": 0, "histogram_reads": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def detectors(self):
+        """ALPIDE and babyMOSS detectors found in Hitmaps, in file order (walked once per reader)"""
+        if self._detectors is None:
+            self.counters["directory_walks"] += 1
+            self._detectors = []
+            for name, classname in self.hitmaps_dir.classnames(recursive=False, cycle=False).items():
+                if classname != "TDirectory":
+                    continue
+                detector = parse_detector_name(name)
+                if detector is not None:
+                    self._detectors.append(detector)
+        return self._detectors
+
+    def read_detector(self, detector):
+        """Read the detector directory once: (hitmap as stored, without bb flip; Y projection)"""
+        self.counters["detector_reads"] += 1
+        self.counters["histogram_reads"] += 2
+        detector_dir = self.hitmaps_dir[detector.name]
+        return (to_hist(detector_dir[f"h_hitmap_{detector.name}"]),
+                to_hist(detector_dir[f"h_hitYmap_{detector.name}"]))
+
+    def hitmap(self, detector, flip_bb=True):
+        """h_hitmap_<detector> as Hist, bottom-barrel regions Y-flipped unless flip_bb=False"""
+        hist = self._read(detector, f"h_hitmap_{detector.name}")
+        if flip_bb and detector.unit == "bb":
+            hist = flip_y(hist)
+        return hist
+
+    def projection_y(self, detector):
+        """h_hitYmap_<detector> as Hist"""
+        return self._read(detector, f"h_hitYmap_{detector.name}")
+
+    def _read(self, detector, hist_name):
+        self.counters["histogram_reads"] += 1
+        return to_hist(self.hitmaps_dir[f"{detector.name}/{hist_name}"])
+
+
+def to_hist(uproot_hist):
+    """Convert an uproot TH1/TH2 into a Hist"""
+    axes = uproot_hist.axes
+    xlabel = axes[0].member("fTitle")
+    ylabel = axes[1].member("fTitle") if len(axes) > 1 else ""
+    return Hist(
+        values=uproot_hist.values(flow=False),
+        errors=uproot_hist.errors(flow=False),
+        xedges=axes[0].edges(flow=False),
+        yedges=axes[1].edges(flow=False) if len(axes) > 1 else np.empty(0),
+        entries=uproot_hist.member("fEntries"),
+        title=uproot_hist.title,
+        xlabel=xlabel,
+        ylabel=ylabel,
+    )
+
+
+def projection_x(hitmap):
+    """X projection of a 2D Hist (sum over Y)"""
+    return Hist(
+        values=hitmap.values.sum(axis=1),
+        errors=np.sqrt((hitmap.errors ** 2).sum(axis=1)),
+        xedges=hitmap.xedges,
+        yedges=np.empty(0),
+        entries=hitmap.entries,
+        title=hitmap.title,
+        xlabel=hitmap.xlabel,
+        ylabel="",
+    )
+
+
+def read_babymoss_hitmaps(root_file_path):
+    """{(det_index, pad_index): Hist} of all babyMOSS regions plus {name: Hist} of all ALPIDE planes"""
+    babyMOSS_hitmaps, alpide_hitmaps = {}, {}
+    with HitmapReader(root_file_path) as reader:
+        for detector in reader.detectors():
+            hist = reader.hitmap(detector)
+            if detector.kind == "ALPIDE":
+                alpide_hitmaps[detector.name] = hist
+            else:
+                babyMOSS_hitmaps[(detector.det_index, detector.pad_index)] = hist._replace(title=detector.title)
+    return babyMOSS_hitmaps, alpide_hitmaps
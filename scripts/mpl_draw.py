@@ -0,0 +1,47 @@
+"""
+matplotlib rendering of hitmap_reader.Hist objects, used as a ROOT-free
+alternative to TCanvas in hitmap.py and projection.py
+"""
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+
+
+def draw_hist2d(ax, hist):
+    """COLZ-like drawing: empty bins left white, colour bar on the right"""
+    values = np.ma.masked_equal(hist.values, 0)
+    image = ax.pcolormesh(hist.xedges, hist.yedges, values.T, cmap="viridis", rasterized=True)
+    ax.figure.colorbar(image, ax=ax)
+    ax.set_title(hist.title)
+    ax.set_xlabel(hist.xlabel)
+    ax.set_ylabel(hist.ylabel)
+
+
+def draw_hist1d(ax, hist):
+    """HIST-like drawing with the entries in the legend"""
+    ax.stairs(hist.values, hist.xedges, label=f"Entries {hist.entries:.0f}")
+    ax.set_title(hist.title)
+    ax.set_xlabel(hist.xlabel)
+    ax.legend(loc="upper right", fontsize="small")
+
+
+def save_single(hist, draw_func, output_path, figsize=(10, 5)):
+    fig, ax = plt.subplots(figsize=figsize)
+    draw_func(ax, hist)
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def save_babymoss_grid(hists_by_pad, draw_func, output_path, figsize=(20, 10)):
+    """Draw {pad_index: Hist} on a 4x2 grid (tb regions on top, bb below)"""
+    fig, axes = plt.subplots(2, 4, figsize=figsize)
+    for pad_index, ax in enumerate(axes.flat):
+        if pad_index in hists_by_pad:
+            draw_func(ax, hists_by_pad[pad_index])
+        else:
+            ax.axis("off")
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
@@ -0,0 +1,186 @@
+"""
+Hot/dead pixel finder for babyMOSS and ALPIDE hitmaps
+
+Per babyMOSS region / ALPIDE plane (vectorized over all pixels):
+    hot pixel     hits > median + n_mad * MAD  (MAD floored at the Poisson sigma of the median)
+    dead pixel    no hits while the median pixel has enough hits that a Poisson zero is not
+                  expected anywhere in the region: median > ln(n_pixels) + DEAD_MARGIN, i.e.
+                  n_pixels * exp(-median) < exp(-DEAD_MARGIN) (or --dead-min-median)
+    dead column   column sum below --dead-col-fraction of the median column sum
+
+Pixel coordinates are sensor coordinates as stored in the ROOT file, i.e. without the
+bb "320-Y" display flip. Masks are written as producer sections that can be merged
+into the configs written by configs/config_generator_*DUT.py:
+
+    [Producer.MOSSRAISER_0]
+    bb_region2_PIXEL_MASK = [(12, 200), (100, 3)]
+    bb_region2_COLUMN_MASK = [57]
+    [Producer.ALPIDE_plane_1]
+    PIXEL_MASK = [(511, 12)]
+
+    python pixel_mask.py run*.root -o masks.conf
+    python pixel_mask.py --cube cube/ --merge ../configs/kek-2MOSS_region_scan.conf
+"""
+import argparse
+import configparser
+import os
+
+import numpy as np
+
+import hitmap_reader
+from plot_batch import collect_root_files
+
+MAD_TO_SIGMA = 1.4826
+# expected number of Poisson zeros per region allowed before flagging dead pixels: exp(-DEAD_MARGIN)
+DEAD_MARGIN = 5.0
+
+
+def dead_threshold(n_pixels, margin=DEAD_MARGIN):
+    """Median hits above which a pixel without hits is significant (ln(n_pixels) + margin, ~16 for 256x256)"""
+    return np.log(n_pixels) + margin
+
+
+def find_bad_pixels(hitmap, n_mad=10.0, min_hits=10, dead_min_median=None, dead_col_fraction=0.1):
+    """Return (hot, dead, dead_columns) for one hitmap shaped (nx, ny).
+    hot/dead are (n, 2) arrays of (x, y), dead_columns an array of x.
+    dead_min_median defaults to dead_threshold() of the hitmap size."""
+    values = np.nan_to_num(np.asarray(hitmap, dtype=np.float64))
+    median = np.median(values)
+    mad = np.median(np.abs(values - median)) * MAD_TO_SIGMA
+    sigma = max(mad, np.sqrt(max(median, 1.0)))
+    hot = np.argwhere((values > median + n_mad * sigma) & (values >= min_hits))
+
+    if dead_min_median is None:
+        dead_min_median = dead_threshold(values.size)
+    dead = np.argwhere(values == 0) if median > dead_min_median else np.empty((0, 2), dtype=int)
+
+    column_sums = values.sum(axis=1)
+    median_column = np.median(column_sums)
+    dead_columns = np.flatnonzero(column_sums < dead_col_fraction * median_column) if median_column > 0 \
+        else np.empty(0, dtype=int)
+    # pixels of dead columns are reported via the column
+    if dead_columns.size and dead.size:
+        dead = dead[~np.isin(dead[:, 0], dead_columns)]
+    return hot, dead, dead_columns
+
+
+def stack_runs(root_files):
+    """{Detector: summed hitmap (as stored, no bb flip)} over all runs"""
+    stacked = {}
+    for root_file_path in root_files:
+        with hitmap_reader.HitmapReader(root_file_path) as reader:
+            for detector in reader.detectors():
+                values = reader.hitmap(detector, flip_bb=False).values
+                stacked[detector] = stacked[detector] + values if detector in stacked else values.astype(np.float64)
+    return stacked
+
+
+def stack_cube(cube_dir):
+    """Same as stack_runs, from a hitmap_cube directory (babyMOSS only)"""
+    from hitmap_cube import HitmapCube
+    cube = HitmapCube(cube_dir)
+    stacked = {}
+    for unit, data in cube.data.items():
+        summed = np.nansum(data, axis=0)
+        measured = np.isfinite(data).any(axis=(0, 3, 4))   # (det, region) present in some run
+        for det_position, det_index in enumerate(cube.det_indices):
+            for region in range(summed.shape[1]):
+                if not measured[det_position, region]:
+                    continue
+                name = f"cube_{unit}_reg{region}_{det_index}"
+                stacked[hitmap_reader.Detector(name, "babyMOSS", det_index, unit, region)] = \
+                    summed[det_position, region]
+    return stacked
+
+
+def producer_section(detector):
+    if detector.kind == "ALPIDE":
+        return f"Producer.ALPIDE_plane_{detector.det_index}"
+    return f"Producer.MOSSRAISER_{detector.det_index}"
+
+
+def key_prefix(detector):
+    return "" if detector.kind == "ALPIDE" else f"{detector.unit}_region{detector.region}_"
+
+
+def _format_pixels(pixels):
+    return "[" + ", ".join(f"({x}, {y})" for x, y in pixels) + "]"
+
+
+def build_masks(stacked, include_dead=False, **kwargs):
+    """{section: {key: value}} with PIXEL_MASK (hot, optionally dead) and COLUMN_MASK entries"""
+    masks = {}
+    for detector, values in sorted(stacked.items(), key=lambda item: item[0].name):
+        hot, dead, dead_columns = find_bad_pixels(values, **kwargs)
+        print(f"{detector.name:<30} hot {len(hot):5d}   dead {len(dead):6d}   dead columns {len(dead_columns):4d}")
+        pixels = np.concatenate([hot, dead]) if include_dead else hot
+        section = masks.setdefault(producer_section(detector), {})
+        prefix = key_prefix(detector)
+        if len(pixels):
+            section[f"{prefix}PIXEL_MASK"] = _format_pixels(pixels.tolist())
+        if include_dead and len(dead_columns):
+            section[f"{prefix}COLUMN_MASK"] = "[" + ", ".join(str(x) for x in dead_columns.tolist()) + "]"
+    return {section: keys for section, keys in masks.items() if keys}
+
+
+def _new_config():
+    # same parser settings as configs/config_generator_*DUT.py
+    config = configparser.ConfigParser(allow_no_value=True, delimiters=("=", ":"))
+    config.optionxform = str
+    return config
+
+
+def write_masks(masks, output_path):
+    config = _new_config()
+    for section, keys in masks.items():
+        config[section] = keys
+    with open(output_path, "w") as file:
+        config.write(file, space_around_delimiters=False)
+    print(f"Saved as {output_path}")
+
+
+def merge_masks(masks, conf_path, output_path):
+    """Merge masks into the producer sections of an existing EUDAQ .conf"""
+    config = _new_config()
+    config.read(conf_path)
+    for section, keys in masks.items():
+        if section not in config:
+            print(f"Section [{section}] not found in {conf_path}, skipped.")
+            continue
+        for key, value in keys.items():
+            config[section][key] = value
+    with open(output_path, "w") as file:
+        config.write(file, space_around_delimiters=False)
+    print(f"Saved as {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find hot/dead pixels in hitmaps and write producer masks",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="ROOT file(s), glob(s) or directories; several runs are stacked")
+    parser.add_argument("--cube", help="use a hitmap_cube directory instead of ROOT files (babyMOSS only)")
+    parser.add_argument("--n-mad", type=float, default=10.0, help="hot threshold in robust sigmas above the median")
+    parser.add_argument("--min-hits", type=int, default=10, help="minimum hits for a hot pixel")
+    parser.add_argument("--dead-min-median", type=float, default=None,
+                        help="only flag dead pixels when the median pixel has more hits than this "
+                             f"(default: ln(pixels per region) + {DEAD_MARGIN:g}, ~16 for 256x256)")
+    parser.add_argument("--dead-col-fraction", type=float, default=0.1,
+                        help="dead column if its hits are below this fraction of the median column")
+    parser.add_argument("--include-dead", action="store_true", help="also mask dead pixels and columns")
+    parser.add_argument("-o", "--output", default="masks.conf", help="mask sections output")
+    parser.add_argument("--merge", help="EUDAQ .conf to merge the masks into (written as <name>_masked.conf)")
+    args = parser.parse_args()
+
+    if args.cube:
+        stacked = stack_cube(args.cube)
+    else:
+        root_files = collect_root_files(args.inputs)
+        if not root_files:
+            parser.error("no input ROOT files")
+        stacked = stack_runs(root_files)
+
+    masks = build_masks(stacked, include_dead=args.include_dead, n_mad=args.n_mad, min_hits=args.min_hits,
+                        dead_min_median=args.dead_min_median, dead_col_fraction=args.dead_col_fraction)
+    write_masks(masks, args.output)
+    if args.merge:
+        merge_masks(masks, args.merge, f"{os.path.splitext(args.merge)[0]}_masked.conf")
@@ -0,0 +1,98 @@
+"""
+Batch helpers shared by hitmap.py and projection.py
+    collect ROOT files from paths, globs or directories
+    skip runs whose figures are newer than the ROOT file
+    fan the remaining runs out over a process pool (ROOT in batch mode)
+"""
+import glob
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def collect_root_files(inputs):
+    """Expand files, glob patterns and directories into a sorted list of ROOT files"""
+    root_files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            root_files.update(glob.glob(os.path.join(item, "*.root")))
+        elif any(char in item for char in "*?["):
+            root_files.update(glob.glob(item))
+        elif os.path.isfile(item):
+            root_files.add(item)
+        else:
+            print(f"No such file or directory: {item}")
+    return sorted(os.path.abspath(path) for path in root_files)
+
+
+def run_name(root_file_path):
+    """Run name used as figure prefix, e.g. run123456_240905123456"""
+    return os.path.splitext(os.path.basename(root_file_path))[0]
+
+
+def find_outputs(output_pattern, directory="./fig"):
+    """Files in directory whose whole name matches the regex output_pattern"""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if re.fullmatch(output_pattern, name)]
+
+
+def is_up_to_date(root_file_path, output_pattern):
+    """True if at least one output matches and every output is newer than the ROOT file"""
+    outputs = find_outputs(output_pattern)
+    if not outputs:
+        return False
+    input_mtime = os.path.getmtime(root_file_path)
+    return all(os.path.getmtime(output) > input_mtime for output in outputs)
+
+
+def _timed_call(plot_func, root_file_path):
+    start = time.perf_counter()
+    try:
+        plot_func(root_file_path)
+        error = None
+    except Exception as e:  # keep the other runs going
+        error = f"{type(e).__name__}: {e}"
+    return root_file_path, time.perf_counter() - start, error
+
+
+def run_batch(plot_func, root_files, output_pattern, jobs=None, force=False, initializer=None):
+    """Run plot_func(root_file) for every ROOT file on a process pool.
+
+    output_pattern(root_file) gives a regex of the names of the figures a run produces in ./fig
+    (exact, so that run1 does not pick up the figures of run1_2 or run10); runs whose
+    figures are all newer than the input are skipped unless force is set.
+    initializer is called once per worker (set ROOT batch mode and styles there).
+    Returns a list of (root_file, seconds, error) for the processed runs."""
+    todo = []
+    for root_file in root_files:
+        if not force and is_up_to_date(root_file, output_pattern(root_file)):
+            print(f"[skip] {run_name(root_file)}: outputs are up to date")
+        else:
+            todo.append(root_file)
+    if not todo:
+        return []
+
+    os.makedirs("./fig", exist_ok=True)
+    jobs = jobs or min(len(todo), os.cpu_count() or 1)
+    print(f"Processing {len(todo)} file(s) on {jobs} worker(s)")
+
+    results = []
+    start = time.perf_counter()
+    # spawn: a fresh interpreter per worker, PyROOT does not like being forked
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=initializer) as pool:
+        futures = [pool.submit(_timed_call, plot_func, root_file) for root_file in todo]
+        for future in as_completed(futures):
+            root_file, seconds, error = future.result()
+            status = "FAILED " + error if error else "done"
+            print(f"[{seconds:7.2f} s] {run_name(root_file)}: {status}")
+            results.append((root_file, seconds, error))
+
+    total = time.perf_counter() - start
+    failed = sum(1 for _, _, error in results if error)
+    print(f"Total {total:.2f} s for {len(results)} file(s), {failed} failed")
+    return results
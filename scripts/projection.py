@@ -1,9 +1,16 @@
-import ROOT
-import sys
-
-def plot_projection(root_file_path):
+import argparse
+import functools
+import os
+import re
+import hitmap_reader
+from plot_batch import collect_root_files, run_batch, run_name
+# PyROOT은 import에 수 초가 걸리므로 ROOT backend를 쓸 때만 함수 안에서 불러온다
+
+def plot_projection(root_file_path, draw=True):
+    import ROOT
     # ROOT 파일 열기
     root_file = ROOT.TFile.Open(root_file_path)
+    root_file_name = run_name(root_file_path)
     if not root_file or root_file.IsZombie():
         print(f"Failed to open {root_file_path}")
         return
@@ -35,20 +42,16 @@ def plot_projection(root_file_path):
             canvas.cd()
             projection.Draw("HIST")
             canvas.Update()
-            canvas.SaveAs(f"./fig/projY_{detector_name}.pdf")
+            canvas.SaveAs(f"./fig/projY_{root_file_name}_{detector_name}.pdf")
 
         # babyMOSS의 경우 처리
         elif "reg" in detector_name:
-            det_index = int(detector_name.split('_')[-1])
-            reg_index = int(detector_name.split('_reg')[1].split('_')[0])
+            detector = hitmap_reader.parse_detector_name(detector_name)
+            det_index, reg_index = detector.det_index, detector.pad_index
 
             projection_name = f"h_hitYmap_{detector_name}"
             projection = detector_dir.Get(projection_name)
-            if "bb" in detector_name: 
-                projection.SetTitle(f"BB_reg{reg_index}")
-                reg_index = reg_index + 4
-            else:
-                projection.SetTitle(f"TB_reg{reg_index}")
+            projection.SetTitle(detector.title)
 
             babyMOSS_projection[(det_index, reg_index)] = projection
 
@@ -72,8 +75,9 @@ def plot_projection(root_file_path):
             #ROOT.gPad.SetLogy()
         
         # 각 detector별 canvas 저장
-        _canvas.SaveAs(f"./fig/projY_babyMOSS_{det_index}_lin.pdf")
-        _canvas.Draw()
+        _canvas.SaveAs(f"./fig/projY_{root_file_name}_babyMOSS_{det_index}_lin.pdf")
+        if draw:
+            _canvas.Draw()
 
             
 
@@ -82,14 +86,67 @@ def plot_projection(root_file_path):
     root_file.Close()
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python plot_projection.py <input_root_file>")
-        sys.exit(1)
+def plot_projection_mpl(root_file_path):
+    """Same figures as plot_projection, read with uproot and drawn with matplotlib (no ROOT import)"""
+    import mpl_draw
+    root_file_name = run_name(root_file_path)
+    babyMOSS_projection = {}
+    with hitmap_reader.HitmapReader(root_file_path) as reader:
+        for detector in reader.detectors():
+            projection = reader.projection_y(detector)
+            if detector.kind == "ALPIDE":
+                mpl_draw.save_single(projection, mpl_draw.draw_hist1d,
+                                     f"./fig/projY_{root_file_name}_{detector.name}.pdf", figsize=(5, 4))
+            else:
+                babyMOSS_projection[(detector.det_index, detector.pad_index)] = projection._replace(title=detector.title)
+
+    for det_index in sorted(set(det for det, reg in babyMOSS_projection)):
+        hists_by_pad = {reg: hist for (det, reg), hist in babyMOSS_projection.items() if det == det_index}
+        mpl_draw.save_babymoss_grid(hists_by_pad, mpl_draw.draw_hist1d,
+                                    f"./fig/projY_{root_file_name}_babyMOSS_{det_index}_lin.pdf", figsize=(16, 8))
 
-    root_file_path = sys.argv[1]
 
+def _set_style():
+    import ROOT
     ROOT.gStyle.SetOptStat(11)       # 원하는 statbox 옵션 설정 (e.g., 1110: entries, mean, RMS)
     #ROOT.gStyle.SetStatFillStyle(0)        # statbox 배경 투명하게 (0 = 투명)
 
-    plot_projection(root_file_path)
+
+def _init_batch_worker():
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    _set_style()
+
+
+def _plot_batch(root_file_path, backend="root"):
+    if backend == "mpl":
+        plot_projection_mpl(root_file_path)
+    else:
+        plot_projection(root_file_path, draw=False)
+
+
+def _outputs(root_file_path):
+    return rf"projY_{re.escape(run_name(root_file_path))}_(ALPIDE\w*|babyMOSS_\d+_lin)\.pdf"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw Y projections of ALPIDE and babyMOSS hitmaps from ROOT files")
+    parser.add_argument("inputs", nargs="+", help="ROOT file(s), glob(s) or directories (directories/globs imply --batch)")
+    parser.add_argument("-b", "--batch", action="store_true", help="process all inputs on a process pool, ROOT in batch mode")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true", help="redraw even if the figures are newer than the ROOT file")
+    parser.add_argument("--backend", choices=["root", "mpl"], default="root",
+                        help="root: PyROOT + TCanvas, mpl: uproot + matplotlib (fast start-up, no ROOT needed)")
+    args = parser.parse_args()
+
+    root_files = collect_root_files(args.inputs)
+    if args.batch or len(root_files) != 1 or os.path.isdir(args.inputs[0]):
+        initializer = _init_batch_worker if args.backend == "root" else None
+        run_batch(functools.partial(_plot_batch, backend=args.backend), root_files, _outputs,
+                  jobs=args.jobs, force=args.force, initializer=initializer)
+    elif args.backend == "mpl":
+        os.makedirs("./fig", exist_ok=True)
+        plot_projection_mpl(root_files[0])
+    else:
+        _set_style()
+        plot_projection(root_files[0])
@@ -0,0 +1,104 @@
+"""
+Single-pass run report: hitmaps, Y projections and computed X projections of
+every ALPIDE plane and babyMOSS unit in one multi-page PDF per run, plus a
+per-detector summary table (total hits, mean occupancy, hottest pixel).
+Each ROOT file is opened once and its Hitmaps directory walked once.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import hitmap_reader
+from plot_batch import collect_root_files, run_name
+
+
+def summarize(detector, hitmap):
+    """Summary row of one detector; pixel coordinates as stored in the file (no bb flip)"""
+    values = hitmap.values
+    hot_x, hot_y = np.unravel_index(np.argmax(values), values.shape)
+    return {
+        "detector": detector.name,
+        "title": detector.title,
+        "total_hits": float(values.sum()),
+        "mean_occupancy": float(values.mean()),    # hits per pixel
+        "fired_pixels": int(np.count_nonzero(values)),
+        "hottest_x": int(hot_x),
+        "hottest_y": int(hot_y),
+        "hottest_hits": float(values[hot_x, hot_y]),
+    }
+
+
+def make_report(root_file_path, outdir="./fig"):
+    """Write <outdir>/<run>_report.pdf and <run>_summary.csv, return (summary DataFrame, I/O counters)"""
+    import mpl_draw
+    from matplotlib.backends.backend_pdf import PdfPages
+    import matplotlib.pyplot as plt
+
+    root_file_name = run_name(root_file_path)
+    rows = []
+    babyMOSS = {}  # det_index -> {pad_index: (hitmap, projY)}
+
+    with hitmap_reader.HitmapReader(root_file_path) as reader, \
+            PdfPages(os.path.join(outdir, f"{root_file_name}_report.pdf")) as pdf:
+        for detector in reader.detectors():
+            hitmap, projection = reader.read_detector(detector)
+            rows.append(summarize(detector, hitmap))
+
+            if detector.unit == "bb":
+                hitmap = hitmap_reader.flip_y(hitmap)
+            if detector.kind == "ALPIDE":
+                fig, axes = plt.subplots(1, 3, figsize=(18, 5), gridspec_kw={"width_ratios": [2, 1, 1]})
+                mpl_draw.draw_hist2d(axes[0], hitmap)
+                mpl_draw.draw_hist1d(axes[1], projection._replace(title=f"{detector.name} Y projection"))
+                mpl_draw.draw_hist1d(axes[2], hitmap_reader.projection_x(hitmap)._replace(title=f"{detector.name} X projection"))
+                fig.tight_layout()
+                pdf.savefig(fig)
+                plt.close(fig)
+            else:
+                babyMOSS.setdefault(detector.det_index, {})[detector.pad_index] = (
+                    hitmap._replace(title=detector.title), projection._replace(title=detector.title))
+
+        for det_index in sorted(babyMOSS):
+            pads = babyMOSS[det_index]
+            pages = (
+                ("hitmaps", mpl_draw.draw_hist2d, {pad: hists[0] for pad, hists in pads.items()}),
+                ("Y projections", mpl_draw.draw_hist1d, {pad: hists[1] for pad, hists in pads.items()}),
+                ("X projections", mpl_draw.draw_hist1d,
+                 {pad: hitmap_reader.projection_x(hists[0]) for pad, hists in pads.items()}),
+            )
+            for label, draw_func, hists_by_pad in pages:
+                fig, axes = plt.subplots(2, 4, figsize=(20, 10))
+                for pad_index, ax in enumerate(axes.flat):
+                    if pad_index in hists_by_pad:
+                        draw_func(ax, hists_by_pad[pad_index])
+                    else:
+                        ax.axis("off")
+                fig.suptitle(f"{root_file_name} babyMOSS {det_index} {label}")
+                fig.tight_layout()
+                pdf.savefig(fig)
+                plt.close(fig)
+
+        counters = dict(reader.counters)
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(outdir, f"{root_file_name}_summary.csv"), index=False)
+    return summary, counters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="One-pass hitmap + projection report per run")
+    parser.add_argument("inputs", nargs="+", help="ROOT file(s), glob(s) or directories")
+    parser.add_argument("-o", "--outdir", default="./fig", help="output directory")
+    args = parser.parse_args()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    for root_file_path in collect_root_files(args.inputs):
+        start = time.perf_counter()
+        summary, counters = make_report(root_file_path, args.outdir)
+        print(f"===== {run_name(root_file_path)} ({time.perf_counter() - start:.2f} s) =====")
+        with pd.option_context("display.width", 200, "display.max_rows", None):
+            print(summary.to_string(index=False, float_format="{:.4g}".format))
+        print("I/O: " + ", ".join(f"{key}={value}" for key, value in counters.items()))
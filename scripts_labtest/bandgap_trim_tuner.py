@@ -0,0 +1,167 @@
+"""
+Closed-loop bandgap trimming
+
+For every region of every half-unit, searches the 4 bit trim codes so that the references
+measured through the monitoring mux and ADC (as log_trim_and_ref.py) come closest to a target:
+
+    TRIM_volt  ->  VBGR (only with --vbgr)
+    TRIM_curr  ->  IREF
+
+The search starts at the code set by trim_all_bandgaps(), gallops away from it until the target
+is bracketed and bisects the bracket, so that typically 2-4 of the 16 codes are measured.
+The tuned codes stay set and are printed as in the run control configs (configs/*.conf),
+byte = TRIM_volt << 4 | TRIM_curr. The run control names the half-units the other way round
+than moss_test (RUN_CONTROL_UNIT): the codes logged for moss_test unit tb of babyMOSS-2_4_W21D4,
+0xBF 0x8D 0xBC 0x8A, are its bb_BANDGAP_TRIM in configs/kek-2MOSS_region_scan.conf:
+
+    ##### babyMOSS-2_4_W21D4 ######
+    tb_BANDGAP_TRIM = [0x8C, 0x8B, 0x8C, 0x9B]
+    bb_BANDGAP_TRIM = [0xBF, 0x8D, 0xBC, 0x8A]
+
+    python bandgap_trim_tuner.py --ts-configs tb_configs/ts_config_raiser_2_4_W21D4.json5 --iref 10.0 -o trims.json
+    python bandgap_trim_tuner.py --stub --ts-configs ts_config_raiser_2_4_W21D4.json5 --vbgr 0.25 --adaptive
+"""
+import argparse
+import json
+import time
+
+from log_trim_and_ref import (
+    IMuxSelect, VMuxSelect, _measure_reference, add_sampling_arguments, get_test_system_class, power_on_if_needed,
+    sampling_from_args, DEFAULT_CFG_PATH,
+)
+
+TRIM_CODES = 16
+# the references are assumed to rise with their trim code
+TRIM_INCREASING = {"volt": True, "curr": True}
+# moss_test unit name -> prefix of the same half-unit in the run control configs
+RUN_CONTROL_UNIT = {"tb": "bb", "bb": "tb"}
+
+
+def encode_trim(volt: int, curr: int) -> int:
+    return (volt << 4) | curr
+
+
+def config_line(unit: str, trims: list[tuple[int, int]]) -> str:
+    """BANDGAP_TRIM line of the run control config for the moss_test unit"""
+    return f"{RUN_CONTROL_UNIT[unit]}_BANDGAP_TRIM = {format_trims(trims)}"
+
+
+def format_trims(trims: list[tuple[int, int]]) -> str:
+    """[(volt, curr)] per region -> '[0x8C, 0x8B, 0x8C, 0x9B]'"""
+    return "[" + ", ".join(f"0x{encode_trim(volt, curr):02X}" for volt, curr in trims) + "]"
+
+
+def search_code(measure, target: float, start: int = None, n_codes: int = TRIM_CODES, increasing: bool = True):
+    """Code in [0, n_codes) whose measure(code) is closest to target, for measure() monotonic in the code.
+    Finds the first code at or above the target (galloping from start if given, then bisecting)
+    and picks it or the code below. Returns (code, {code: value} of the measured codes)."""
+    measured = {}
+
+    def above(code):
+        if code not in measured:
+            measured[code] = measure(code)
+        return measured[code] >= target if increasing else measured[code] <= target
+
+    # answer in [low, high]; codes below low are below the target, codes from high on are not
+    low, high = 0, n_codes
+    if start is not None:
+        step = 1
+        if above(start):
+            high = start
+            while high > 0:
+                probe = max(start - step, 0)
+                if not above(probe):
+                    low = probe + 1
+                    break
+                high = probe
+                step *= 2
+        else:
+            low = start + 1
+            while low < n_codes:
+                probe = min(start + step, n_codes - 1)
+                if above(probe):
+                    high = probe
+                    break
+                low = probe + 1
+                step *= 2
+    while low < high:
+        middle = (low + high) // 2
+        if above(middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    candidates = [code for code in (low - 1, low) if 0 <= code < n_codes]
+    for code in candidates:
+        above(code)
+    best = min(candidates, key=lambda code: abs(measured[code] - target))
+    return best, measured
+
+
+def tune_region(moss, region: int, targets: dict, sampling=None) -> dict:
+    """Tune TRIM_volt against VBGR, then TRIM_curr against IREF (IREF is derived from the bandgap)"""
+    volt, curr = moss.get_dac_trimming(region)
+    result = {"Region": region, "Initial": {"TRIM_volt": volt, "TRIM_curr": curr}}
+    for reference, mux, field in (("VBGR", VMuxSelect.VBGR, "volt"), ("IREF", IMuxSelect.IREF, "curr")):
+        if targets.get(reference) is None:
+            continue
+
+        def measure(code):
+            moss.set_dac_trimming(region, code if field == "volt" else volt, code if field == "curr" else curr)
+            return _measure_reference(moss, mux, region, sampling)["Mean"]
+
+        start = volt if field == "volt" else curr
+        code, measured = search_code(measure, targets[reference], start, increasing=TRIM_INCREASING[field])
+        if field == "volt":
+            volt = code
+        else:
+            curr = code
+        result[reference] = {
+            "Target": targets[reference], "Mean": measured[code],
+            "Measured": {str(code): value for code, value in sorted(measured.items())},
+        }
+    moss.set_dac_trimming(region, volt, curr)
+    result["TRIM_volt"], result["TRIM_curr"] = volt, curr
+    return result
+
+
+def tune_chip(ts, targets: dict, sampling=None) -> dict:
+    """{unit: [per-region result]} of one initialized test system"""
+    power_on_if_needed(ts)
+    return {moss.name(): [tune_region(moss, region, targets, sampling) for region in range(4)]
+            for moss in ts.get_all_moss_unit_if()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the bandgap trims against measured VBGR / IREF targets",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--ts-configs", nargs="+", default=[DEFAULT_CFG_PATH], help="ts_config of every chip")
+    parser.add_argument("--vbgr", type=float, default=None, help="VBGR target (V), TRIM_volt is kept if not given")
+    parser.add_argument("--iref", type=float, default=10.0, help="IREF target (uA)")
+    parser.add_argument("-o", "--output", default=None, help="write all measured codes and results as json")
+    add_sampling_arguments(parser)
+    args = parser.parse_args()
+
+    targets = {"VBGR": args.vbgr, "IREF": args.iref}
+    sampling = sampling_from_args(args)
+    test_system_class = get_test_system_class(args.stub)
+    all_results = {}
+    for ts_config in args.ts_configs:
+        start = time.perf_counter()
+        ts = test_system_class.from_config_file(ts_config)
+        ts.initialize()
+        results = tune_chip(ts, targets, sampling)
+        all_results[ts.moss_chip_id] = results
+        n_measured = sum(len(region.get(reference, {}).get("Measured", {}))
+                         for unit_results in results.values() for region in unit_results for reference in targets)
+        print(f"##### {ts.moss_chip_id} ###### ({n_measured} codes measured in {time.perf_counter() - start:.1f} s)")
+        for unit, unit_results in sorted(results.items(), key=lambda item: RUN_CONTROL_UNIT[item[0]], reverse=True):
+            print(config_line(unit, [(r['TRIM_volt'], r['TRIM_curr']) for r in unit_results]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"targets": targets, "results": all_results}, f, indent=4)
+        print(f"Saved as {args.output}")
+
+
+if __name__ == "__main__":
+    main()
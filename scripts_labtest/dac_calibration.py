@@ -0,0 +1,279 @@
+"""
+DAC transfer-curve calibration: DAC code -> volt / current per chip, half-unit and region
+
+Every selected DAC is swept over its codes and read back through the monitoring mux and
+ADC (as log_trim_and_ref.py). Voltage DACs of all 4 regions are swept together: the mux of
+every region is set once, and each code is set on all regions before a single settle wait,
+after which the 4 regions are read. Current DACs share one monitoring pad, so their regions
+are swept one after the other, with one mux switch per region.
+
+All curves of a chip are fitted at once (offset + gain * code on the linear range, which
+excludes saturated ends) and stored as a new version of the chip's calibration table:
+
+    dac_calibration/<chip>/v<NNN>.json
+    {"chip": ..., "version": 3, "time": ..., "codes": {"VCASB": [...]},
+     "units": {"tb": {"VCASB": {"quantity": "V", "regions": [{"values": [...], "stdev": [...],
+                                 "offset": ..., "gain": ..., "linear_range": [lo, hi], "rms": ..., "inl_max": ...}]}}}}
+
+load_calibration(chip) returns the latest table (or a given version) without touching the chip;
+DacCalibration.to_physical() interpolates the measured points.
+
+    python dac_calibration.py measure --ts-configs tb_configs/ts_config_raiser_2_4_W21D4.json5 --dacs VCASB VCASN --step 4
+    python dac_calibration.py list  babyMOSS-2_4_W21D4
+    python dac_calibration.py show  babyMOSS-2_4_W21D4 --version 2
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dac_calibration")
+DAC_CODES = 256
+# a point is in the linear range if a neighbouring segment has at least this fraction of the median slope
+LINEAR_SLOPE_FRACTION = 0.8
+
+
+def sweep_codes(step: int, n_codes: int = DAC_CODES) -> list[int]:
+    codes = list(range(0, n_codes, step))
+    return codes if codes[-1] == n_codes - 1 else codes + [n_codes - 1]
+
+
+def fit_transfer_curves(codes, values):
+    """Straight-line fits of many curves at once.
+    codes (K,), values (N, K) -> dict of (N,) arrays: offset, gain, rms, inl_max (LSB), and the
+    (N, K) mask of the points in the linear range"""
+    x = np.asarray(codes, dtype=float)
+    y = np.asarray(values, dtype=float)
+    slopes = np.diff(y, axis=1) / np.diff(x)
+    median = np.nanmedian(slopes, axis=1, keepdims=True)
+    good_segment = np.nan_to_num(slopes / median, nan=0.0) >= LINEAR_SLOPE_FRACTION
+    linear = np.zeros(y.shape, dtype=bool)
+    linear[:, :-1] |= good_segment
+    linear[:, 1:] |= good_segment
+    linear &= np.isfinite(y)
+
+    w = linear.astype(float)
+    y0 = np.where(linear, y, 0.0)
+    sw, sx, sy = w.sum(axis=1), (w * x).sum(axis=1), (w * y0).sum(axis=1)
+    sxx, sxy = (w * x * x).sum(axis=1), (w * x * y0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gain = (sw * sxy - sx * sy) / (sw * sxx - sx * sx)
+        offset = (sy - gain * sx) / sw
+        residual = np.where(linear, y - (offset[:, None] + gain[:, None] * x), np.nan)
+        rms = np.sqrt(np.nanmean(residual ** 2, axis=1))
+        inl_max = np.nanmax(np.abs(residual), axis=1) / np.abs(gain)
+    return {"offset": offset, "gain": gain, "rms": rms, "inl_max": inl_max, "linear": linear}
+
+
+def _versions(chip_dir):
+    versions = []
+    for path in glob.glob(os.path.join(chip_dir, "v*.json")):
+        match = re.fullmatch(r"v(\d+)\.json", os.path.basename(path))
+        if match:
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+
+def list_versions(chip: str, calibration_dir: str = DEFAULT_DIR) -> list[int]:
+    return _versions(os.path.join(calibration_dir, chip))
+
+
+def save_calibration(table: dict, calibration_dir: str = DEFAULT_DIR) -> str:
+    """Store table as the next version of its chip; existing versions are never overwritten"""
+    chip_dir = os.path.join(calibration_dir, table["chip"])
+    os.makedirs(chip_dir, exist_ok=True)
+    versions = _versions(chip_dir)
+    table["version"] = versions[-1] + 1 if versions else 1
+    path = os.path.join(chip_dir, f"v{table['version']:03d}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(table, f, indent=1)
+    os.link(tmp_path, path)  # fails if the version was taken meanwhile
+    os.remove(tmp_path)
+    return path
+
+
+class DacCalibration:
+
+    def __init__(self, table: dict):
+        self.table = table
+        self.chip = table["chip"]
+        self.version = table["version"]
+
+    def dacs(self, unit: str) -> list[str]:
+        return sorted(self.table["units"].get(unit, {}))
+
+    def quantity(self, unit: str, dac: str) -> str:
+        return self.table["units"][unit][dac]["quantity"]
+
+    def region(self, unit: str, region: int, dac: str) -> dict:
+        return self.table["units"][unit][dac]["regions"][region]
+
+    def to_physical(self, unit: str, region: int, dac: str, code):
+        """Volt / uA of code (scalar or array): interpolated between the measured codes"""
+        curve = self.region(unit, region, dac)
+        result = np.interp(np.asarray(code, dtype=float), self.table["codes"][dac], curve["values"])
+        return float(result) if np.ndim(result) == 0 else result
+
+    def to_code(self, unit: str, region: int, dac: str, value):
+        """Inverse of to_physical on the linear range (linear fit)"""
+        curve = self.region(unit, region, dac)
+        return (np.asarray(value, dtype=float) - curve["offset"]) / curve["gain"]
+
+
+def load_calibration(chip: str, version: int = None, calibration_dir: str = DEFAULT_DIR) -> DacCalibration | None:
+    """Latest (or the given) calibration table of chip, None if there is none"""
+    versions = list_versions(chip, calibration_dir)
+    if not versions or (version is not None and version not in versions):
+        return None
+    version = versions[-1] if version is None else version
+    with open(os.path.join(calibration_dir, chip, f"v{version:03d}.json")) as f:
+        return DacCalibration(json.load(f))
+
+
+# measurement part, needs the test system (or moss_stub.py)
+
+def _set_dac(moss, region, dac, code):
+    # the only DAC write of this script: MossUnitIF.set_dac(region, MossDac, code)
+    moss.set_dac(region, dac, code)
+
+
+def _read_after_settling(moss, is_current, region, sampling):
+    """Fixed procedure: read right away (the caller waited SETTLE_TIME once for all regions)"""
+    from log_trim_and_ref import NUM_SAMPLES, _sample, _sample_adaptive, _wait_settled  # pylint: disable=import-outside-toplevel
+    if sampling is None:
+        return _sample(moss, is_current, region, NUM_SAMPLES)
+    _wait_settled(moss, is_current, region, sampling)
+    mean, stdev, _ = _sample_adaptive(moss, is_current, region, sampling)
+    return mean, stdev
+
+
+def sweep_unit(moss, dacs, codes, sampling=None, regions=range(4)):
+    """{dac: (values (regions, codes), stdev (regions, codes))} of one half-unit"""
+    from log_trim_and_ref import (  # pylint: disable=import-outside-toplevel
+        SETTLE_TIME, IMuxSelect, MossRegion, _set_moss_monitoring_multiplexer,
+    )
+    regions = list(regions)
+    sweeps = {}
+    for dac in dacs:
+        values = np.full((len(regions), len(codes)), np.nan)
+        stdev = np.full_like(values, np.nan)
+        is_current = dac.name in IMuxSelect.__members__
+        # voltage DACs: all regions at once; current DACs: one region at a time on the shared pad
+        groups = [[i] for i in range(len(regions))] if is_current else [list(range(len(regions)))]
+        for group in groups:
+            for i in group:
+                _set_moss_monitoring_multiplexer(moss, dac, regions[i])
+            for k, code in enumerate(codes):
+                for i in group:
+                    _set_dac(moss, regions[i], dac, code)
+                if sampling is None:
+                    time.sleep(SETTLE_TIME)
+                for i in group:
+                    values[i, k], stdev[i, k] = _read_after_settling(moss, is_current, regions[i], sampling)
+        sweeps[dac.name] = (values, stdev)
+    moss.set_default_dacs(MossRegion.ALL_REGIONS)
+    return sweeps
+
+
+def calibrate_chip(ts, dac_names, codes, sampling=None) -> dict:
+    """Sweep and fit every selected DAC of both half-units; returns the (unsaved) table"""
+    from log_trim_and_ref import IMuxSelect, MossDac, power_on_if_needed  # pylint: disable=import-outside-toplevel
+    power_on_if_needed(ts)
+    dacs = [MossDac[name] for name in dac_names]
+    table = {"chip": ts.moss_chip_id, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+             "codes": {dac.name: list(codes) for dac in dacs}, "units": {}}
+    sweeps = {moss.name(): sweep_unit(moss, dacs, codes, sampling) for moss in ts.get_all_moss_unit_if()}
+
+    # one fit for all curves of the chip
+    keys = [(unit, dac) for unit, unit_sweeps in sweeps.items() for dac in unit_sweeps]
+    values = np.concatenate([sweeps[unit][dac][0] for unit, dac in keys])
+    fits = fit_transfer_curves(codes, values)
+    row = 0
+    for unit, dac in keys:
+        unit_values, unit_stdev = sweeps[unit][dac]
+        regions = []
+        for i in range(len(unit_values)):
+            linear_codes = np.asarray(codes)[fits["linear"][row]]
+            regions.append({
+                "values": unit_values[i].tolist(), "stdev": unit_stdev[i].tolist(),
+                "offset": float(fits["offset"][row]), "gain": float(fits["gain"][row]),
+                "linear_range": [int(linear_codes.min()), int(linear_codes.max())] if len(linear_codes) else None,
+                "rms": float(fits["rms"][row]), "inl_max": float(fits["inl_max"][row]),
+            })
+            row += 1
+        table["units"].setdefault(unit, {})[dac] = {
+            "quantity": "uA" if dac in IMuxSelect.__members__ else "V", "regions": regions,
+        }
+    return table
+
+
+GAIN_UNITS = {"V": (1e3, "mV"), "uA": (1e3, "nA")}
+
+
+def print_table(calibration: DacCalibration):
+    print(f"{calibration.chip} v{calibration.version:03d} ({calibration.table['time']})")
+    print(f"{'unit':4s} {'DAC':7s} {'reg':>3s} {'offset':>9s} {'gain/LSB':>10s} {'linear':>9s} {'rms':>9s} {'INL LSB':>7s}")
+    for unit in sorted(calibration.table["units"]):
+        for dac in calibration.dacs(unit):
+            scale, gain_unit = GAIN_UNITS[calibration.quantity(unit, dac)]
+            for region, curve in enumerate(calibration.table["units"][unit][dac]["regions"]):
+                linear = "-" if curve["linear_range"] is None else "{}-{}".format(*curve["linear_range"])
+                print(f"{unit:4s} {dac:7s} {region:3d} {curve['offset']:9.4f} {curve['gain'] * scale:7.3f} {gain_unit:2s}"
+                      f" {linear:>9s} {curve['rms']:9.2e} {curve['inl_max']:7.2f}")
+
+
+def main():
+    from log_trim_and_ref import (  # pylint: disable=import-outside-toplevel
+        DEFAULT_CFG_PATH, add_sampling_arguments, get_test_system_class, sampling_from_args,
+    )
+    parser = argparse.ArgumentParser(description="DAC transfer-curve calibration tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    measure_parser = subparsers.add_parser("measure", help="sweep, fit and store a new calibration version",
+                                           formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    measure_parser.add_argument("--ts-configs", nargs="+", default=None, help="ts_config of every chip")
+    measure_parser.add_argument("--dacs", nargs="+", default=["VCASB", "VCASN", "VSHIFT", "IBIAS", "IBIASN", "IDB",
+                                                               "IRESET"])
+    measure_parser.add_argument("--step", type=int, default=8, help="code step of the sweep (last code always included)")
+    measure_parser.add_argument("--dir", default=DEFAULT_DIR, help="calibration tables directory")
+    add_sampling_arguments(measure_parser)
+    list_parser = subparsers.add_parser("list", help="stored versions of a chip")
+    list_parser.add_argument("chip")
+    list_parser.add_argument("--dir", default=DEFAULT_DIR)
+    show_parser = subparsers.add_parser("show", help="print the fits of a stored version")
+    show_parser.add_argument("chip")
+    show_parser.add_argument("--version", type=int, default=None, help="default: latest")
+    show_parser.add_argument("--dir", default=DEFAULT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for version in list_versions(args.chip, args.dir):
+            calibration = load_calibration(args.chip, version, args.dir)
+            print(f"v{version:03d}  {calibration.table['time']}  "
+                  + ", ".join(f"{unit}: {' '.join(calibration.dacs(unit))}" for unit in sorted(calibration.table["units"])))
+    elif args.command == "show":
+        calibration = load_calibration(args.chip, args.version, args.dir)
+        if calibration is None:
+            raise SystemExit(f"No calibration of {args.chip} in {args.dir}")
+        print_table(calibration)
+    else:
+        test_system_class = get_test_system_class(args.stub)
+        codes = sweep_codes(args.step)
+        for ts_config in args.ts_configs or [DEFAULT_CFG_PATH]:
+            start = time.perf_counter()
+            ts = test_system_class.from_config_file(ts_config)
+            ts.initialize()
+            table = calibrate_chip(ts, args.dacs, codes, sampling_from_args(args))
+            path = save_calibration(table, args.dir)
+            print(f"{ts.moss_chip_id}: {len(args.dacs)} DAC(s) x {len(codes)} codes in "
+                  f"{time.perf_counter() - start:.1f} s, saved as {path}")
+            print_table(load_calibration(ts.moss_chip_id, table["version"], args.dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,18 @@ Written by Meike
     do that for all regions
 
 Added csv converting part
+Folders are listed with os.scandir and parsed in parallel by scan_loader
+The ScanCollection of each region is looked up in the results index (results_index.py);
+the collection_folder entries below are only used for regions the index does not know
 """
 
-import json5
-import json
-import subprocess
 import sys
 import os
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from scan_loader import load_scan_collections
+from results_index import ResultsIndex
 
 base_path = "/home/hipex/MOSS_TEST_RESULTS/babyMOSS-2_4_W21D4"
 debug = False
@@ -126,53 +128,6 @@ region_collection_THR = {
 
 
 
-def read_files(config_fileName, results_fileName, measNameForJSON, debug):
-
-    with open(config_fileName) as config_json:
-
-        config_data = json.load(config_json)
-        #print(json_data.keys())
-        tb_VCASB = config_data['moss_dac_settings']['tb']['VCASB']
-        bb_VCASB = config_data['moss_dac_settings']['bb']['VCASB']
-        if(debug): print(f"tb VCASB: {tb_VCASB}")
-        if(debug): print(f"bb VCASB: {bb_VCASB}")
-            
-    with open(results_fileName) as results_json:
-
-        results_data = json5.load(results_json)
-        tb_results = results_data['tb'][measNameForJSON]
-        bb_results = results_data['bb'][measNameForJSON]
-        if(debug): print(f"tb {measNameForJSON}: {tb_results}")
-        if(debug): print(f"bb {measNameForJSON}: {bb_results}")
-        
-    # append
-    if(region == 'tb_reg0'):
-        folder_collection[region]["VCASB"].append(tb_VCASB[0])
-        folder_collection[region]["results"].append(tb_results[0])
-    elif(region == 'tb_reg1'):
-        folder_collection[region]["VCASB"].append(tb_VCASB[1])
-        folder_collection[region]["results"].append(tb_results[1])
-    elif(region == 'tb_reg2'):
-        folder_collection[region]["VCASB"].append(tb_VCASB[2])
-        folder_collection[region]["results"].append(tb_results[2])
-    elif(region == 'tb_reg3'):
-        folder_collection[region]["VCASB"].append(tb_VCASB[3])
-        folder_collection[region]["results"].append(tb_results[3])
-    elif(region == 'bb_reg0'):
-        folder_collection[region]["VCASB"].append(bb_VCASB[0])
-        folder_collection[region]["results"].append(bb_results[0])
-    elif(region == 'bb_reg1'):
-        folder_collection[region]["VCASB"].append(bb_VCASB[1])
-        folder_collection[region]["results"].append(bb_results[1])
-    elif(region == 'bb_reg2'):
-        folder_collection[region]["VCASB"].append(bb_VCASB[2])
-        folder_collection[region]["results"].append(bb_results[2])
-    elif(region == 'bb_reg3'):
-        folder_collection[region]["VCASB"].append(bb_VCASB[3])
-        folder_collection[region]["results"].append(bb_results[3])
-        
-# end function read_files
-
 # main
 
 if(len(sys.argv)<2):
@@ -183,35 +138,49 @@ else:
     print(f"measurement type: {measurement}")
     if(measurement == "FHR"):
         measNameForFolder = 'FakeHitRateScan'
-        measNameForJSON = 'FakeHitRate'
         folder_collection = region_collection_FHR
     elif(measurement == "THR"):
         measNameForFolder = 'ThresholdScan'
-        measNameForJSON = 'Threshold average per region'
         folder_collection = region_collection_THR
     else:
         print("please provide either THR or FHR as argument")
         quit()
     
+# which ScanCollection varied which region: ask the index instead of the hardcoded folders
+results_index = ResultsIndex(os.path.dirname(base_path))
+# threads: this script is not import-safe, so no process pool (spawn would re-run it)
+results_index.update(executor="thread")
+indexed_collections = results_index.varied_collections(os.path.basename(base_path), measurement)
+for region in folder_collection:
+    table_collection = folder_collection[region]['collection_folder']
+    if region not in indexed_collections:
+        print(f"{region}: not in the results index, using {table_collection}")
+        continue
+    folder_collection[region]['collection_folder'] = indexed_collections[region]
+    if indexed_collections[region] != table_collection:
+        print(f"WARNING {region}: reading {indexed_collections[region]} (latest with varied VCASB), "
+              f"not {table_collection} from the table above")
+    else:
+        print(f"{region}: {indexed_collections[region]}")
+
+collection_paths = {
+    region: os.path.join(base_path, measNameForFolder, folder_collection[region]['collection_folder'])
+    for region in folder_collection
+}
+df_scans = load_scan_collections(sorted(set(collection_paths.values())), executor="thread", cache=True)
+value_column = 'FHR' if measurement == 'FHR' else 'THR'
+
 for region in folder_collection: # in each step, different region(s)' VCASB was varied
 
     print(f"VARIED REGION(s): {region}")
-    file_path = os.path.join( base_path, measNameForFolder, folder_collection[region]['collection_folder'])
-    #file_path = f"{base_path}/{measNameForFolder}/{folder_collection[region]['collection_folder']}/"
-    folders_bytes = subprocess.check_output(f"ls {file_path}", shell=True)
-    folders_string = folders_bytes.decode()
-    folders_list = folders_string.split("\n")
-    folders_list.pop() # it has one empty item at the end
-
-    
-    for results_folder in folders_list:  # each results_folder has results from a different VCASB setting
-    
-        #config_fileName = f"{file_path}/{results_folder}/config/scan_config.json5"
-        config_fileName = os.path.join( file_path, results_folder, "config", "scan_config.json5")
-        #results_fileName = f"{file_path}/{results_folder}/analysis/analysis_result.json5"
-        results_fileName = os.path.join( file_path, results_folder, "analysis", "analysis_result.json5")
-        if(debug): print(f"file path: {results_fileName}")
-        read_files(config_fileName, results_fileName, measNameForJSON, debug)
+    unit, region_index = region[0:2], int(region[-1])
+    region_rows = df_scans[
+        (df_scans['collection'] == folder_collection[region]['collection_folder'])
+        & (df_scans['unit'] == unit) & (df_scans['region'] == region_index)
+    ].sort_values('folder')
+    if(debug): print(region_rows)
+    folder_collection[region]["VCASB"].extend(region_rows['VCASB'].tolist())
+    folder_collection[region]["results"].extend(region_rows[value_column].tolist())
 
 
 
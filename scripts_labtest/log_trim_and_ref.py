@@ -1,11 +1,30 @@
-"""Stab scan"""
+"""Stab scan
+
+Logs the bandgap trimming and DAC references of one or several chips:
+
+    python log_trim_and_ref.py <output dir> --ts-configs tb_configs/ts_config_raiser_1_2_W24B5.json5 ...
+
+Chips read out by different DAQ boards are measured concurrently. --stub runs on moss_stub.py.
+The board of every chip is given as its MOSS_DAQ entry of scripts/json/daq_serial.json:
+
+    python log_trim_and_ref.py <output dir> --ts-configs ts_config_raiser_2_4_W21D4.json5 ts_config_raiser_3_4_W17E6.json5 --daq DUT0 DUT1
+"""
+import math
+import os
 import time
 import datetime
 import argparse
-from moss_test.test_system.convenience import write_json
-from moss_test.moss_unit_if.moss_unit_if import MossUnitIF
-from moss_test.moss_unit_if.moss_registers import MossDac, IMuxSelect, VMuxSelect, MossRegion
-from moss_test import TestSystem
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+try:
+    from moss_test.test_system.convenience import write_json, load_json
+    from moss_test.moss_unit_if.moss_unit_if import MossUnitIF
+    from moss_test.moss_unit_if.moss_registers import MossDac, IMuxSelect, VMuxSelect, MossRegion
+    from moss_test import TestSystem
+except ImportError:  # moss_test not installed: only --stub works
+    from moss_stub import write_json, load_json, MossDac, IMuxSelect, VMuxSelect, MossRegion
+    MossUnitIF = TestSystem = None
 # Voltages and currents to measure for each region
 REF_VOLTAGES_CURRENTS = (
     IMuxSelect.IREF,
@@ -17,11 +36,70 @@ REF_VOLTAGES_CURRENTS = (
 
 DEFAULT_CFG_PATH = "/home/npl/babyMOSS/sw/config/tb_configs/ts_config_raiser_2_4_W21D4.json5"
 
-def start_logging(args):
-    """Starts the logging procedure. Logs the trimming registers and DAC references 
-    for every region and half-unit"""
-    ts = TestSystem.from_config_file(DEFAULT_CFG_PATH)
-    ts.initialize()
+# Fixed procedure: wait after every mux switch, then a fixed number of ADC samples
+SETTLE_TIME = 0.25
+NUM_SAMPLES = 10
+
+
+class AdaptiveSampling(NamedTuple):
+    """Settings of the adaptive mode: after a mux switch, single readings are taken every
+    settle_poll seconds until settle_count consecutive readings agree within settle_tol
+    (relative), at most settle_max seconds. Then batches of batch samples are taken until the
+    standard error of the mean is below se_target (relative to the mean), between
+    min_samples and max_samples."""
+    settle_tol: float = 1e-3
+    settle_count: int = 3
+    settle_poll: float = 0.01
+    settle_max: float = SETTLE_TIME
+    se_target: float = 5e-4
+    batch: int = 3
+    min_samples: int = 3
+    max_samples: int = 30
+
+# key of the DAQ board serial in the ts_config (dotted for nested sections). This is an assumption:
+# the ts_configs in this repository do not name their DAQ board, use --daq with daq_serial.json then.
+DAQ_SERIAL_KEY = "daq.serial"
+DAQ_SERIAL_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "json", "daq_serial.json")
+
+
+def daq_board(ts_config_path: str, key: str = DAQ_SERIAL_KEY) -> str:
+    """Serial of the DAQ board reading out a ts_config (e.g. DAQ-000904250E0B0F2F).
+    Raises KeyError if the ts_config has no such key: chips must not be grouped by guesswork."""
+    node = load_json(ts_config_path)
+    for part in key.split("."):
+        if not isinstance(node, dict) or part not in node:
+            raise KeyError(f"{ts_config_path} has no DAQ board serial '{key}', give the boards with --daq")
+        node = node[part]
+    if not isinstance(node, str) or not node:
+        raise KeyError(f"{ts_config_path}: '{key}' is not a DAQ board serial ({node!r})")
+    return node
+
+
+def group_by_board(ts_configs: list[str], daq_names: list[str] = None, key: str = DAQ_SERIAL_KEY,
+                   daq_json: str = DAQ_SERIAL_JSON) -> dict:
+    """{DAQ board serial: [ts_config]}. daq_names are the MOSS_DAQ entries of daq_serial.json
+    (DUT0, DUT1, ...) of the ts_configs, in the same order; without them the serial is read from
+    the ts_configs. A single ts_config needs no board."""
+    if daq_names:
+        if len(daq_names) != len(ts_configs):
+            raise ValueError(f"{len(daq_names)} DAQ board(s) given for {len(ts_configs)} ts_config(s)")
+        moss_daq = load_json(daq_json)["MOSS_DAQ"]
+        serials = []
+        for name in daq_names:
+            if name not in moss_daq:
+                raise KeyError(f"{name} not in MOSS_DAQ of {daq_json} ({', '.join(moss_daq)})")
+            serials.append(moss_daq[name])
+    elif len(ts_configs) == 1:
+        serials = ts_configs
+    else:
+        serials = [daq_board(ts_config, key) for ts_config in ts_configs]
+    boards = defaultdict(list)
+    for serial, ts_config in zip(serials, ts_configs):
+        boards[serial].append(ts_config)
+    return boards
+
+
+def power_on_if_needed(ts):
     if not ts.get_all_moss_unit_if()[0].is_powered():
         print(f"{ts.moss_chip_id} is not powered on! Power will be supplied, badgaps trimmed and default DACs set.")
         power_ok, _ = ts.get_all_moss_unit_if()[0].power_on()
@@ -29,21 +107,68 @@ def start_logging(args):
         for moss in ts.get_all_moss_unit_if():
             moss.trim_all_bandgaps()
             #moss.set_default_dacs(MossRegion.ALL_REGIONS)
-        
-        
-        
 
+
+def log_chip(ts, directory: str, sampling: AdaptiveSampling | None = None, store=None, timestamp=None):
+    """Logs the trimming registers and DAC references of every region and half-unit of one
+    initialized test system, also to the ReferenceStore store if given"""
+    start = time.perf_counter()
+    power_on_if_needed(ts)
     for moss in ts.get_all_moss_unit_if():
         all_monitoring_data = []
         for region in range(4):
-            monitoring_data = _measure_references(moss, region)
+            monitoring_data = _measure_references(moss, region, sampling)
             monitoring_data["Region"] = region
             monitoring_data["TRIM_volt"], monitoring_data["TRIM_curr"] = moss.get_dac_trimming(region)
             all_monitoring_data.append(monitoring_data)
         write_json(
-            f"{args.directory}/{ts.moss_chip_id}_{moss.name()}_reference_voltages_currents.json",
+            f"{directory}/{ts.moss_chip_id}_{moss.name()}_reference_voltages_currents.json",
             all_monitoring_data,
         )
+        if store is not None:
+            store.append(ts.moss_chip_id, moss.name(), all_monitoring_data, timestamp)
+    print(f"{ts.moss_chip_id}: references logged in {time.perf_counter() - start:.1f} s")
+
+
+def _log_board(ts_configs: list[str], test_system_class, directory: str, sampling: AdaptiveSampling | None,
+               store, timestamp):
+    """Chips of one DAQ board, one after the other"""
+    for ts_config in ts_configs:
+        ts = test_system_class.from_config_file(ts_config)
+        ts.initialize()
+        log_chip(ts, directory, sampling, store, timestamp)
+
+
+def start_logging(args):
+    """Starts the logging procedure for all ts_configs, one worker per DAQ board"""
+    sampling = sampling_from_args(args)
+
+    store = None
+    if not args.no_store:
+        from reference_drift import ReferenceStore  # pylint: disable=import-outside-toplevel
+        store = ReferenceStore(args.store or os.path.join(os.path.dirname(os.path.abspath(args.directory)),
+                                                          "reference_store"))
+    timestamp = datetime.datetime.now()
+
+    boards = group_by_board(args.ts_configs, args.daq, args.daq_key)
+    print(f"{len(args.ts_configs)} chip(s) on {len(boards)} DAQ board(s)")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(boards)) as pool:
+        futures = {
+            board: pool.submit(_log_board, ts_configs, get_test_system_class(args.stub), args.directory, sampling,
+                               store, timestamp)
+            for board, ts_configs in boards.items()
+        }
+    failed = []
+    for board, future in futures.items():
+        if future.exception() is not None:
+            print(f"Logging on {board} failed: {future.exception()!r}")
+            failed.append(board)
+    print(f"All references logged in {time.perf_counter() - start:.1f} s")
+    if store is not None:
+        print(f"Appended to {store.store_dir}")
+    return not failed
 
 def _set_moss_monitoring_multiplexer(moss: MossUnitIF, select: MossDac | VMuxSelect | IMuxSelect, region: int
 ) -> bool:
@@ -62,29 +187,129 @@ def _set_moss_monitoring_multiplexer(moss: MossUnitIF, select: MossDac | VMuxSel
     moss.set_monitor_mux(region, vmux=VMuxSelect[select.name])
     return False
 
-def _measure_references(moss: MossUnitIF, region: int) -> dict[str, dict[str, float]]:
-    """Measure reference voltages and currents"""
+def _sample(moss: MossUnitIF, is_current_ref: bool, region: int, num_samples: int) -> tuple[float, float]:
+    if is_current_ref:
+        return moss.adc.sample_idac(num_samples=num_samples)
+    return moss.adc.sample_vdac(region, num_samples=num_samples)
+
+
+def _wait_settled(moss: MossUnitIF, is_current_ref: bool, region: int, sampling: AdaptiveSampling) -> float:
+    """Poll single ADC readings until settle_count consecutive ones agree; returns the settle time"""
+    start = time.perf_counter()
+    previous, n_stable = None, 0
+    while time.perf_counter() - start < sampling.settle_max:
+        reading, _ = _sample(moss, is_current_ref, region, 1)
+        if previous is not None and abs(reading - previous) <= sampling.settle_tol * max(abs(previous), 1e-12):
+            n_stable += 1
+            if n_stable >= sampling.settle_count:
+                break
+        else:
+            n_stable = 0
+        previous = reading
+        time.sleep(sampling.settle_poll)
+    return time.perf_counter() - start
+
+
+def _sample_adaptive(
+    moss: MossUnitIF, is_current_ref: bool, region: int, sampling: AdaptiveSampling
+) -> tuple[float, float, int]:
+    """Batches of samples until the relative standard error reaches se_target; (mean, stdev, samples)"""
+    n, mean, m2 = 0, 0.0, 0.0
+    while n < sampling.max_samples:
+        batch = min(sampling.batch, sampling.max_samples - n)
+        batch_mean, batch_stdev = _sample(moss, is_current_ref, region, batch)
+        batch_stdev = 0.0 if batch_stdev is None or math.isnan(batch_stdev) else batch_stdev
+        # pooled mean and sum of squared deviations of all batches so far
+        delta = batch_mean - mean
+        total = n + batch
+        mean += delta * batch / total
+        m2 += batch_stdev**2 * batch + delta**2 * n * batch / total
+        n = total
+        stdev = math.sqrt(m2 / n)
+        if n >= sampling.min_samples and stdev / math.sqrt(n) <= sampling.se_target * max(abs(mean), 1e-12):
+            break
+    return mean, math.sqrt(m2 / n), n
+
+
+def _measure_references(
+    moss: MossUnitIF, region: int, sampling: AdaptiveSampling | None = None
+) -> dict[str, dict[str, float]]:
+    """Measure reference voltages and currents, with the fixed procedure or, if sampling is given,
+    adaptively. The settle time and number of samples used are recorded with every reference."""
     result_dict = {"Region": region}
     #logger.info(f"Measuring references for unit {moss.location()}, region {region}:")
     for reference in REF_VOLTAGES_CURRENTS:
-        is_current_ref = _set_moss_monitoring_multiplexer(moss, reference, region)
-        time.sleep(0.25)  # let stabilize
-        if is_current_ref:
-            mean, stdev = moss.adc.sample_idac(num_samples=10)
-            #logger.info(f" ... {reference.name}: {mean} uA")
-        else:
-            mean, stdev = moss.adc.sample_vdac(region, num_samples=10)
-            #logger.info(f" ... {reference.name}: {mean} V")
-        result_dict[reference.name] = {"Mean": mean, "Stdev": stdev}
+        result_dict[reference.name] = _measure_reference(moss, reference, region, sampling)
+        #logger.info(f" ... {reference.name}: {mean} {'uA' if is_current_ref else 'V'}")
     return result_dict
 
+
+def _measure_reference(
+    moss: MossUnitIF, reference: VMuxSelect | IMuxSelect, region: int, sampling: AdaptiveSampling | None = None
+) -> dict[str, float]:
+    """Switch the monitoring mux to one reference and sample it"""
+    is_current_ref = _set_moss_monitoring_multiplexer(moss, reference, region)
+    if sampling is None:
+        time.sleep(SETTLE_TIME)  # let stabilize
+        settle_time, num_samples = SETTLE_TIME, NUM_SAMPLES
+        mean, stdev = _sample(moss, is_current_ref, region, NUM_SAMPLES)
+    else:
+        settle_time = _wait_settled(moss, is_current_ref, region, sampling)
+        mean, stdev, num_samples = _sample_adaptive(moss, is_current_ref, region, sampling)
+    return {"Mean": mean, "Stdev": stdev, "Samples": num_samples, "SettleTime": round(settle_time, 4)}
+
+
+def add_sampling_arguments(argparser):
+    """--stub and the sampling options, shared with bandgap_trim_tuner.py"""
+    argparser.add_argument("--stub", action="store_true", help="use the stub test system (moss_stub.py)")
+    defaults = AdaptiveSampling()
+    argparser.add_argument("--adaptive", action="store_true",
+                           help="detect settling and stop sampling at the target standard error "
+                                f"instead of {SETTLE_TIME} s + {NUM_SAMPLES} samples")
+    argparser.add_argument("--settle-tol", type=float, default=defaults.settle_tol,
+                           help="relative difference of consecutive readings counted as settled")
+    argparser.add_argument("--settle-max", type=float, default=defaults.settle_max, help="max settle time (s)")
+    argparser.add_argument("--se-target", type=float, default=defaults.se_target,
+                           help="target standard error of the mean, relative to the mean")
+    argparser.add_argument("--max-samples", type=int, default=defaults.max_samples)
+
+
+def sampling_from_args(args) -> AdaptiveSampling | None:
+    if not args.adaptive:
+        return None
+    return AdaptiveSampling(
+        settle_tol=args.settle_tol, settle_max=args.settle_max, se_target=args.se_target,
+        max_samples=args.max_samples,
+    )
+
+
+def get_test_system_class(stub: bool):
+    if stub:
+        from moss_stub import StubTestSystem  # pylint: disable=import-outside-toplevel
+        return StubTestSystem
+    assert TestSystem is not None, "moss_test is not installed, only --stub is available"
+    return TestSystem
+
 def main():
     argparser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     argparser.add_argument(
         "directory"
     )
+    argparser.add_argument("--ts-configs", nargs="+", default=[DEFAULT_CFG_PATH],
+                           help="ts_config of every chip to log")
+    argparser.add_argument("--store", default=None,
+                           help="reference time-series store (reference_drift.py), "
+                                "default: reference_store next to the output directory")
+    argparser.add_argument("--no-store", action="store_true", help="only write the json files")
+    argparser.add_argument("--daq", nargs="+", default=None,
+                           help="MOSS_DAQ board of every ts_config in scripts/json/daq_serial.json (e.g. DUT0 DUT1)")
+    argparser.add_argument("--daq-key", default=DAQ_SERIAL_KEY,
+                           help="without --daq: key of the DAQ board serial in the ts_configs (dotted for nested "
+                                "sections)")
+    add_sampling_arguments(argparser)
     args = argparser.parse_args()
-    start_logging(args)
+    if not start_logging(args):
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,185 @@
+"""
+Simulated babyMOSS for running the VCASB range finder without hardware
+
+Every region has a fake hit rate rising exponentially with VCASB and a threshold falling
+linearly with it:
+
+    FHR(VCASB) = 1e-6 * 10**((VCASB - vcasb_1e6) / vcasb_per_decade)   (hits / pixel / trigger)
+    THR(VCASB) = thr_intercept + thr_slope * VCASB
+
+Measured FHR is Poisson-counted over n_triggers x n_pixels with some scan-to-scan scatter,
+so it reads 0 far below the limit like the real scan. A scan fails (Err result) if any
+region exceeds its readout limit (fail_fhr) or at random with p_fail.
+
+SimFakeHitRateScan / SimThresholdScan and SimFakeHitRateAnalysis / SimThresholdScanAnalysis
+have the constructor and run() signatures used by vcasb_range_finder.py; install() puts them
+in place of the real classes (vcasb_range_finder.py --simulate SEED).
+Each simulated scan advances SimChip.clock by the configured scan and analysis times.
+"""
+import math
+import os
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    from result import Err, Ok
+except ImportError:  # the real test system is not installed
+    class Ok(NamedTuple):
+        value: object
+
+        def is_err(self):
+            return False
+
+    class Err(NamedTuple):
+        value: object
+
+        def is_err(self):
+            return True
+
+UNITS = ("tb", "bb")
+N_PIXELS = {"tb": 256 * 256, "bb": 320 * 320}
+
+
+class RegionModel(NamedTuple):
+    vcasb_1e6: float            # VCASB at which FHR = 1e-6
+    vcasb_per_decade: float     # VCASB steps per decade of FHR
+    thr_intercept: float
+    thr_slope: float
+    fail_fhr: float             # readout fails above this FHR
+
+    def fhr(self, vcasb):
+        return 1e-6 * 10 ** ((np.asarray(vcasb, dtype=float) - self.vcasb_1e6) / self.vcasb_per_decade)
+
+    def thr(self, vcasb):
+        return self.thr_intercept + self.thr_slope * np.asarray(vcasb, dtype=float)
+
+    def vcasb_max(self, fhr_limit):
+        """True VCASB_max: lowest VCASB whose expected FHR reaches fhr_limit"""
+        return math.ceil(self.vcasb_1e6 + self.vcasb_per_decade * np.log10(fhr_limit / 1e-6) - 1e-9)
+
+
+class SimChip:
+    """All regions of one simulated chip plus the simulated clock"""
+
+    def __init__(self, regions, seed=0, n_triggers=100_000, fhr_scatter=0.1, thr_scatter=0.3, p_fail=0.0,
+                 scan_time_s=None):
+        self.regions = regions          # {unit: [RegionModel] * 4}
+        self.rng = np.random.default_rng(seed)
+        self.n_triggers = n_triggers
+        self.fhr_scatter = fhr_scatter
+        self.thr_scatter = thr_scatter
+        self.p_fail = p_fail
+        self.scan_time_s = scan_time_s or {"FHR": 20.0, "FHR_analysis": 5.0, "THR": 60.0, "THR_analysis": 10.0}
+        self.clock = 0.0
+        self.n_scans = {"FHR": 0, "THR": 0}
+
+    @classmethod
+    def random(cls, seed=0, **kwargs):
+        rng = np.random.default_rng(seed)
+        regions = {}
+        for unit in UNITS:
+            regions[unit] = [RegionModel(vcasb_1e6=rng.uniform(60, 110),
+                                         vcasb_per_decade=rng.uniform(2, 6),
+                                         thr_intercept=rng.uniform(160, 200),
+                                         thr_slope=-rng.uniform(1.2, 1.8),
+                                         fail_fhr=10 ** rng.uniform(-2, -1))
+                             for _ in range(4)]
+        return cls(regions, seed=seed + 1, **kwargs)
+
+    def _failed(self, unit, vcasb_list):
+        saturated = any(model.fhr(vcasb) > model.fail_fhr for model, vcasb in zip(self.regions[unit], vcasb_list))
+        return saturated or self.rng.random() < self.p_fail
+
+    def fhr_scan(self, unit, vcasb_list):
+        """(ok, FHR per region)"""
+        self.clock += self.scan_time_s["FHR"] + self.scan_time_s["FHR_analysis"]
+        self.n_scans["FHR"] += 1
+        if self._failed(unit, vcasb_list):
+            return False, [math.nan] * 4
+        exposure = self.n_triggers * N_PIXELS[unit]
+        fhr = []
+        for model, vcasb in zip(self.regions[unit], vcasb_list):
+            expected = model.fhr(vcasb) * self.rng.lognormal(0, self.fhr_scatter)
+            fhr.append(float(self.rng.poisson(min(expected * exposure, 1e15)) / exposure))
+        return True, fhr
+
+    def thr_scan(self, unit, vcasb_list):
+        """(ok, threshold per region)"""
+        self.clock += self.scan_time_s["THR"] + self.scan_time_s["THR_analysis"]
+        self.n_scans["THR"] += 1
+        if self._failed(unit, vcasb_list):
+            return False, [math.nan] * 4
+        return True, [float(model.thr(vcasb) + self.rng.normal(0, self.thr_scatter))
+                      for model, vcasb in zip(self.regions[unit], vcasb_list)]
+
+
+# Stand-ins for the moss_scans / analyses classes used by vcasb_range_finder.py
+SIM_CHIP = None
+_LAST_RESULT = {}
+
+
+def _vcasb_of(conf):
+    if not isinstance(conf, dict):
+        try:
+            from moss_test.test_system.convenience import load_json  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            from moss_stub import load_json  # pylint: disable=import-outside-toplevel
+        conf = load_json(conf)
+    unit = conf["enabled_units"][0]
+    return unit, conf["moss_dac_settings"][unit]["VCASB"]
+
+
+class _SimScan:
+    kind = None
+    accepts_config_dict = True   # vcasb_range_finder passes the config dict, no file needed
+
+    def __init__(self, conf: dict | str, intermediate_dir_name="", setup_stream_handler=False):
+        self.unit, self.vcasb_list = _vcasb_of(conf)
+        self.output_dir_path = tempfile.mkdtemp(prefix=f"sim_{self.kind}_")
+
+    def run(self):
+        scan = SIM_CHIP.fhr_scan if self.kind == "FHR" else SIM_CHIP.thr_scan
+        ok, values = scan(self.unit, self.vcasb_list)
+        _LAST_RESULT[self.output_dir_path] = (self.unit, values)
+        return Ok(0) if ok else Err(1)
+
+
+class SimFakeHitRateScan(_SimScan):
+    kind = "FHR"
+
+
+class SimThresholdScan(_SimScan):
+    kind = "THR"
+
+
+class _SimAnalysis:
+    key = None
+
+    def __init__(self, top_scan_dir, quiet=True):
+        self.top_scan_dir = str(top_scan_dir)
+
+    def run(self):
+        unit, values = _LAST_RESULT.pop(self.top_scan_dir)
+        os.rmdir(self.top_scan_dir)
+        return {unit: {self.key: values}}
+
+
+class SimFakeHitRateAnalysis(_SimAnalysis):
+    key = "FakeHitRate"
+
+
+class SimThresholdScanAnalysis(_SimAnalysis):
+    key = "Threshold average per region"
+
+
+def install(module, seed=0, **kwargs):
+    """Replace the scan and analysis classes of module (vcasb_range_finder) by the simulation"""
+    global SIM_CHIP  # pylint: disable=global-statement
+    SIM_CHIP = SimChip.random(seed, **kwargs)
+    module.FakeHitRateScan = SimFakeHitRateScan
+    module.ThresholdScan = SimThresholdScan
+    module.FakeHitRateAnalysis = SimFakeHitRateAnalysis
+    module.ThresholdScanAnalysis = SimThresholdScanAnalysis
+    return SIM_CHIP
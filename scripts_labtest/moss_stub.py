@@ -0,0 +1,266 @@
+"""
+Stub babyMOSS test system for running the monitoring scripts without hardware
+
+StubTestSystem has the part of the moss_test TestSystem interface used by log_trim_and_ref.py,
+bandgap_trim_tuner.py and dac_calibration.py (from_config_file, initialize, get_all_moss_unit_if,
+moss_chip_id) and its units the monitor mux, bandgap trimming (get/set_dac_trimming), DAC and
+ADC calls. The references of every region follow a simple model:
+
+    VBGR = vbgr_0 + VBGR_PER_CODE * TRIM_volt       IREF = iref_0 + IREF_PER_CODE * TRIM_curr
+    VREF = 1.8 * VBGR       VDD13 = 1.2 / 3     VDD23 = 2 * 1.2 / 3
+
+DACs follow offset + gain * code with a small bow and saturate near full scale (DacTransfer).
+ADC readings settle exponentially (SETTLE_TAU) after a mux switch, carry gaussian noise and
+take sample_time each, so concurrent logging of several stub chips behaves like the real one.
+Chips are random but reproducible from their id; the chip id is taken from the ts_config
+file name (ts_config_raiser_2_4_W21D4.json5 -> babyMOSS-2_4_W21D4).
+
+Without moss_test installed the scripts import the enums, write_json and load_json from here.
+"""
+import enum
+import hashlib
+import json
+import os
+import re
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    import json5
+except ImportError:
+    json5 = None
+
+UNITS = ("tb", "bb")
+N_REGIONS = 4
+TRIM_CODES = 16
+VBGR_PER_CODE = 0.004      # V per TRIM_volt code
+IREF_PER_CODE = 0.12       # uA per TRIM_curr code
+DAC_CODES = 256
+DEFAULT_DACS = {"IBIAS": 62, "IBIASN": 100, "IDB": 25, "IRESET": 10, "VCASB": 70, "VCASN": 104, "VSHIFT": 145,
+                "VPULSEH": 255, "VPULSEL": 0}
+DAC_FULL_SCALE = {"V": 1.2, "uA": 2.0}   # output saturates slightly below this
+SETTLE_TAU = 0.02          # s
+SAMPLE_TIME = 2e-4         # s per ADC sample
+
+
+class MossRegion(enum.IntEnum):
+    REGION0 = 0
+    REGION1 = 1
+    REGION2 = 2
+    REGION3 = 3
+    ALL_REGIONS = 4
+
+
+class VMuxSelect(enum.IntEnum):
+    NONE = 0
+    VCASB = 1
+    VCASN = 2
+    VSHIFT = 3
+    VPULSEH = 4
+    VPULSEL = 5
+    VBGR = 6
+    VREF = 7
+    VDD13 = 8
+    VDD23 = 9
+
+
+class IMuxSelect(enum.IntEnum):
+    NONE = 0
+    IBIAS = 1
+    IBIASN = 2
+    IDB = 3
+    IRESET = 4
+    IREF = 5
+
+
+class MossDac(enum.IntEnum):
+    IBIAS = 0
+    IBIASN = 1
+    IDB = 2
+    IRESET = 3
+    VCASB = 4
+    VCASN = 5
+    VSHIFT = 6
+    VPULSEH = 7
+    VPULSEL = 8
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+
+
+def load_json(path):
+    with open(path, "r") as f:
+        return json5.load(f) if json5 is not None else json.load(f)
+
+
+def chip_id_from_config(path: str) -> str:
+    match = re.search(r"(\d+_\d+_W\w+?)\.json5?$", os.path.basename(path))
+    return f"babyMOSS-{match.group(1)}" if match else os.path.splitext(os.path.basename(path))[0]
+
+
+class RegionReferences(NamedTuple):
+    vbgr_0: float
+    iref_0: float
+
+    def vbgr(self, trim_volt):
+        return self.vbgr_0 + VBGR_PER_CODE * trim_volt
+
+    def iref(self, trim_curr):
+        return self.iref_0 + IREF_PER_CODE * trim_curr
+
+
+class DacTransfer(NamedTuple):
+    """offset + gain * code with a small bow, saturating at full_scale"""
+    offset: float
+    gain: float
+    bow: float
+    full_scale: float
+
+    def value(self, code):
+        x = code / (DAC_CODES - 1)
+        linear = self.offset + self.gain * code + self.bow * x * (1 - x)
+        knee = 0.8 * self.full_scale
+        if linear <= knee:
+            return linear
+        return knee + (self.full_scale - knee) * np.tanh((linear - knee) / (self.full_scale - knee))
+
+
+class StubAdc:
+
+    def __init__(self, unit, noise=(5e-5, 2e-3), sample_time=SAMPLE_TIME):
+        self.unit = unit
+        self.noise_v, self.noise_i = noise
+        self.sample_time = sample_time
+
+    def _read(self, true_value, noise, num_samples):
+        # value seen num_samples * sample_time after the last mux switch, approaching the true value
+        time.sleep(self.sample_time * num_samples)
+        elapsed = time.perf_counter() - self.unit.mux_switched + self.sample_time * np.arange(1 - num_samples, 1)
+        offset = self.unit.mux_previous - true_value
+        values = true_value + offset * np.exp(-elapsed / SETTLE_TAU) + self.unit.rng.normal(0, noise, num_samples)
+        stdev = float(np.std(values, ddof=1)) if num_samples > 1 else float("nan")
+        return float(np.mean(values)), stdev
+
+    def sample_idac(self, num_samples=10):
+        return self._read(self.unit.monitored(current=True), self.noise_i, num_samples)
+
+    def sample_vdac(self, region, num_samples=10):
+        return self._read(self.unit.monitored(current=False, region=region), self.noise_v, num_samples)
+
+
+class StubMossUnit:
+
+    def __init__(self, chip_id, unit, seed):
+        self.chip_id = chip_id
+        self.unit = unit
+        self.rng = np.random.default_rng(seed)
+        self.references = [RegionReferences(vbgr_0=self.rng.uniform(0.17, 0.23), iref_0=self.rng.uniform(8.4, 9.6))
+                           for _ in range(N_REGIONS)]
+        self.trim = [(0, 0)] * N_REGIONS
+        self.dac_transfer = [{
+            dac.name: DacTransfer(
+                offset=self.rng.uniform(0.0, 0.02) * full_scale,
+                gain=self.rng.uniform(0.8, 1.0) * full_scale / DAC_CODES,
+                bow=self.rng.uniform(-0.005, 0.005) * full_scale,
+                full_scale=full_scale)
+            for dac in MossDac
+            for full_scale in [DAC_FULL_SCALE["uA" if dac.name in IMuxSelect.__members__ else "V"]]
+        } for _ in range(N_REGIONS)]
+        self.dacs = [dict(DEFAULT_DACS) for _ in range(N_REGIONS)]
+        self.powered = False
+        self.vmux = [VMuxSelect.NONE] * N_REGIONS
+        self.imux = [IMuxSelect.NONE] * N_REGIONS
+        self.mux_switched = time.perf_counter()
+        self.mux_previous = 0.0
+        self.adc = StubAdc(self)
+
+    def name(self):
+        return self.unit
+
+    def location(self):
+        return f"{self.chip_id}/{self.unit}"
+
+    def is_powered(self):
+        return self.powered
+
+    def power_on(self):
+        self.powered = True
+        return True, None
+
+    def trim_all_bandgaps(self):
+        # what the on-chip procedure would find: the codes closest to the nominal references
+        for region, reference in enumerate(self.references):
+            volt = int(np.clip(round((0.25 - reference.vbgr_0) / VBGR_PER_CODE), 0, TRIM_CODES - 1))
+            curr = int(np.clip(round((10.0 - reference.iref_0) / IREF_PER_CODE), 0, TRIM_CODES - 1))
+            self.set_dac_trimming(region, volt, curr)
+
+    def get_dac_trimming(self, region):
+        return self.trim[region]
+
+    def set_dac_trimming(self, region, volt, curr):
+        self.trim[region] = (int(volt), int(curr))
+
+    def set_dac(self, region, dac, value):
+        regions = range(N_REGIONS) if region == MossRegion.ALL_REGIONS else [int(region)]
+        for r in regions:
+            self.dacs[r][MossDac[dac.name].name] = int(value)
+
+    def set_default_dacs(self, region):
+        regions = range(N_REGIONS) if region == MossRegion.ALL_REGIONS else [int(region)]
+        for r in regions:
+            self.dacs[r] = dict(DEFAULT_DACS)
+
+    def _dac_value(self, region, name):
+        return float(self.dac_transfer[region][name].value(self.dacs[region][name]))
+
+    def monitored(self, current, region=None):
+        """True value at the monitoring pad"""
+        if current:
+            regions = [r for r in range(N_REGIONS) if self.imux[r] != IMuxSelect.NONE]
+            if len(regions) != 1:
+                return 0.0
+            if self.imux[regions[0]] == IMuxSelect.IREF:
+                return self.references[regions[0]].iref(self.trim[regions[0]][1])
+            return self._dac_value(regions[0], self.imux[regions[0]].name)
+        if self.vmux[region].name in MossDac.__members__:
+            return self._dac_value(region, self.vmux[region].name)
+        vbgr = self.references[region].vbgr(self.trim[region][0])
+        return {
+            VMuxSelect.VBGR: vbgr,
+            VMuxSelect.VREF: 1.8 * vbgr,
+            VMuxSelect.VDD13: 1.2 / 3,
+            VMuxSelect.VDD23: 2 * 1.2 / 3,
+        }.get(self.vmux[region], 0.0)
+
+    def set_monitor_mux(self, region, vmux=None, imux=None):
+        regions = range(N_REGIONS) if region == MossRegion.ALL_REGIONS else [int(region)]
+        current = imux is not None or vmux is None
+        self.mux_previous = self.monitored(current=True) if current else self.monitored(False, regions[0])
+        for r in regions:
+            self.vmux[r] = VMuxSelect.NONE if vmux is None else VMuxSelect[vmux.name]
+            self.imux[r] = IMuxSelect.NONE if imux is None else IMuxSelect[imux.name]
+        self.mux_switched = time.perf_counter()
+
+
+class StubTestSystem:
+
+    def __init__(self, config_path, moss_chip_id=None):
+        self.config_path = config_path
+        self.moss_chip_id = moss_chip_id or chip_id_from_config(config_path)
+        self.units = []
+
+    @classmethod
+    def from_config_file(cls, config_path):
+        return cls(config_path)
+
+    def initialize(self):
+        seed = int(hashlib.sha1(self.moss_chip_id.encode()).hexdigest()[:8], 16)
+        self.units = [StubMossUnit(self.moss_chip_id, unit, seed + i) for i, unit in enumerate(UNITS)]
+        time.sleep(0.1)
+
+    def get_all_moss_unit_if(self):
+        return self.units
@@ -0,0 +1,109 @@
+"""
+Convergence benchmark of the VCASB search strategies on simulated chips (moss_scan_sim.py)
+
+For every strategy and every region of n simulated chips the FHR limit is searched as
+vcasb_range_finder.py does (other regions at vcasb_default, or all regions at once for
+"parallel"), and compared with the true VCASB_max of the simulated region:
+
+    scans/unit     FHR scans per unit (4 regions)
+    sim time/unit  simulated scan + analysis time per unit
+    exact, +-1     fraction of regions with VCASB_max equal to / within one DAC of the truth
+    mean |err|     mean absolute VCASB_max error
+
+    python range_finder_bench.py --chips 50 --fhr-limit 1e-3 --initial 50 -o bench.json
+
+Chips and scan outcomes are reproducible from --seed. With the defaults (--seed 0, 50 chips):
+
+    strategy   scans/unit  exact  +-1   not reached        with --p-fail 0.05
+    step             37.4   0.46  0.97            0        31.4   0.30  0.62  153
+    model            27.5   0.87  1.00            0        34.3   0.84  0.99    4
+    parallel          8.3   0.87  1.00            0        10.0   0.86  1.00    0
+"""
+import argparse
+import json
+import math
+
+import numpy as np
+
+from moss_scan_sim import SimChip, UNITS
+from vcasb_search import SEARCHES, parallel_search
+
+
+def bench_strategy(name, chips, fhr_limit, vcasb_initial, vcasb_default):
+    """Per-region records of one strategy over all chips"""
+    records = []
+    for chip in chips:
+        for unit in UNITS:
+            clock, n_scans = chip.clock, chip.n_scans["FHR"]
+            if name == "parallel":
+                def measure_all(vcasb_per_region, chip=chip, unit=unit):
+                    return chip.fhr_scan(unit, [vcasb_per_region.get(region, vcasb_default) for region in range(4)])
+                results, _ = parallel_search(measure_all, range(4), vcasb_initial, fhr_limit)
+            else:
+                results = {}
+                for region in range(4):
+                    def measure(vcasb, chip=chip, unit=unit, region=region):
+                        ok, fhr = chip.fhr_scan(unit, [vcasb if r == region else vcasb_default for r in range(4)])
+                        return ok, fhr[region] if ok else math.nan
+                    results[region] = SEARCHES[name](measure, vcasb_initial, fhr_limit)
+            unit_scans, unit_time = chip.n_scans["FHR"] - n_scans, chip.clock - clock
+            for region, result in results.items():
+                truth = chip.regions[unit][region].vcasb_max(fhr_limit)
+                records.append({"unit_scans": unit_scans, "unit_time_s": unit_time,
+                                "vcasb_max": result.vcasb, "truth": truth, "reached": result.reached})
+    return records
+
+
+def summarize(name, records):
+    error = np.array([record["vcasb_max"] - record["truth"] for record in records])
+    n_units = len(records) / 4
+    return {
+        "strategy": name,
+        "scans_per_unit": sum(record["unit_scans"] for record in records) / 4 / n_units,
+        "sim_time_per_unit_s": sum(record["unit_time_s"] for record in records) / 4 / n_units,
+        "exact": float(np.mean(error == 0)),
+        "within_1": float(np.mean(np.abs(error) <= 1)),
+        "mean_abs_error": float(np.mean(np.abs(error))),
+        "mean_error": float(np.mean(error)),
+        "not_reached": int(sum(not record["reached"] for record in records)),
+    }
+
+
+def run_benchmark(strategies, n_chips=50, seed=0, fhr_limit=1e-3, vcasb_initial=50, vcasb_default=50, p_fail=0.0):
+    summaries = []
+    for name in strategies:
+        # same chips and random sequence for every strategy
+        chips = [SimChip.random(seed + 2 * i, p_fail=p_fail) for i in range(n_chips)]
+        summaries.append(summarize(name, bench_strategy(name, chips, fhr_limit, vcasb_initial, vcasb_default)))
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VCASB search convergence on simulated chips")
+    parser.add_argument("--strategies", nargs="+", default=list(SEARCHES) + ["parallel"],
+                        choices=list(SEARCHES) + ["parallel"])
+    parser.add_argument("--chips", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fhr-limit", type=float, default=1e-3)
+    parser.add_argument("--initial", type=int, default=50, help="vcasb_initial")
+    parser.add_argument("--default", type=int, default=50, help="vcasb_default of the regions not searched")
+    parser.add_argument("--p-fail", type=float, default=0.0, help="probability of a random scan failure")
+    parser.add_argument("-o", "--output", default=None, help="write the summary as json")
+    args = parser.parse_args()
+
+    summaries = run_benchmark(args.strategies, args.chips, args.seed, args.fhr_limit, args.initial, args.default,
+                              args.p_fail)
+    print(f"{'strategy':10s} {'scans/unit':>10s} {'sim time/unit':>14s} {'exact':>6s} {'+-1':>6s} "
+          f"{'mean |err|':>10s} {'bias':>6s} {'not reached':>11s}")
+    for summary in summaries:
+        print(f"{summary['strategy']:10s} {summary['scans_per_unit']:10.1f} "
+              f"{summary['sim_time_per_unit_s'] / 60:11.1f} min {summary['exact']:6.2f} {summary['within_1']:6.2f} "
+              f"{summary['mean_abs_error']:10.2f} {summary['mean_error']:6.2f} {summary['not_reached']:11d}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": summaries}, f, indent=2)
+        print(f"Saved as {args.output}")
+
+
+if __name__ == "__main__":
+    main()
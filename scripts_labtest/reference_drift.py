@@ -0,0 +1,224 @@
+"""
+Time series of the bandgap trimming and DAC references logged by log_trim_and_ref.py
+
+Every logged chip adds one small Parquet file to an append-only store, partitioned by chip:
+
+    <store>/chip=<chip>/<YYYY-mm-dd_HH_MM_SS>_<unit>.parquet
+
+with one row per (region, reference):
+    timestamp, unit, region, reference, mean, stdev, samples, settle_time, trim_volt, trim_curr
+Existing files are never rewritten; "compact" merges the files of a chip into one.
+
+drift() returns the curves of every (chip, unit, region, reference) relative to their first
+point in the selected time range and flags the points out of tolerance, or where a trim
+code changed.
+
+    python reference_drift.py import  <store> ~/testbeam/TB_August_2024/data/trim_ref_logs
+    python reference_drift.py drift   <store> --chip W21D4 --reference VBGR --tolerance 0.005
+    python reference_drift.py compact <store>
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+TIME_FORMAT = "%Y-%m-%d_%H_%M_%S"   # as the trim_ref_logs directories
+REFERENCES = ("IREF", "VBGR", "VREF", "VDD13", "VDD23")
+# relative change from the first point counted as drift
+TOLERANCES = {"IREF": 0.01, "VBGR": 0.005, "VREF": 0.005, "VDD13": 0.005, "VDD23": 0.005}
+COLUMNS = {
+    "timestamp": "datetime64[ns]", "unit": str, "region": "int64", "reference": str, "mean": "float64",
+    "stdev": "float64", "samples": "float64", "settle_time": "float64", "trim_volt": "int64", "trim_curr": "int64",
+}
+JSON_NAME = re.compile(r"(?P<chip>.+)_(?P<unit>tb|bb)_reference_voltages_currents\.json$")
+
+
+def records_to_frame(records: list[dict], unit: str, timestamp: datetime.datetime) -> pd.DataFrame:
+    """Rows of one *_reference_voltages_currents.json (list of per-region dicts)"""
+    rows = []
+    for record in records:
+        for reference in REFERENCES:
+            if reference not in record:
+                continue
+            rows.append({
+                "timestamp": timestamp, "unit": unit, "region": record["Region"], "reference": reference,
+                "mean": record[reference]["Mean"], "stdev": record[reference]["Stdev"],
+                "samples": record[reference].get("Samples"), "settle_time": record[reference].get("SettleTime"),
+                "trim_volt": record["TRIM_volt"], "trim_curr": record["TRIM_curr"],
+            })
+    return pd.DataFrame(rows, columns=list(COLUMNS)).astype(COLUMNS)
+
+
+def _tmp_name(path):
+    # hidden while being written, so a crash never leaves a half file in the dataset
+    return os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+
+
+def json_timestamp(path: str) -> datetime.datetime:
+    """Time of a json log: its trim_ref_logs directory name, else the file modification time"""
+    try:
+        return datetime.datetime.strptime(os.path.basename(os.path.dirname(os.path.abspath(path))), TIME_FORMAT)
+    except ValueError:
+        return datetime.datetime.fromtimestamp(os.path.getmtime(path)).replace(microsecond=0)
+
+
+class ReferenceStore:
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    def _run_file(self, chip, unit, timestamp):
+        return os.path.join(self.store_dir, f"chip={chip}", f"{timestamp.strftime(TIME_FORMAT)}_{unit}.parquet")
+
+    def append(self, chip: str, unit: str, records: list[dict], timestamp: datetime.datetime = None) -> bool:
+        """Store one logged half-unit; False if this chip, unit and time are already stored"""
+        timestamp = (timestamp or datetime.datetime.now()).replace(microsecond=0)
+        run_file = self._run_file(chip, unit, timestamp)
+        if os.path.exists(run_file) or pd.Timestamp(timestamp) in self._compacted_times(chip, unit):
+            return False
+        os.makedirs(os.path.dirname(run_file), exist_ok=True)
+        tmp_file = _tmp_name(run_file)
+        records_to_frame(records, unit, timestamp).to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, run_file)
+        return True
+
+    def _compacted_times(self, chip, unit):
+        compacted = glob.glob(os.path.join(self.store_dir, f"chip={chip}", "compacted_*.parquet"))
+        if not compacted:
+            return set()
+        df = pd.concat([pd.read_parquet(path, columns=["timestamp", "unit"]) for path in compacted])
+        return set(df.loc[df["unit"] == unit, "timestamp"])
+
+    def import_json(self, paths: list[str]) -> tuple[int, int]:
+        """One-shot import of existing json logs (files or directories searched recursively).
+        Returns (files stored, files already in the store)."""
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files += glob.glob(os.path.join(path, "**", "*_reference_voltages_currents.json"), recursive=True)
+            else:
+                files.append(path)
+        n_stored = n_skipped = 0
+        for path in sorted(files):
+            match = JSON_NAME.match(os.path.basename(path))
+            if match is None:
+                print(f"Skipping {path}: not a reference log")
+                continue
+            with open(path, "r") as f:
+                records = json.load(f)
+            if self.append(match["chip"], match["unit"], records, json_timestamp(path)):
+                n_stored += 1
+            else:
+                n_skipped += 1
+        return n_stored, n_skipped
+
+    def query(self, chip=None, unit=None, region=None, reference=None, since=None, until=None) -> pd.DataFrame:
+        """Rows matching all given filters, sorted by time. chip matches as a substring."""
+        if not os.path.isdir(self.store_dir):
+            raise FileNotFoundError(f"No reference store in {self.store_dir}")
+        filters = []
+        if unit is not None:
+            filters.append(("unit", "==", unit))
+        if region is not None:
+            filters.append(("region", "==", region))
+        if reference is not None:
+            filters.append(("reference", "==", reference))
+        if since is not None:
+            filters.append(("timestamp", ">=", pd.Timestamp(since)))
+        if until is not None:
+            filters.append(("timestamp", "<=", pd.Timestamp(until)))
+        df = pd.read_parquet(self.store_dir, filters=filters or None)
+        df["chip"] = df["chip"].astype(str)
+        if chip is not None:
+            df = df[df["chip"].str.contains(chip, regex=False)]
+        df = df[["chip"] + [column for column in df.columns if column != "chip"]]
+        return df.sort_values(["chip", "unit", "region", "reference", "timestamp"]).reset_index(drop=True)
+
+    def drift(self, tolerance: float | dict = None, **filters) -> pd.DataFrame:
+        """query() plus, per (chip, unit, region, reference) curve:
+            delta, rel_delta   change from the first point
+            step               change from the previous point
+            trim_changed       a trim code differs from the previous point
+            out_of_tolerance   |rel_delta| above the tolerance (TOLERANCES by default, or one
+                               value / a {reference: value} dict)"""
+        df = self.query(**filters)
+        if isinstance(tolerance, dict):
+            tolerances = {**TOLERANCES, **tolerance}
+        else:
+            tolerances = dict.fromkeys(REFERENCES, tolerance) if tolerance is not None else TOLERANCES
+        curves = df.groupby(["chip", "unit", "region", "reference"], sort=False)
+        df["delta"] = df["mean"] - curves["mean"].transform("first")
+        df["rel_delta"] = df["delta"] / curves["mean"].transform("first").abs()
+        df["step"] = curves["mean"].diff().fillna(0.0)
+        df["trim_changed"] = (curves["trim_volt"].diff().fillna(0) != 0) | (curves["trim_curr"].diff().fillna(0) != 0)
+        df["out_of_tolerance"] = df["rel_delta"].abs() > df["reference"].map(tolerances)
+        return df
+
+    def compact(self) -> int:
+        """Merge the run files of every chip into one file; returns the number of files merged"""
+        n_merged = 0
+        for chip_dir in sorted(glob.glob(os.path.join(self.store_dir, "chip=*"))):
+            run_files = sorted(path for path in glob.glob(os.path.join(chip_dir, "*.parquet"))
+                               if not os.path.basename(path).startswith("compacted_"))
+            if len(run_files) < 2:
+                continue
+            df = pd.concat([pd.read_parquet(path) for path in run_files], ignore_index=True).astype(COLUMNS)
+            first, last = df["timestamp"].min(), df["timestamp"].max()
+            merged = os.path.join(chip_dir, f"compacted_{first.strftime(TIME_FORMAT)}-{last.strftime(TIME_FORMAT)}"
+                                            f"_{len(run_files)}.parquet")
+            df.sort_values(["timestamp", "unit", "region", "reference"]).to_parquet(_tmp_name(merged), index=False)
+            os.replace(_tmp_name(merged), merged)
+            for path in run_files:
+                os.remove(path)
+            n_merged += len(run_files)
+        return n_merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time series of the logged bandgap trims and DAC references")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="import existing *_reference_voltages_currents.json")
+    import_parser.add_argument("store")
+    import_parser.add_argument("paths", nargs="+", help="json files or directories (searched recursively)")
+    drift_parser = subparsers.add_parser("drift", help="print the drift curves, flagged points only by default")
+    drift_parser.add_argument("store")
+    drift_parser.add_argument("--chip")
+    drift_parser.add_argument("--unit", choices=["tb", "bb"])
+    drift_parser.add_argument("--region", type=int)
+    drift_parser.add_argument("--reference", choices=REFERENCES)
+    drift_parser.add_argument("--since", help="e.g. 2024-08-20")
+    drift_parser.add_argument("--until")
+    drift_parser.add_argument("--tolerance", type=float, default=None,
+                              help=f"relative tolerance of all references (default {TOLERANCES})")
+    drift_parser.add_argument("--all", action="store_true", help="print every point, not only the flagged ones")
+    drift_parser.add_argument("-o", "--output", help="save the curves as csv")
+    compact_parser = subparsers.add_parser("compact", help="merge the files of every chip")
+    compact_parser.add_argument("store")
+    args = parser.parse_args()
+
+    store = ReferenceStore(args.store)
+    start = time.perf_counter()
+    if args.command == "import":
+        n_stored, n_skipped = store.import_json(args.paths)
+        print(f"{n_stored} log(s) imported, {n_skipped} already stored, in {time.perf_counter() - start:.2f} s")
+    elif args.command == "compact":
+        print(f"{store.compact()} file(s) merged in {time.perf_counter() - start:.2f} s")
+    else:
+        df = store.drift(args.tolerance, chip=args.chip, unit=args.unit, region=args.region,
+                         reference=args.reference, since=args.since, until=args.until)
+        if args.output:
+            df.to_csv(args.output, index=False)
+            print(f"Saved as {args.output}")
+        flagged = df[df["out_of_tolerance"] | df["trim_changed"]]
+        with pd.option_context("display.width", 200, "display.max_rows", 200, "display.max_columns", None):
+            print((df if args.all else flagged).drop(columns=["samples", "settle_time"]))
+        print(f"{len(flagged)} of {len(df)} point(s) out of tolerance or with changed trims")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Columnar index of all lab scan results
+
+Crawls <results root>/<chip>/{FakeHitRateScan,ThresholdScan}/ScanCollection_* and
+writes one Parquet file per ScanCollection, partitioned by chip and scan type:
+
+    <results root>/.results_index/chip=<chip>/scan=<FHR|THR>/<ScanCollection>.parquet
+
+with one row per (result folder, unit, region) as produced by scan_loader, plus
+    varied    True if this region's VCASB changes within the collection
+Re-indexing only reads ScanCollections that are new or modified since they were indexed
+(newest mtime of the collection, its result folders and their json5 files).
+
+    python results_index.py update /home/hipex/MOSS_TEST_RESULTS
+    python results_index.py query  /home/hipex/MOSS_TEST_RESULTS --scan THR --chip W21D4 --unit bb --region 2
+"""
+import argparse
+import glob
+import os
+import time
+
+import pandas as pd
+
+from scan_loader import _folder_files, list_result_folders, load_scan_collections
+
+INDEX_NAME = ".results_index"
+SCAN_FOLDERS = {"FHR": "FakeHitRateScan", "THR": "ThresholdScan"}
+
+
+def collection_mtime(collection):
+    """Newest mtime of a ScanCollection: results written later into a result folder
+    (e.g. analysis_result.json5) do not change the mtime of the collection folder"""
+    paths = [collection]
+    for folder in list_result_folders(collection):
+        paths += [folder, *_folder_files(folder)]
+    return max(os.path.getmtime(path) for path in paths if os.path.exists(path))
+
+
+class ResultsIndex:
+
+    def __init__(self, results_root):
+        self.results_root = results_root
+        self.index_dir = os.path.join(results_root, INDEX_NAME)
+
+    def _partition_file(self, chip, scan, collection):
+        return os.path.join(self.index_dir, f"chip={chip}", f"scan={scan}", f"{collection}.parquet")
+
+    def find_collections(self):
+        """[(chip, scan, collection path)] of every ScanCollection below the results root"""
+        found = []
+        for chip_dir in sorted(glob.glob(os.path.join(self.results_root, "babyMOSS-*"))):
+            for scan, folder in SCAN_FOLDERS.items():
+                for collection in sorted(glob.glob(os.path.join(chip_dir, folder, "ScanCollection_*"))):
+                    if os.path.isdir(collection):
+                        found.append((os.path.basename(chip_dir), scan, collection))
+        return found
+
+    def update(self, full=False, max_workers=None, executor="process"):
+        """Index new or modified ScanCollections, return the number of collections (re)indexed.
+        executor as in load_scan_collections; use "thread" from scripts that are not import-safe."""
+        todo = []
+        for chip, scan, collection in self.find_collections():
+            partition_file = self._partition_file(chip, scan, os.path.basename(collection))
+            if full or not os.path.exists(partition_file) \
+                    or collection_mtime(collection) > os.path.getmtime(partition_file):
+                todo.append((chip, scan, collection))
+        if not todo:
+            return 0
+
+        df = load_scan_collections([collection for _, _, collection in todo], max_workers=max_workers,
+                                   executor=executor, cache=True)
+        for chip, scan, collection in todo:
+            name = os.path.basename(collection)
+            rows = df[(df["chip"] == chip) & (df["collection"] == name)].drop(columns=["chip", "scan"])
+            rows = rows.assign(varied=rows.groupby(["unit", "region"])["VCASB"].transform("nunique") > 1)
+            partition_file = self._partition_file(chip, scan, name)
+            os.makedirs(os.path.dirname(partition_file), exist_ok=True)
+            rows.to_parquet(partition_file, index=False)
+        return len(todo)
+
+    def query(self, chip=None, scan=None, unit=None, region=None, collection=None, varied=None, columns=None):
+        """Rows matching all given filters. chip matches as a substring ("W21D4" -> every W21D4 chip)."""
+        if not os.path.isdir(self.index_dir):
+            raise FileNotFoundError(f"No results index in {self.results_root}, run 'results_index.py update' first")
+        filters = []
+        if scan is not None:
+            filters.append(("scan", "==", scan))
+        if unit is not None:
+            filters.append(("unit", "==", unit))
+        if region is not None:
+            filters.append(("region", "==", region))
+        if collection is not None:
+            filters.append(("collection", "==", collection))
+        if varied is not None:
+            filters.append(("varied", "==", varied))
+        df = pd.read_parquet(self.index_dir, filters=filters or None, columns=columns)
+        if chip is not None:
+            df = df[df["chip"].astype(str).str.contains(chip, regex=False)]
+        # partition columns come last when read back, put them first again
+        leading = [column for column in ("chip", "scan") if column in df.columns]
+        df = df.astype({column: str for column in leading})
+        df = df[leading + [column for column in df.columns if column not in leading]]
+        return df.reset_index(drop=True)
+
+    def varied_collections(self, chip, scan):
+        """{'tb_reg0': collection, ...}: latest ScanCollection in which each region's VCASB was varied.
+        A later partial re-scan wins over an earlier full scan, so callers that had a hand-maintained
+        region -> ScanCollection table should report where the two differ."""
+        df = self.query(chip=chip, scan=scan, varied=True, columns=["chip", "scan", "collection", "unit", "region"])
+        latest = df.groupby(["unit", "region"])["collection"].max()
+        return {f"{unit}_reg{region}": collection for (unit, region), collection in latest.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar index of MOSS_TEST_RESULTS")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update", help="index new or modified ScanCollections")
+    update_parser.add_argument("results_root")
+    update_parser.add_argument("--full", action="store_true", help="re-index everything")
+    query_parser = subparsers.add_parser("query", help="print matching rows")
+    query_parser.add_argument("results_root")
+    query_parser.add_argument("--chip")
+    query_parser.add_argument("--scan", choices=list(SCAN_FOLDERS))
+    query_parser.add_argument("--unit", choices=["tb", "bb"])
+    query_parser.add_argument("--region", type=int)
+    query_parser.add_argument("--varied", action="store_true", help="only rows whose region VCASB was varied")
+    args = parser.parse_args()
+
+    index = ResultsIndex(args.results_root)
+    start = time.perf_counter()
+    if args.command == "update":
+        n_indexed = index.update(full=args.full)
+        print(f"{n_indexed} ScanCollection(s) indexed in {time.perf_counter() - start:.2f} s")
+    else:
+        df = index.query(chip=args.chip, scan=args.scan, unit=args.unit, region=args.region,
+                         varied=True if args.varied else None)
+        elapsed = time.perf_counter() - start
+        with pd.option_context("display.width", 200, "display.max_rows", 200):
+            print(df)
+        print(f"{len(df)} row(s) in {elapsed*1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
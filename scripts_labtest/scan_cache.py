@@ -0,0 +1,167 @@
+"""
+Persistent cache of parsed scan_config.json5 / analysis_result.json5 files
+
+Only the fields used by the lab scripts are stored (VCASB per unit, FakeHitRate,
+Threshold/Noise average per region), in an SQLite file under the results tree,
+keyed by file path, mtime and size. A file is re-parsed only when it is new or changed.
+
+    python scan_cache.py stats   <path under the results tree>
+    python scan_cache.py bench   <ScanCollection> [<ScanCollection> ...]   # cold vs warm load
+    python scan_cache.py invalidate <path> [<path> ...]                    # drop entries below path
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+
+import json5
+
+CACHE_NAME = ".scan_cache.sqlite"
+# the chip folder itself (babyMOSS-2_4_W21D4), not its babyMOSS-2_4_W21D4_ThresholdScan_001 collections
+CHIP_FOLDER = re.compile(r"babyMOSS-[^_/]+_[^_/]+_[^_/]+")
+ANALYSIS_KEYS = ("FakeHitRate", "Threshold average per region", "Noise average per region")
+
+
+def default_cache_path(path):
+    """<results root>/.scan_cache.sqlite, the results root being the parent of the babyMOSS-* chip folder"""
+    path = os.path.abspath(path)
+    probe = path
+    while os.path.dirname(probe) != probe:
+        if CHIP_FOLDER.fullmatch(os.path.basename(probe)):
+            return os.path.join(os.path.dirname(probe), CACHE_NAME)
+        probe = os.path.dirname(probe)
+    return os.path.join(path if os.path.isdir(path) else os.path.dirname(path), CACHE_NAME)
+
+
+def extract_config(config_data):
+    """VCASB per unit from scan_config.json5, in the same nesting as the file"""
+    return {"moss_dac_settings": {unit: {"VCASB": settings["VCASB"]}
+                                  for unit, settings in config_data.get("moss_dac_settings", {}).items()
+                                  if isinstance(settings, dict) and "VCASB" in settings}}
+
+
+def extract_analysis(analysis_data):
+    """Per-region results from analysis_result.json5, in the same nesting as the file"""
+    return {unit: {key: values[key] for key in ANALYSIS_KEYS if key in values}
+            for unit, values in analysis_data.items() if isinstance(values, dict)}
+
+
+def parse_file(path, kind):
+    with open(path, "r") as f:
+        data = json5.load(f)
+    return extract_config(data) if kind == "config" else extract_analysis(data)
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class ScanCache:
+    """SQLite-backed cache of the extracted fields, one row per file"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, kind TEXT, data TEXT)"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_path(cls, path):
+        """Cache of the results tree containing path, None if it cannot be created (e.g. read-only)"""
+        try:
+            return cls(default_cache_path(path))
+        except sqlite3.Error as e:
+            print(f"Scan cache disabled ({e})")
+            return None
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, path):
+        """Cached fields if path is unchanged since it was stored, else None"""
+        abspath, mtime_ns, size = file_key(path)
+        row = self.connection.execute(
+            "SELECT data FROM files WHERE path = ? AND mtime_ns = ? AND size = ?", (abspath, mtime_ns, size)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def store(self, path, kind, data, commit=True):
+        abspath, mtime_ns, size = file_key(path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (path, mtime_ns, size, kind, data) VALUES (?, ?, ?, ?, ?)",
+            (abspath, mtime_ns, size, kind, json.dumps(data)),
+        )
+        if commit:
+            self.connection.commit()
+
+    def commit(self):
+        self.connection.commit()
+
+    def load(self, path, kind):
+        """Cached fields of path, parsed and stored on a miss"""
+        data = self.lookup(path)
+        if data is None:
+            data = parse_file(path, kind)
+            self.store(path, kind, data)
+        return data
+
+    def invalidate(self, prefix=None):
+        """Drop all entries below prefix (everything if None), return the number of dropped entries"""
+        if prefix is None:
+            cursor = self.connection.execute("DELETE FROM files")
+        else:
+            prefix = os.path.abspath(prefix)
+            cursor = self.connection.execute(
+                "DELETE FROM files WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (prefix, prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + os.sep + "%"),
+            )
+        self.connection.commit()
+        return cursor.rowcount
+
+    def stats(self):
+        return dict(self.connection.execute("SELECT kind, COUNT(*) FROM files GROUP BY kind").fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parsed scan results cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("stats", "number of cached files"),
+                               ("bench", "time a cold and a warm load of ScanCollections"),
+                               ("invalidate", "drop cached entries below the given paths")):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument("paths", nargs="+")
+        subparser.add_argument("--cache", default=None, help="cache file (default: <results root>/" + CACHE_NAME + ")")
+    args = parser.parse_args()
+
+    cache = ScanCache(args.cache or default_cache_path(args.paths[0]))
+    print(f"cache: {cache.db_path}")
+    if args.command == "stats":
+        print(cache.stats())
+    elif args.command == "invalidate":
+        for path in args.paths:
+            print(f"{path}: {cache.invalidate(path)} entries dropped")
+    elif args.command == "bench":
+        from scan_loader import load_scan_collections  # pylint: disable=import-outside-toplevel
+        for path in args.paths:
+            cache.invalidate(path)
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            df = load_scan_collections(args.paths, cache=cache)
+            print(f"{label}: {len(df)} rows in {time.perf_counter() - start:.3f} s")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Parallel loader for ScanCollection folders (FakeHitRateScan / ThresholdScan)
+
+    <ScanCollection>/<result folder>/config/scan_config.json5
+    <ScanCollection>/<result folder>/analysis/analysis_result.json5
+
+Folders are listed with os.scandir and parsed concurrently. The result is one
+tidy DataFrame with a row per (result folder, unit, region):
+    chip, scan, collection, folder, unit, region, VCASB, FHR, THR, Noise
+Folders with missing files are reported and skipped, as in
+vcasb2threshold.process_folder.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from scan_cache import ScanCache, parse_file
+
+COLUMNS = ["chip", "scan", "collection", "folder", "unit", "region", "VCASB", "FHR", "THR", "Noise"]
+UNITS = ("tb", "bb")
+
+
+def chip_from_path(path):
+    """babyMOSS-2_4_W21D4 from any path below the chip's results folder"""
+    match = re.search(r"babyMOSS-[^/_]+_[^/_]+_[^/_]+", path)
+    return match.group(0) if match else None
+
+
+def list_result_folders(collection_path):
+    """Sorted result folders of one ScanCollection (no shell, no ls)"""
+    try:
+        with os.scandir(collection_path) as entries:
+            return sorted(entry.path for entry in entries if entry.is_dir())
+    except FileNotFoundError:
+        print(f"Missing collection folder: {collection_path}")
+        return []
+
+
+def _folder_files(folder_path):
+    return (os.path.join(folder_path, "config", "scan_config.json5"),
+            os.path.join(folder_path, "analysis", "analysis_result.json5"))
+
+
+def parse_folder_fields(folder_path):
+    """(folder, config fields, analysis fields) of one result folder, fields None if incomplete"""
+    config_file, analysis_file = _folder_files(folder_path)
+    if not os.path.exists(config_file) or not os.path.exists(analysis_file):
+        print(f"Missing files in folder: {folder_path}")
+        return folder_path, None, None
+
+    try:
+        return folder_path, parse_file(config_file, "config"), parse_file(analysis_file, "analysis")
+    except ValueError as e:  # partially written json5
+        print(f"Cannot parse results in folder: {folder_path} ({e})")
+        return folder_path, None, None
+
+
+def parse_result_folder(folder_path):
+    """Rows of one result folder, [] if the folder is incomplete"""
+    _, config_data, analysis_data = parse_folder_fields(folder_path)
+    if config_data is None:
+        return []
+    return rows_from_results(folder_path, config_data, analysis_data)
+
+
+def rows_from_results(folder_path, config_data, analysis_data):
+    """Turn one parsed scan_config/analysis_result pair into tidy rows"""
+    collection_path = os.path.dirname(folder_path)
+    scan = "THR" if "ThresholdScan" in folder_path else "FHR"
+    rows = []
+    for unit in UNITS:
+        if unit not in analysis_data or unit not in config_data.get("moss_dac_settings", {}):
+            continue
+        vcasb = config_data["moss_dac_settings"][unit]["VCASB"]
+        fhr = analysis_data[unit].get("FakeHitRate")
+        thr = analysis_data[unit].get("Threshold average per region")
+        noise = analysis_data[unit].get("Noise average per region")
+        for region in range(len(vcasb)):
+            rows.append({
+                "chip": chip_from_path(folder_path),
+                "scan": scan,
+                "collection": os.path.basename(collection_path),
+                "folder": os.path.basename(folder_path),
+                "unit": unit,
+                "region": region,
+                "VCASB": vcasb[region],
+                "FHR": fhr[region] if fhr is not None else None,
+                "THR": thr[region] if thr is not None else None,
+                "Noise": noise[region] if noise is not None else None,
+            })
+    return rows
+
+
+def _cached_fields(cache, folder_path):
+    """(config, analysis) fields from the cache, None if either file is new, changed or missing"""
+    config_file, analysis_file = _folder_files(folder_path)
+    if not os.path.exists(config_file) or not os.path.exists(analysis_file):
+        return None
+    config_data = cache.lookup(config_file)
+    analysis_data = cache.lookup(analysis_file) if config_data is not None else None
+    if analysis_data is None:
+        return None
+    return config_data, analysis_data
+
+
+def load_scan_collections(collection_paths, max_workers=None, executor="process", cache=None):
+    """Load all result folders of the given ScanCollections into one DataFrame.
+    executor: "process" (json5 parsing is CPU bound) or "thread".
+    cache: ScanCache, True for the default cache of the results tree, or None.
+    Only folders that are not (or no longer) in the cache are parsed."""
+    folders = [folder for path in collection_paths for folder in list_result_folders(path)]
+    if not folders:
+        return pd.DataFrame(columns=COLUMNS)
+    if cache is True:
+        cache = ScanCache.for_path(folders[0])
+
+    parsed, todo = [], []
+    for folder in folders:
+        fields = _cached_fields(cache, folder) if cache is not None else None
+        if fields is None:
+            todo.append(folder)
+        else:
+            parsed.append((folder, *fields))
+
+    if todo:
+        pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        with pool_class(max_workers=max_workers) as pool:
+            chunksize = max(1, len(todo) // (4 * (max_workers or os.cpu_count() or 1)))
+            fresh = list(pool.map(parse_folder_fields, todo, chunksize=chunksize))
+        parsed.extend(fresh)
+        if cache is not None:
+            # single writer: the workers only parse, the cache is filled here
+            for folder, config_data, analysis_data in fresh:
+                if config_data is not None:
+                    config_file, analysis_file = _folder_files(folder)
+                    cache.store(config_file, "config", config_data, commit=False)
+                    cache.store(analysis_file, "analysis", analysis_data, commit=False)
+            cache.commit()
+    if cache is not None:
+        print(f"Scan cache: {len(folders) - len(todo)} folder(s) cached, {len(todo)} parsed")
+
+    rows = [row for folder, config_data, analysis_data in sorted(parsed, key=lambda item: item[0])
+            if config_data is not None
+            for row in rows_from_results(folder, config_data, analysis_data)]
+    return pd.DataFrame(rows, columns=COLUMNS)
@@ -0,0 +1,91 @@
+"""
+Persistent results of the scans run by vcasb_range_finder.py
+
+Every successful scan is appended as one JSON line to <session dir>/scan_results.jsonl
+as soon as its analysis is done, keyed by the scan type and a hash of the canonical
+(sorted-key) JSON of its generated config:
+
+    {"key": ..., "scan": "FakeHitRateScan", "time": 1741430400.0, "value": [...], "config": ..., "output_dir": ...}
+
+A session started again on the same directory (--resume) skips every scan already in the
+file; results of other sessions can be reused as well if they are not older than max_age_s.
+Failed scans are not stored, so they are always repeated.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+
+FILE_NAME = "scan_results.jsonl"
+
+
+def config_key(scan_name: str, config: dict) -> str:
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(f"{scan_name}|{canonical}".encode()).hexdigest()
+
+
+def read_entries(path: str) -> list[dict]:
+    """Entries of one scan_results.jsonl; a line cut off by a crash is skipped"""
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries
+
+
+class ScanMemo:
+
+    def __init__(self, session_dir: str, reuse_dirs: tuple = (), max_age_s: float | None = None):
+        self.path = os.path.join(session_dir, FILE_NAME)
+        self.entries = {}
+        self.hits = 0
+        now = time.time()
+        for reuse_dir in reuse_dirs:
+            path = os.path.join(reuse_dir, FILE_NAME)
+            if os.path.abspath(path) == os.path.abspath(self.path) or not os.path.exists(path):
+                continue
+            for entry in read_entries(path):
+                if max_age_s is None or now - entry["time"] <= max_age_s:
+                    self.entries[entry["key"]] = entry
+        if os.path.exists(self.path):
+            for entry in read_entries(self.path):
+                self.entries[entry["key"]] = entry
+        logging.getLogger(__name__).info(f"{len(self.entries)} stored scan result(s) available")
+
+    @classmethod
+    def for_session(cls, session_dir: str, reuse_max_age_s: float | None = None):
+        """Memo of a session directory; with reuse_max_age_s, also of its sibling sessions"""
+        reuse_dirs = ()
+        if reuse_max_age_s is not None:
+            reuse_dirs = sorted(glob.glob(os.path.join(os.path.dirname(os.path.normpath(session_dir)), "*")))
+        return cls(session_dir, reuse_dirs, reuse_max_age_s)
+
+    def get(self, scan_name: str, config: dict = None, key: str = None):
+        """Stored value of this scan, None if it has not been run.
+        key: config_key() computed beforehand, instead of config"""
+        entry = self.entries.get(key or config_key(scan_name, config))
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry["value"]
+
+    def put(self, scan_name: str, config: dict, value, config_path: str = None, output_dir: str = None,
+            key: str = None):
+        entry = {
+            "key": key or config_key(scan_name, config),
+            "scan": scan_name,
+            "time": time.time(),
+            "value": value,
+            "config": config_path,
+            "output_dir": output_dir,
+        }
+        self.entries[entry["key"]] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,207 @@
+"""
+Per-pixel S-curve fits of ThresholdScan raw data
+
+Raw hit counts of one result folder are read as memory-mapped .npy files:
+
+    <result folder>/raw/charges.npy               injected charge per step (e-), shape (n_steps,)
+    <result folder>/raw/<unit>_region<r>_hits.npy  hits per step and pixel, shape (n_steps, n_rows, n_cols)
+
+and the number of injections per step from "n_injections" in config/scan_config.json5.
+All pixels of a region are fitted at once with
+
+    hits / n_injections = 0.5 * (1 + erf((charge - threshold) / (sqrt(2) * noise)))
+
+starting from the derivative-method estimate and refined with a few damped Gauss-Newton steps
+done on whole pixel arrays. Pixels that never reach 50 % (or start above it) are left NaN.
+
+    python scurve_fit.py <result folder>                     # region distributions, maps in analysis/scurve_maps_<unit>_region<r>.npz
+    python scurve_fit.py <ScanCollection> --collection       # every folder, then VCASB -> threshold fits
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import json5
+import numpy as np
+import pandas as pd
+from scipy.special import erf
+
+from vcasb2threshold import fit_vcasb_threshold
+
+UNITS = ("tb", "bb")
+N_REGIONS = 4
+SQRT2 = np.sqrt(2.0)
+
+
+def raw_dir(folder_path):
+    return os.path.join(folder_path, "raw")
+
+
+def read_n_injections(folder_path, default=None):
+    config_file = os.path.join(folder_path, "config", "scan_config.json5")
+    with open(config_file, "r") as f:
+        config_data = json5.load(f)
+    n_injections = config_data.get("n_injections", default)
+    if n_injections is None:
+        raise KeyError(f"No n_injections in {config_file}, give it with --n-injections")
+    return n_injections
+
+
+def read_vcasb(folder_path):
+    """{unit: [VCASB per region]} from config/scan_config.json5"""
+    with open(os.path.join(folder_path, "config", "scan_config.json5"), "r") as f:
+        config_data = json5.load(f)
+    return {unit: settings["VCASB"] for unit, settings in config_data["moss_dac_settings"].items()}
+
+
+def load_region(folder_path, unit, region):
+    """(charges, hits) of one region, hits memory-mapped with shape (n_steps, n_rows, n_cols)"""
+    charges = np.load(os.path.join(raw_dir(folder_path), "charges.npy")).astype(float)
+    hits = np.load(os.path.join(raw_dir(folder_path), f"{unit}_region{region}_hits.npy"), mmap_mode="r")
+    if hits.shape[0] != len(charges):
+        raise ValueError(f"{unit} region {region}: {hits.shape[0]} hit steps for {len(charges)} charges")
+    return charges, hits
+
+
+def derivative_init(charges, fraction):
+    """Threshold and noise from the mean and RMS of d(fraction)/d(charge); fraction is (n_steps, n_pixels)"""
+    midpoints = 0.5 * (charges[1:] + charges[:-1])[:, None]
+    weights = np.clip(np.diff(fraction, axis=0), 0, None)
+    total = weights.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        threshold = (weights * midpoints).sum(axis=0) / total
+        noise = np.sqrt((weights * (midpoints - threshold)**2).sum(axis=0) / total)
+    return threshold, noise
+
+
+def fit_scurves(charges, hits, n_injections, iterations=6, chunk_size=1 << 15):
+    """Per-pixel threshold and noise maps (NaN where the fit is not possible) of one region.
+    hits is (n_steps, n_rows, n_cols) and may be a memmap; pixels are processed in chunks."""
+    n_steps = hits.shape[0]
+    flat_hits = hits.reshape(n_steps, -1)
+    n_pixels = flat_hits.shape[1]
+    threshold_map = np.full(n_pixels, np.nan)
+    noise_map = np.full(n_pixels, np.nan)
+    q = charges[:, None]
+    min_noise = 0.1 * np.min(np.diff(charges))
+    for start in range(0, n_pixels, chunk_size):
+        fraction = np.asarray(flat_hits[:, start:start + chunk_size], dtype=float) / n_injections
+        good = (fraction[0] < 0.5) & (fraction[-1] >= 0.5)
+        fraction = fraction[:, good]
+        threshold, noise = derivative_init(charges, fraction)
+        noise = np.maximum(np.nan_to_num(noise, nan=min_noise), min_noise)
+
+        damping = np.full(threshold.shape, 1e-3)
+        for _ in range(iterations):
+            z = (q - threshold) / (SQRT2 * noise)
+            residual = fraction - 0.5 * (1 + erf(z))
+            gauss = np.exp(-z**2) / np.sqrt(np.pi)
+            jac_t = -gauss / (SQRT2 * noise)
+            jac_s = -gauss * z / noise
+            a = (jac_t**2).sum(axis=0)
+            b = (jac_t * jac_s).sum(axis=0)
+            c = (jac_s**2).sum(axis=0)
+            g_t = (jac_t * residual).sum(axis=0)
+            g_s = (jac_s * residual).sum(axis=0)
+            a, c = a * (1 + damping), c * (1 + damping)
+            det = a * c - b**2
+            with np.errstate(invalid="ignore", divide="ignore"):
+                step_t = np.nan_to_num((c * g_t - b * g_s) / det)
+                step_s = np.nan_to_num((a * g_s - b * g_t) / det)
+            new_threshold = threshold + step_t
+            new_noise = np.maximum(noise + step_s, min_noise)
+            new_residual = fraction - 0.5 * (1 + erf((q - new_threshold) / (SQRT2 * new_noise)))
+            better = (new_residual**2).sum(axis=0) <= (residual**2).sum(axis=0)
+            threshold = np.where(better, new_threshold, threshold)
+            noise = np.where(better, new_noise, noise)
+            damping = np.where(better, damping * 0.3, damping * 10)
+
+        inside = (threshold >= charges[0]) & (threshold <= charges[-1])
+        pixel_index = np.flatnonzero(good) + start
+        threshold_map[pixel_index] = np.where(inside, threshold, np.nan)
+        noise_map[pixel_index] = np.where(inside, noise, np.nan)
+    return threshold_map.reshape(hits.shape[1:]), noise_map.reshape(hits.shape[1:])
+
+
+def region_summary(threshold_map, noise_map):
+    """Distribution of the fitted pixels of one region"""
+    fitted = np.isfinite(threshold_map)
+    return {
+        "Threshold": float(np.mean(threshold_map[fitted])) if fitted.any() else np.nan,
+        "Threshold_rms": float(np.std(threshold_map[fitted])) if fitted.any() else np.nan,
+        "Threshold_median": float(np.median(threshold_map[fitted])) if fitted.any() else np.nan,
+        "Noise": float(np.mean(noise_map[fitted])) if fitted.any() else np.nan,
+        "Noise_rms": float(np.std(noise_map[fitted])) if fitted.any() else np.nan,
+        "n_fitted": int(fitted.sum()),
+        "n_failed": int((~fitted).sum()),
+    }
+
+
+def fit_region(folder_path, unit, region, n_injections, save_maps=True):
+    """Fit one region, save its maps next to the analysis results and return the region summary"""
+    start = time.perf_counter()
+    charges, hits = load_region(folder_path, unit, region)
+    threshold_map, noise_map = fit_scurves(charges, hits, n_injections)
+    if save_maps:
+        np.savez_compressed(os.path.join(folder_path, "analysis", f"scurve_maps_{unit}_region{region}.npz"),
+                            threshold=threshold_map, noise=noise_map)
+    summary = region_summary(threshold_map, noise_map)
+    summary.update(region=f"{unit}{region}", fit_time_s=time.perf_counter() - start)
+    return summary
+
+
+def analyse_folder(folder_path, n_injections=None, max_workers=None, save_maps=True):
+    """Region distributions of one ThresholdScan result folder as a DataFrame, one row per region,
+    with the VCASB of the scan; regions run in parallel on max_workers processes"""
+    n_injections = read_n_injections(folder_path, n_injections)
+    vcasb = read_vcasb(folder_path)
+    tasks = [(unit, region) for unit in UNITS for region in range(N_REGIONS)
+             if os.path.exists(os.path.join(raw_dir(folder_path), f"{unit}_region{region}_hits.npy"))]
+    if max_workers == 1:
+        summaries = [fit_region(folder_path, unit, region, n_injections, save_maps) for unit, region in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            summaries = list(pool.map(fit_region, [folder_path] * len(tasks), *zip(*tasks),
+                                      [n_injections] * len(tasks), [save_maps] * len(tasks)))
+    df = pd.DataFrame(summaries)
+    df.insert(0, "VCASB", [vcasb[unit][region] for unit, region in tasks])
+    df.insert(0, "folder", os.path.basename(folder_path))
+    return df
+
+
+def analyse_collection(scan_collection_folder, n_injections=None, max_workers=None, save_maps=True):
+    """analyse_folder for every result folder with raw data, plus the VCASB -> threshold fits of the
+    pixel-level region means; returns (per-folder DataFrame, fits)"""
+    folders = sorted(os.path.dirname(os.path.dirname(path)) for path in
+                     glob.glob(os.path.join(scan_collection_folder, "*", "raw", "charges.npy")))
+    if not folders:
+        raise FileNotFoundError(f"No raw ThresholdScan data in {scan_collection_folder}")
+    data = pd.concat([analyse_folder(folder, n_injections, max_workers, save_maps) for folder in folders],
+                     ignore_index=True)
+    return data, fit_vcasb_threshold(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-pixel S-curve fits of ThresholdScan raw data")
+    parser.add_argument("path", help="ThresholdScan result folder (or ScanCollection with --collection)")
+    parser.add_argument("--collection", action="store_true", help="path is a ScanCollection, fit VCASB -> threshold")
+    parser.add_argument("--n-injections", type=int, default=None, help="if not in scan_config.json5")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (regions in parallel)")
+    parser.add_argument("--no-maps", action="store_true", help="do not save the per-pixel maps")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        if args.collection:
+            data, fits = analyse_collection(args.path, args.n_injections, args.jobs, not args.no_maps)
+            print(data)
+            print(fits[["region", "slope", "intercept", "chi2_ndf", "outlier"]])
+        else:
+            print(analyse_folder(args.path, args.n_injections, args.jobs, not args.no_maps))
+    print(f"Total {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
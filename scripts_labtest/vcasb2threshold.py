@@ -5,16 +5,20 @@ import re
 import glob
 import csv
 import configparser
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from scan_cache import ScanCache
+
 
 
 
 # Function to process each folder and extract VCASB and Thresholds
-def process_folder(folder_path):
+def process_folder(folder_path, cache=None):
     # Paths to the JSON files
     config_file = os.path.join(folder_path, "config", "scan_config.json5")
     analysis_file = os.path.join(folder_path, "analysis", "analysis_result.json5")
@@ -25,17 +29,23 @@ def process_folder(folder_path):
         print(f"Missing files in folder: {folder_path}")
         return None
     
-    # Load scan_config.json5
-    with open(config_file, 'r') as f:
-        config_data = json5.load(f)
+    # Load scan_config.json5 (only re-parsed if new or changed when a cache is given)
+    if cache is not None:
+        config_data = cache.load(config_file, "config")
+    else:
+        with open(config_file, 'r') as f:
+            config_data = json5.load(f)
     
     # Extract VCASB values from the config
     vcasb_tb = config_data['moss_dac_settings']['tb']['VCASB']
     vcasb_bb = config_data['moss_dac_settings']['bb']['VCASB']
     
     # Load analysis_result.json5
-    with open(analysis_file, 'r') as f:
-        analysis_data = json5.load(f)
+    if cache is not None:
+        analysis_data = cache.load(analysis_file, "analysis")
+    else:
+        with open(analysis_file, 'r') as f:
+            analysis_data = json5.load(f)
     
     # Extract Threshold averages for each region from 'tb' and 'bb'
     threshold_tb = analysis_data['tb']['Threshold average per region']
@@ -67,31 +77,38 @@ def process_folder(folder_path):
 
     return results
 
+def moss_id_from_path(scan_collection_folder):
+    """babyMOSS-2_4_W21D4 from .../babyMOSS-2_4_W21D4/ThresholdScan/ScanCollection_..."""
+    match = re.search(r'babyMOSS-[^/]+', scan_collection_folder)
+    if not match:
+        raise ValueError(f"No babyMOSS-* chip ID in {scan_collection_folder}")
+    return match.group(0)
+
+
 # Main function to iterate over all folders and process them
-def extract_vcasb_threshold(scan_collection_folder, csv=False):
+def extract_vcasb_threshold(scan_collection_folder, csv=False, use_cache=True, moss_id=None):
     
-    global MOSS_ID 
-    match = re.search(r'babyMOSS-[^/]+', scan_collection_folder)
-    if match:
-        MOSS_ID = match.group(0)
-        print(MOSS_ID)
-    else:  
-        print("error")
+    moss_id = moss_id or moss_id_from_path(scan_collection_folder)
+    print(moss_id)
 
-    scan_folders = glob.glob(os.path.join(scan_collection_folder, f'{MOSS_ID}_ThresholdScan_*'))
+    scan_folders = glob.glob(os.path.join(scan_collection_folder, f'{moss_id}_ThresholdScan_*'))
     
     all_results = []
+    cache = ScanCache.for_path(scan_collection_folder) if use_cache else None
     
     # Process each folder
     for folder in scan_folders:
         #print(f"Processing folder: {folder}")
-        results = process_folder(folder)
+        results = process_folder(folder, cache)
         if results:
             all_results.extend(results)
+    if cache is not None:
+        print(f"Scan cache: {cache.hits} file(s) cached, {cache.misses} parsed")
+        cache.close()
     
     # Save the results to a CSV file
     if csv:
-        output_file = os.path.join(scan_collection_folder, f"{MOSS_ID}_vcasb_threshold_results.csv")
+        output_file = os.path.join(scan_collection_folder, f"{moss_id}_vcasb_threshold_results.csv")
         with open(output_file, 'w', newline='') as f:
             writer = csv.DictWriter(f, fieldnames=['VCASB', 'region', 'Threshold', 'Noise'])
             writer.writeheader()
@@ -100,86 +117,132 @@ def extract_vcasb_threshold(scan_collection_folder, csv=False):
 
     return pd.DataFrame(all_results)
 
-#def draw_vcasb_threshold(scan_collection_folder, print=False):
-def draw_vcasb_threshold(data, fig=False):
-    colors = {
-        'tb0': 'red',
-        'tb1': 'orange',
-        'tb2': 'gold',
-        'tb3': 'darkkhaki',
-        'bb0': 'green',
-        'bb1': 'blue',
-        'bb2': 'indigo',
-        'bb3': 'purple'
-    }   
-    fit_parameters = {}
-    #csv_file = os.path.join(scan_collection_folder, "vcasb_threshold_results.csv")
-    #data = pd.read_csv(csv_file)
-
-    plt.figure(figsize=(10, 6))
-
-    vcasb_values = sorted(data['VCASB'].astype(int).unique())
-
-    regions_tb = [region for region in data['region'].unique() if 'tb' in region]
-    regions_bb = [region for region in data['region'].unique() if 'bb' in region]
-
-    # Plot for tb regions
-    for region in regions_tb:
-        region_data = data[data['region'] == region].sort_values(by='VCASB')
-        x = region_data['VCASB']
-        y = region_data['Threshold']
-        y_err = region_data['Noise']
-
-        region_color = colors.get(region, 'black')
-
-
-        coeffs = np.polyfit(x, y, deg=1) 
-        fit_func = np.poly1d(coeffs)
-        slope = coeffs[0]  
-        intercept = coeffs[1]  
-        fit_parameters[region] = {'slope': slope, 'intercept': intercept}
+REGION_COLORS = {
+    'tb0': 'red',
+    'tb1': 'orange',
+    'tb2': 'gold',
+    'tb3': 'darkkhaki',
+    'bb0': 'green',
+    'bb1': 'blue',
+    'bb2': 'indigo',
+    'bb3': 'purple'
+}
+
+
+def _region_order(region):
+    # tb0..tb3 first, then bb0..bb3
+    return (0 if region.startswith('tb') else 1, region)
+
+
+def fit_vcasb_threshold(data, group_cols=None, outlier_pull=3.0, max_chi2_ndf=3.0):
+    """Weighted linear fit Threshold = slope * VCASB + intercept for every region (and chip) at once.
+
+    Each point is weighted with 1/Noise^2; non-positive or missing noise is replaced by the
+    median noise of its region. All groups are solved together from their weighted sums
+    (closed-form normal equations), no per-region loop.
+    group_cols defaults to ['chip', 'region'] if data has a 'chip' column, else ['region'].
+
+    Returns one row per group: slope, intercept, their errors and covariance, chi2, ndf,
+    chi2_ndf, n_points, n_outliers (points with |pull| > outlier_pull) and outlier
+    (any outlier point, or chi2_ndf above max_chi2_ndf; the default of 3 is a p-value of about
+    0.01 at ndf = 5 and smaller for longer scans). Groups with fewer than two
+    distinct VCASB values cannot be fitted: their fit columns are NaN."""
+    if group_cols is None:
+        group_cols = ['chip', 'region'] if 'chip' in data.columns else ['region']
+    df = data[group_cols + ['VCASB', 'Threshold', 'Noise']].copy()
+    df['VCASB'] = df['VCASB'].astype(float)
+    df['Threshold'] = df['Threshold'].astype(float)
+
+    noise = df['Noise'].astype(float).where(df['Noise'] > 0)
+    noise = noise.fillna(noise.groupby([df[col] for col in group_cols]).transform('median')).fillna(1.0)
+    w = 1.0 / noise**2
+    x, y = df['VCASB'], df['Threshold']
+
+    sums = pd.DataFrame({'S': w, 'Sx': w * x, 'Sy': w * y, 'Sxx': w * x * x, 'Sxy': w * x * y, 'n_points': 1})
+    sums[group_cols] = df[group_cols]
+    sums = sums.groupby(group_cols, sort=False).sum()
+
+    det = sums['S'] * sums['Sxx'] - sums['Sx']**2
+    n_vcasb = df.groupby(group_cols, sort=False)['VCASB'].nunique()
+    degenerate = n_vcasb.reindex(sums.index) < 2
+    for group in sums.index[degenerate]:
+        print(f"WARNING: {group}: fewer than two VCASB values, no fit")
+    det = det.where(~degenerate)
+    fits = pd.DataFrame(index=sums.index)
+    fits['slope'] = (sums['S'] * sums['Sxy'] - sums['Sx'] * sums['Sy']) / det
+    fits['intercept'] = (sums['Sxx'] * sums['Sy'] - sums['Sx'] * sums['Sxy']) / det
+    fits['slope_err'] = np.sqrt(sums['S'] / det)
+    fits['intercept_err'] = np.sqrt(sums['Sxx'] / det)
+    fits['cov_slope_intercept'] = -sums['Sx'] / det
+
+    # pulls of every point against its own region's fit
+    point_fit = fits.reindex(pd.MultiIndex.from_frame(df[group_cols]) if len(group_cols) > 1 else df[group_cols[0]])
+    pulls = (y.to_numpy() - (point_fit['slope'].to_numpy() * x.to_numpy() + point_fit['intercept'].to_numpy())) \
+        / noise.to_numpy()
+    per_point = pd.DataFrame({'chi2': pulls**2, 'n_outliers': np.abs(pulls) > outlier_pull})
+    per_point[group_cols] = df[group_cols].to_numpy()
+    per_point = per_point.groupby(group_cols, sort=False).sum()
+
+    fits['chi2'] = per_point['chi2'].where(~degenerate)
+    fits['ndf'] = sums['n_points'] - 2
+    fits['chi2_ndf'] = fits['chi2'] / fits['ndf'].where(fits['ndf'] > 0)
+    fits['n_points'] = sums['n_points']
+    fits['n_outliers'] = per_point['n_outliers'].astype(int)
+    fits['outlier'] = (fits['n_outliers'] > 0) | (fits['chi2_ndf'] > max_chi2_ndf)
+
+    fits = fits.reset_index()
+    fits['_order'] = fits['region'].map(_region_order)
+    return fits.sort_values([col for col in group_cols if col != 'region'] + ['_order']) \
+        .drop(columns='_order').reset_index(drop=True)
+
+
+def fit_parameters_from(fits):
+    """{region: {'slope', 'intercept'}} as used by the save_* functions and config generators.
+    Regions without a fit (NaN slope) are left out."""
+    return {row.region: {'slope': row.slope, 'intercept': row.intercept} for row in fits.itertuples()
+            if np.isfinite(row.slope)}
 
-        y_fit = fit_func(x)
-        residuals = (y - y_fit) / y_err
-        chi2 = np.sum(residuals**2)
-        ndf = len(x) - (1+1)
-        chi2_ndf = chi2 / ndf
-
-        plt.errorbar(x, y, yerr=y_err, 
-                    label=f'{region}: y = {slope:.2f}x + {intercept:.2f}    chi2 = {chi2:.3f}', 
-                    linestyle=' ', marker='o', color = region_color)
-        plt.plot(x, fit_func(x), color = region_color)
 
-    # Plot for bb regions
-    for region in regions_bb:
-        region_data = data[data['region'] == region].sort_values(by='VCASB')
+#def draw_vcasb_threshold(scan_collection_folder, print=False):
+def draw_vcasb_threshold(data, fig=False, fits=None, fig_name=None, show=True, calibration=None):
+    """Fit (if fits is not given) and, only if fig is set, draw and save VCASB vs threshold of one chip
+    as fig_name (show it as well unless show=False). With a dac_calibration.DacCalibration of the chip,
+    VCASB is drawn in mV and the legend gives the fitted lines per mV."""
+    if fits is None:
+        fits = fit_vcasb_threshold(data)
+    fit_parameters = fit_parameters_from(fits)
+    if not fig:
+        return fit_parameters
+
+    figure = plt.figure(figsize=(10, 6))
+
+    for row in fits.itertuples():
+        region_data = data[data['region'] == row.region].sort_values(by='VCASB')
         x = region_data['VCASB']
         y = region_data['Threshold']
         y_err = region_data['Noise']
-        region_color = colors.get(region, 'black')
-
-        coeffs = np.polyfit(x, y, deg=1) 
-        fit_func = np.poly1d(coeffs)
-        slope = coeffs[0]  
-        intercept = coeffs[1]  
-        fit_parameters[region] = {'slope': slope, 'intercept': intercept}
-
-        y_fit = fit_func(x)
-        residuals = (y - y_fit) / y_err
-        chi2 = np.sum(residuals**2)
-        #pearson = (y-y_fit)**2 / y_fit
-        #chi2 = np.sum(pearson)
-        ndf = len(x) - (1+1)
-        chi2_ndf = chi2 / ndf
-
-        plt.errorbar(x, y, yerr=y_err, 
-                    label=f'{region}: y = {slope:.2f}x + {intercept:.2f}    chi2 = {chi2:.3f}', 
+        region_color = REGION_COLORS.get(row.region, 'black')
+        # DAC code -> mV (tb0 -> unit tb, region 0)
+        x_draw = x if calibration is None else calibration.to_physical(row.region[:2], int(row.region[2:]), 'VCASB', x) * 1e3
+
+        if not np.isfinite(row.slope):
+            plt.errorbar(x_draw, y, yerr=y_err, label=f'{row.region}: no fit', linestyle=' ', marker='o',
+                         color=region_color)
+            continue
+        slope, intercept, digits = row.slope, row.intercept, 2
+        if calibration is not None:
+            # same line in mV, through the linear fit of the DAC: mV = offset + gain * code
+            curve = calibration.region(row.region[:2], int(row.region[2:]), 'VCASB')
+            gain_mv, offset_mv = curve['gain'] * 1e3, curve['offset'] * 1e3
+            slope, intercept, digits = row.slope / gain_mv, row.intercept - row.slope * offset_mv / gain_mv, 3
+        plt.errorbar(x_draw, y, yerr=y_err, 
+                    label=f'{row.region}: y = {slope:.{digits}f}x + {intercept:.2f}    chi2 = {row.chi2:.3f}', 
                     linestyle=' ', marker='o', color = region_color)
-        plt.plot(x, fit_func(x), color = region_color)
+        plt.plot(x_draw, row.slope * x + row.intercept, color = region_color)
 
 
     plt.title('VCASB vs Threshold for Each Region', fontsize=14)
-    plt.xlabel('VCASB', fontsize=12)
+    plt.xlabel('VCASB' if calibration is None else f'VCASB (mV, calibration v{calibration.version:03d})', fontsize=12)
     plt.ylabel('Threshold', fontsize=12)
     plt.ylim(5, 70)
 
@@ -189,21 +252,22 @@ def draw_vcasb_threshold(data, fig=False):
     plt.tight_layout()
 
     # Show the plot
-    if(fig):
-        fig_name = f"{MOSS_ID}_VASB-THR_{os.path.basename(args.scan_collection_folder)}.pdf"
+    if fig_name:
         plt.savefig( fig_name )
         print(f"Saved as {fig_name}")
+    if show:
         plt.show()
+    plt.close(figure)
 
     return fit_parameters
 
 
 
-def save_vcasb_fixedthr_txt(threshold, outpath, fit_parameters):
-    txt_file = os.path.join( outpath, f'{MOSS_ID}_thr{threshold}_vcasb_values.txt' )
+def save_vcasb_fixedthr_txt(threshold, outpath, fit_parameters, moss_id):
+    txt_file = os.path.join( outpath, f'{moss_id}_thr{threshold}_vcasb_values.txt' )
     with open(txt_file, 'w') as file:
 
-        file.write(f"##### {MOSS_ID} ######\n")
+        file.write(f"##### {moss_id} ######\n")
         file.write(f"##### THRESHOLD = {threshold} ######\n")
         for region, value in fit_parameters.items():
             vcasb = (threshold - fit_parameters[region]['intercept']) / fit_parameters[region]['slope']
@@ -213,9 +277,9 @@ def save_vcasb_fixedthr_txt(threshold, outpath, fit_parameters):
     print(f"Saved as {txt_file}" )
 
 
-def save_vcasb_csv(outpath, fit_parameters):
+def save_vcasb_csv(outpath, fit_parameters, moss_id):
     threshold_range = range(15, 31, 1)
-    csv_file = os.path.join(outpath, f'{MOSS_ID}_vcasb_values.csv')
+    csv_file = os.path.join(outpath, f'{moss_id}_vcasb_values.csv')
 
     # CSV 파일 생성 및 열기
     with open(csv_file, 'w', newline='') as file:
@@ -236,18 +300,93 @@ def save_vcasb_csv(outpath, fit_parameters):
     print(f"Saved as {csv_file}")
 
 
-
+def process_chip(scan_collection_folder, outpath=".", thresholds=(30,), use_cache=True, fig=True, show=False,
+                 dac_calibration=False):
+    """Full chain for one chip: extract, fit, write *_vcasb_values.csv and *_thr<N>_vcasb_values.txt.
+    All per-chip state is local, so several chips can run in parallel. Returns (fits, wall time).
+    With dac_calibration, the figure shows VCASB in mV if the chip has a calibration table."""
+    start = time.perf_counter()
+    moss_id = moss_id_from_path(scan_collection_folder)
+    all_results = extract_vcasb_threshold(scan_collection_folder, use_cache=use_cache, moss_id=moss_id)
+    fits = fit_vcasb_threshold(all_results)
+    fig_name = os.path.join(outpath, f"{moss_id}_VASB-THR_{os.path.basename(os.path.normpath(scan_collection_folder))}.pdf")
+    calibration = None
+    if dac_calibration and fig:
+        from dac_calibration import load_calibration
+        calibration = load_calibration(moss_id)
+        if calibration is None or not all('VCASB' in calibration.dacs(unit) for unit in ('tb', 'bb')):
+            print(f"No VCASB calibration of {moss_id}, drawing DAC units")
+            calibration = None
+    fit_parameters = draw_vcasb_threshold(all_results, fig=fig, fits=fits, fig_name=fig_name, show=show,
+                                          calibration=calibration)
+    for threshold in thresholds:
+        save_vcasb_fixedthr_txt(threshold=threshold, outpath=outpath, fit_parameters=fit_parameters, moss_id=moss_id)
+    save_vcasb_csv(outpath, fit_parameters, moss_id)
+    fits.insert(0, 'chip', moss_id)
+    fits.insert(1, 'scan_collection', scan_collection_folder)
+    return fits, time.perf_counter() - start
+
+
+def find_scan_collections(results_root):
+    """Latest ThresholdScan ScanCollection of every chip below results_root"""
+    collections = []
+    for chip_dir in sorted(glob.glob(os.path.join(results_root, 'babyMOSS-*'))):
+        chip_collections = sorted(glob.glob(os.path.join(chip_dir, 'ThresholdScan', 'ScanCollection*')))
+        if chip_collections:
+            collections.append(chip_collections[-1])
+    return collections
+
+
+def process_chips(scan_collection_folders, outpath=".", thresholds=(30,), use_cache=True, fig=True, max_workers=None,
+                  dac_calibration=False):
+    """process_chip for many chips on a process pool; writes vcasb_fit_summary.csv with all fits"""
+    start = time.perf_counter()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(process_chip, folder, outpath, thresholds, use_cache, fig, False, dac_calibration): folder
+                   for folder in scan_collection_folders}
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                fits, elapsed = future.result()
+            except Exception as e:  # keep the other chips going
+                print(f"[FAILED] {folder}: {type(e).__name__}: {e}")
+                continue
+            print(f"[{elapsed:6.2f} s] {fits['chip'].iloc[0]}: {len(fits)} regions, {int(fits['outlier'].sum())} flagged")
+            summaries.append(fits.assign(wall_time_s=elapsed))
+
+    summary = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame()
+    summary_file = os.path.join(outpath, "vcasb_fit_summary.csv")
+    summary.to_csv(summary_file, index=False)
+    print(f"Saved as {summary_file}")
+    print(f"Total {time.perf_counter() - start:.2f} s for {len(summaries)}/{len(scan_collection_folders)} chip(s)")
+    return summary
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract VCASB and Threshold values from ScanCollection folders")
-    parser.add_argument('scan_collection_folder', type=str, help="Path to the ScanCollection folder")
+    parser.add_argument('scan_collection_folder', type=str, nargs='*', help="Path(s) to ScanCollection folder(s)")
+    parser.add_argument('--results-root', type=str, default=None,
+                        help="process the latest ThresholdScan ScanCollection of every babyMOSS-* chip below this folder")
+    parser.add_argument('-o', '--outpath', type=str, default=".", help="output folder for csv/txt/pdf files")
+    parser.add_argument('-T', '--threshold', type=int, nargs='+', default=[30], help="thresholds for *_thr<N>_vcasb_values.txt")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes in batch mode")
+    parser.add_argument('--no-fig', action='store_true', help="skip the VCASB-THR figures")
+    parser.add_argument('--no-cache', action='store_true', help="re-parse every json5 file instead of using the scan cache")
+    parser.add_argument('--dac-calibration', action='store_true',
+                        help="draw VCASB in mV with the latest dac_calibration.py table of the chip")
 
     args = parser.parse_args()
 
-
-    all_results = extract_vcasb_threshold(args.scan_collection_folder)
-    fit_parameters = draw_vcasb_threshold(all_results, fig=True)
-    save_vcasb_fixedthr_txt(threshold=30, outpath=".", fit_parameters=fit_parameters)
-    save_vcasb_csv(".", fit_parameters)
-
+    folders = list(args.scan_collection_folder)
+    if args.results_root:
+        folders += find_scan_collections(args.results_root)
+    if not folders:
+        parser.error("give ScanCollection folder(s) or --results-root")
+
+    if len(folders) == 1:
+        process_chip(folders[0], args.outpath, args.threshold, use_cache=not args.no_cache,
+                     fig=not args.no_fig, show=True, dac_calibration=args.dac_calibration)
+    else:
+        process_chips(folders, args.outpath, args.threshold, use_cache=not args.no_cache,
+                      fig=not args.no_fig, max_workers=args.jobs, dac_calibration=args.dac_calibration)
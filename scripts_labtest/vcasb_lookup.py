@@ -0,0 +1,178 @@
+"""
+Cached threshold -> VCASB lookup for the config generators
+
+Linear fit parameters (Threshold = slope * VCASB + intercept) are stored per chip and
+region in a small JSON file, together with a hash of the scans they come from:
+
+    {"babyMOSS-2_4_W21D4": {"source": ..., "source_hash": ..., "kind": "scan" | "csv",
+                            "regions": {"tb0": {"slope": ..., "intercept": ...}, ...}}}
+
+Answering vcasb(chip, unit, region, threshold) only reads this file.
+Entries come either from a ScanCollection (fitted with vcasb2threshold) or, for chips
+where only a legacy *_vcasb_values.csv table exists, from a fit to that table.
+
+    python vcasb_lookup.py build  /path/to/babyMOSS-2_4_W21D4/ThresholdScan/ScanCollection_...
+    python vcasb_lookup.py import babyMOSS-3_4_W17E6_vcasb_values.csv
+    python vcasb_lookup.py query  babyMOSS-2_4_W21D4 bb 2 20.5
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+DEFAULT_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vcasb_fits.json")
+ROUNDING = {
+    "floor": np.floor,   # same as the int() used in the *_vcasb_values files
+    "round": np.round,
+    "ceil": np.ceil,
+    "none": None,
+}
+
+
+def hash_files(paths):
+    """Hash of (name, size, mtime) of the given files"""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def scan_collection_hash(scan_collection_folder):
+    files = glob.glob(os.path.join(scan_collection_folder, "*", "config", "scan_config.json5")) \
+        + glob.glob(os.path.join(scan_collection_folder, "*", "analysis", "analysis_result.json5"))
+    return hash_files(files)
+
+
+def chip_from_path(path):
+    """babyMOSS-2_4_W21D4 from a ScanCollection path (same as scan_loader.chip_from_path, without pandas)"""
+    match = re.search(r"babyMOSS-[^/_]+_[^/_]+_[^/_]+", path)
+    return match.group(0) if match else None
+
+
+def chip_from_csv(csv_path):
+    """babyMOSS-2_4_W21D4 from babyMOSS-2_4_W21D4_vcasb_values.csv"""
+    return os.path.basename(csv_path).split("_vcasb_values")[0]
+
+
+class VcasbLookup:
+
+    def __init__(self, store_path=DEFAULT_STORE):
+        self.store_path = store_path
+        self.entries = {}
+        if os.path.exists(store_path):
+            with open(store_path) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        tmp_path = self.store_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.store_path)
+
+    def chips(self):
+        return sorted(self.entries)
+
+    def _set(self, chip, regions, source, source_hash, kind):
+        self.entries[chip] = {
+            "source": os.path.abspath(source),
+            "source_hash": source_hash,
+            "kind": kind,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "regions": {region: {"slope": float(value["slope"]), "intercept": float(value["intercept"])}
+                        for region, value in regions.items()},
+        }
+        self.save()
+
+    def is_current(self, chip, source_hash):
+        return chip in self.entries and self.entries[chip]["source_hash"] == source_hash
+
+    def build(self, scan_collection_folder, force=False):
+        """Fit a ScanCollection and store it; skipped if the scans did not change since the last build"""
+        from vcasb2threshold import moss_id_from_path, extract_vcasb_threshold, fit_vcasb_threshold, \
+            fit_parameters_from  # pylint: disable=import-outside-toplevel
+        chip = moss_id_from_path(scan_collection_folder)
+        source_hash = scan_collection_hash(scan_collection_folder)
+        if not force and self.is_current(chip, source_hash):
+            return chip
+        fits = fit_vcasb_threshold(extract_vcasb_threshold(scan_collection_folder, moss_id=chip))
+        self._set(chip, fit_parameters_from(fits), scan_collection_folder, source_hash, "scan")
+        print(f"{chip}: fit parameters stored from {scan_collection_folder}")
+        return chip
+
+    def import_csv(self, csv_path, chip=None, force=False):
+        """Store a legacy threshold -> VCASB table (columns Threshold, tb_region0, ...).
+        The table holds int()-truncated VCASB values, so the fitted line is shifted by +0.5
+        DAC to undo the truncation on average; 'floor' rounding then reproduces the table."""
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+        chip = chip or chip_from_csv(csv_path)
+        source_hash = hash_files([csv_path])
+        if not force and self.is_current(chip, source_hash):
+            return chip
+        table = pd.read_csv(csv_path)
+        thresholds = table["Threshold"].to_numpy(dtype=float)
+        regions = {}
+        for column in table.columns[1:]:
+            # vcasb = a * threshold + b  <=>  threshold = vcasb / a - b / a
+            a, b = np.polyfit(thresholds, table[column].to_numpy(dtype=float), deg=1)
+            b += 0.5
+            regions[f"{column[0:2]}{column[-1]}"] = {"slope": 1.0 / a, "intercept": -b / a}
+        self._set(chip, regions, csv_path, source_hash, "csv")
+        print(f"{chip}: fit parameters stored from {csv_path}")
+        return chip
+
+    def fit_parameters(self, chip):
+        if chip not in self.entries:
+            raise KeyError(f"{chip} not in {self.store_path}; build it from a ScanCollection or import its csv first")
+        return self.entries[chip]["regions"]
+
+    def vcasb(self, chip, unit, region, threshold, rounding="floor"):
+        """VCASB giving threshold (scalar or array, fractional allowed) on unit ('tb'/'bb') region"""
+        parameters = self.fit_parameters(chip)[f"{unit}{region}"]
+        vcasb = (np.asarray(threshold, dtype=float) - parameters["intercept"]) / parameters["slope"]
+        if ROUNDING[rounding] is not None:
+            vcasb = ROUNDING[rounding](vcasb).astype(int)
+        return vcasb.item() if vcasb.ndim == 0 else vcasb
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached threshold -> VCASB lookup")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="fit parameter store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="fit ScanCollection(s) and store the parameters")
+    build_parser.add_argument("scan_collection_folder", nargs="+")
+    build_parser.add_argument("--force", action="store_true")
+    import_parser = subparsers.add_parser("import", help="store legacy *_vcasb_values.csv table(s)")
+    import_parser.add_argument("csv", nargs="+")
+    import_parser.add_argument("--force", action="store_true")
+    query_parser = subparsers.add_parser("query", help="print VCASB for a threshold")
+    query_parser.add_argument("chip")
+    query_parser.add_argument("unit", choices=["tb", "bb"])
+    query_parser.add_argument("region", type=int)
+    query_parser.add_argument("threshold", type=float, nargs="+")
+    query_parser.add_argument("--rounding", choices=list(ROUNDING), default="floor")
+    subparsers.add_parser("list", help="list stored chips")
+    args = parser.parse_args()
+
+    lookup = VcasbLookup(args.store)
+    if args.command == "build":
+        for folder in args.scan_collection_folder:
+            lookup.build(folder, force=args.force)
+    elif args.command == "import":
+        for csv_path in args.csv:
+            lookup.import_csv(csv_path, force=args.force)
+    elif args.command == "query":
+        print(lookup.vcasb(args.chip, args.unit, args.region, args.threshold, rounding=args.rounding))
+    else:
+        for chip in lookup.chips():
+            entry = lookup.entries[chip]
+            print(f"{chip}: {entry['kind']} {entry['source']} ({entry['created']})")
+
+
+if __name__ == "__main__":
+    main()
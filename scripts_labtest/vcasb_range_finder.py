@@ -3,29 +3,115 @@
 Script developed by Maurice Donner (REF: maurice.calvin.donner@cern.ch)
 It will automatically determine a VCASB range for a given sensor unit
 and is developed for testbeam measurements.
+
+Without moss_test / moss_scans and the analyses installed, only --simulate works.
 """
+import contextlib
+import copy
+import csv
 import datetime
+import enum
 import logging
+import math
 import os
 import sys
+import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tqdm import tqdm
-from tqdm.contrib.logging import logging_redirect_tqdm
-import numpy as np
-from result import Result
-from moss_test.test_system.exit_codes import TestExitCode
-from moss_test.test_system.convenience import load_json, write_json
-from moss_scans.base_readout_scan import BaseReadoutScan
-from moss_scans.fhr_scan import FakeHitRateScan
-from moss_scans.thr_scan import ThresholdScan
+from typing import NamedTuple
+from vcasb_search import SEARCHES, group_by_spread, hold_within_spread, parallel_search
+from scan_memo import ScanMemo, config_key
+import moss_scan_sim
+try:
+    from tqdm import tqdm
+    from tqdm.contrib.logging import logging_redirect_tqdm
+except ImportError:  # no progress bars
+    class tqdm:  # pylint: disable=invalid-name
+        """Silent stand-in for the progress bars"""
+
+        def __init__(self, iterable=None, **kwargs):
+            self.iterable = iterable
+
+        def __iter__(self):
+            return iter(self.iterable)
+
+        def update(self, n=1):
+            pass
+
+        def set_description(self, desc):
+            pass
+
+        def close(self):
+            pass
+
+    @contextlib.contextmanager
+    def logging_redirect_tqdm():
+        handler = logging.StreamHandler()
+        logging.getLogger().addHandler(handler)
+        try:
+            yield
+        finally:
+            logging.getLogger().removeHandler(handler)
 
 #sys.path.append(os.path.join(__file__, "../../analyses"))
 
 # pylint: disable=wrong-import-position, wrong-import-order
 sys.path.append( "/home/npl/babyMOSS/sw/analyses" )
-from fhr_analysis import FakeHitRateAnalysis  # noqa: E402
-from thr_scan_analysis import ThresholdScanAnalysis  # noqa: E402
+try:
+    from result import Ok, Result
+    from moss_test.test_system.exit_codes import TestExitCode
+    from moss_test.test_system.convenience import load_json, write_json
+    from moss_scans.base_readout_scan import BaseReadoutScan
+    from moss_scans.fhr_scan import FakeHitRateScan
+    from moss_scans.thr_scan import ThresholdScan
+    from fhr_analysis import FakeHitRateAnalysis  # noqa: E402
+    from thr_scan_analysis import ThresholdScanAnalysis  # noqa: E402
+    HARDWARE_ERROR = None
+except ImportError as e:  # test system not installed: only --simulate works
+    from moss_scan_sim import Ok
+    from moss_stub import load_json, write_json
+    Result = BaseReadoutScan = object
+
+    class TestExitCode(enum.IntEnum):
+        TEST_FAILED = 1
+
+    FakeHitRateScan = ThresholdScan = FakeHitRateAnalysis = ThresholdScanAnalysis = None
+    HARDWARE_ERROR = e
+
+
+class TmpConfig(NamedTuple):
+    """Config of one scan: kept in memory, written to path for provenance"""
+
+    path: str
+    config: dict
+    timing: dict  # config_s, io_s (filled in by the background writer)
+
+
+class ProvenanceWriter:
+    """Writes the tmp configs on a background thread, off the critical path of the scans"""
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.futures = {}
+
+    def _write(self, path: str, data: dict, timing: dict) -> None:
+        start = time.perf_counter()
+        write_json(path, data)
+        timing["io_s"] += time.perf_counter() - start
+
+    def write_json(self, path: str, data: dict, timing: dict) -> None:
+        self.futures[path] = self.pool.submit(self._write, path, data, timing)
+
+    def wait(self, path: str) -> None:
+        """Block until path is on disk"""
+        if path in self.futures:
+            self.futures[path].result()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+        for future in self.futures.values():
+            future.result()  # raise write errors
 
 
 def range_finder(  # pylint: disable=too-many-locals
@@ -45,13 +131,17 @@ def range_finder(  # pylint: disable=too-many-locals
 
         # Run first check to see if starting values are ok
         initial_config = create_tmp_config(args, ts_path, unit, 0, args.vcasb_default)
-        fhr_result, fhr = run_and_analyse_scan(FakeHitRateScan, timestamp, initial_config, unit)
+        fhr_result, fhr = run_and_analyse_scan(
+            FakeHitRateScan, timestamp, initial_config, unit, memo=args.scan_memo, args=args
+        )
 
         if fhr_result.is_err():
             logger.error("Initial scan failed. Try lowering vcasb_initial")
             sys.exit(TestExitCode.TEST_FAILED)
 
-        thr_result, thr = run_and_analyse_scan(ThresholdScan, timestamp, initial_config, unit)
+        thr_result, thr = run_and_analyse_scan(
+            ThresholdScan, timestamp, initial_config, unit, memo=args.scan_memo, args=args
+        )
 
         if not thr_result.is_err():
             logger.info(f"Initial FHR scan successful. FHR: {fhr}")
@@ -62,21 +152,25 @@ def range_finder(  # pylint: disable=too-many-locals
         out_dict[unit]["THR_default"] = thr
 
     for unit in conf["enabled_units"]:
+        region_mask = get_region_mask(conf, unit)
+        if args.parallel_regions:
+            find_unit_limits(args=args, ts_path=ts_path, timestamp=timestamp, out_dict=out_dict, unit=unit,
+                             regions=[region for region in range(4) if (region_mask >> region) & 1],
+                             max_spread=args.max_spread if args.max_spread is not None
+                             else conf.get("vcasb_max_spread"))
+            write_json(args.output_dir_path + f"/results_{unit}.json", out_dict)
+            continue
+
         for region in tqdm(range(4), desc=f"Unit {unit} regions finished"):
 
             out_dict[unit][region] = {}
 
-            region_mask = 15
-            if "region_readout_enable_masks" in conf.keys():
-                if unit[:2] in conf["region_readout_enable_masks"].keys():
-                    region_mask = conf["region_readout_enable_masks"][unit[:2]]
-
             # Don't scan disabled regions
             if (region_mask >> region) & 1 == 0:
                 continue
 
             # Find upper limit for FHR
-            tmp_config_path, vcasb_max = find_fhr_limit(
+            tmp_config, vcasb_max = find_fhr_limit(
                 args=args,
                 ts_path=ts_path,
                 timestamp=timestamp,
@@ -86,7 +180,9 @@ def range_finder(  # pylint: disable=too-many-locals
             )
 
             try:
-                thr_result, thr = run_and_analyse_scan(ThresholdScan, timestamp, tmp_config_path, unit)
+                thr_result, thr = run_and_analyse_scan(
+                    ThresholdScan, timestamp, tmp_config, unit, memo=args.scan_memo, args=args
+                )
             except Exception as e:
                 logger.error(f"{e}: Initial configuration is above FHR limit! Aborting...")
                 sys.exit(TestExitCode.TEST_FAILED)
@@ -96,9 +192,13 @@ def range_finder(  # pylint: disable=too-many-locals
 
             # Measure min setting
             vcasb_min = out_dict[unit][region]["VCASB_max"] - args.vcasb_delta
-            tmp_config_path = create_tmp_config(args, ts_path, unit, region, vcasb_min)
-            fhr_result, fhr = run_and_analyse_scan(FakeHitRateScan, timestamp, tmp_config_path, unit)
-            thr_result, thr = run_and_analyse_scan(ThresholdScan, timestamp, tmp_config_path, unit)
+            tmp_config = create_tmp_config(args, ts_path, unit, region, vcasb_min)
+            fhr_result, fhr = run_and_analyse_scan(
+                FakeHitRateScan, timestamp, tmp_config, unit, memo=args.scan_memo, args=args
+            )
+            thr_result, thr = run_and_analyse_scan(
+                ThresholdScan, timestamp, tmp_config, unit, memo=args.scan_memo, args=args
+            )
             logger.info(f"FHR of {unit} r{region} VCASB {vcasb_min}: {fhr[region]}")
             logger.info(f"THR of {unit} r{region} VCASB {vcasb_min}: {thr[region]}")
             out_dict[unit][region]["VCASB_min"] = vcasb_min
@@ -108,80 +208,143 @@ def range_finder(  # pylint: disable=too-many-locals
         write_json(args.output_dir_path + f"/results_{unit}.json", out_dict)
 
 
+def get_region_mask(conf: dict, unit: str) -> int:
+    """region_readout_enable_masks of the unit, all 4 regions if not configured"""
+    region_mask = 15
+    if "region_readout_enable_masks" in conf.keys():
+        if unit[:2] in conf["region_readout_enable_masks"].keys():
+            region_mask = conf["region_readout_enable_masks"][unit[:2]]
+    return region_mask
+
+
+def find_unit_limits(  # pylint: disable=too-many-arguments, too-many-locals
+    *,
+    args: argparse.Namespace,
+    ts_path: str,
+    timestamp: str,
+    out_dict: dict,
+    unit: str,
+    regions: list[int],
+    max_spread: int | None,
+) -> None:
+    """Search the FHR limit of all given regions of a unit at once (vcasb_search.parallel_search),
+    then measure THR at the max settings and FHR/THR at the min settings, all regions per scan,
+    or in several scans where the settings span more than max_spread.
+    Regions not searched are kept at vcasb_default (moved as needed to stay within max_spread)."""
+
+    logger = logging.getLogger(__name__)
+
+    def vcasb_vector(vcasb_per_region: dict) -> list[int]:
+        return [vcasb_per_region.get(region, args.vcasb_default) for region in range(4)]
+
+    def measure_all(vcasb_per_region: dict) -> tuple[bool, list]:
+        vcasb_list = vcasb_vector(vcasb_per_region)
+        logger.info(f"Running FHR scan for unit {unit} VCASB {vcasb_list}")
+        tmp_config = create_tmp_config(args, ts_path, unit, None, vcasb_list)
+        result, fhr = run_and_analyse_scan(
+            FakeHitRateScan, timestamp, tmp_config, unit, memo=args.scan_memo, args=args
+        )
+        if result.is_err():
+            return False, [math.nan] * 4
+        logger.info(f"FHR of {unit} VCASB {vcasb_list}: {fhr}")
+        return True, fhr
+
+    not_searched = {region: args.vcasb_default for region in range(4) if region not in regions}
+    searches, n_scans = parallel_search(measure_all, regions, args.vcasb_initial, args.fhr_limit, max_spread,
+                                        held=not_searched)
+    logger.info(f"{unit} r{regions}: FHR limits found after {n_scans} FHR scans (parallel search)")
+
+    for region in range(4):
+        out_dict[unit][region] = {}
+    for region, search in searches.items():
+        if not search.reached:
+            logger.warning(f"{unit} r{region}: FHR limit not reached. Last successful scan at VCASB {search.vcasb}")
+        out_dict[unit][region]["VCASB_max"] = search.vcasb
+        out_dict[unit][region]["FHR_max"] = search.fhr
+        out_dict[unit][region]["FHR_scans"] = search.n_scans
+        logger.info(f"{unit} r{region}: VCASB_max {search.vcasb} (FHR {search.fhr}) after {search.n_scans} FHR scans")
+
+    for setting, offset in (("max", 0), ("min", args.vcasb_delta)):
+        settings = {region: search.vcasb - offset for region, search in searches.items()}
+        for group in group_by_spread(settings, max_spread):
+            others = {**not_searched, **{region: vcasb for region, vcasb in settings.items() if region not in group}}
+            vcasb_list = vcasb_vector(hold_within_spread(group, others, max_spread))
+            tmp_config = create_tmp_config(args, ts_path, unit, None, vcasb_list)
+            if setting == "min":
+                fhr_result, fhr = run_and_analyse_scan(
+                    FakeHitRateScan, timestamp, tmp_config, unit, memo=args.scan_memo, args=args
+                )
+                if fhr_result.is_err():
+                    logger.error(f"FHR scan of {unit} VCASB {vcasb_list} failed")
+                    sys.exit(TestExitCode.TEST_FAILED)
+            thr_result, thr = run_and_analyse_scan(
+                ThresholdScan, timestamp, tmp_config, unit, memo=args.scan_memo, args=args
+            )
+            if thr_result.is_err():
+                logger.error(f"THR scan of {unit} VCASB {vcasb_list} failed")
+                sys.exit(TestExitCode.TEST_FAILED)
+            for region in group:
+                out_dict[unit][region][f"THR_{setting}"] = thr[region]
+                if setting == "min":
+                    out_dict[unit][region]["VCASB_min"] = vcasb_list[region]
+                    out_dict[unit][region]["FHR_min"] = fhr[region]
+            logger.info(f"THR of {unit} VCASB {vcasb_list}: {thr}")
+
+
 def find_fhr_limit(  # pylint: disable=too-many-arguments
     *, args: argparse.Namespace, ts_path: str, timestamp: str, out_dict: dict, unit: str, region: int
-) -> tuple[str, int]:
-    """repeatedly perform FHR scans until the user-defined upper limit has been found"""
+) -> tuple[TmpConfig, int]:
+    """repeatedly perform FHR scans until the user-defined upper limit has been found,
+    using the search strategy selected with --search (see vcasb_search.py)"""
 
     logger = logging.getLogger(__name__)
-
-    # Find Max setting
-    vcasb_next, vcasb_previous = args.vcasb_initial, args.vcasb_initial - 1
-    failed_once = False
-    fhr = [0, 0, 0, 0]
-    tmp_config_path = None
+    tmp_configs = {}
 
     pbar = tqdm(total=args.fhr_limit, desc=f"FHR approaching limit (VCASB={args.vcasb_initial})")
-    while fhr[region] < args.fhr_limit:
-
-        logger.info("Running FHR scan for unit {unit} r{region} VCASB {vcasb_next}")
-        tmp_config_path = create_tmp_config(args, ts_path, unit, region, vcasb_next)
-        result, fhr = run_and_analyse_scan(FakeHitRateScan, timestamp, tmp_config_path, unit)
 
+    def measure(vcasb: int) -> tuple[bool, float]:
+        logger.info(f"Running FHR scan for unit {unit} r{region} VCASB {vcasb}")
+        tmp_configs[vcasb] = create_tmp_config(args, ts_path, unit, region, vcasb)
+        result, fhr = run_and_analyse_scan(
+            FakeHitRateScan, timestamp, tmp_configs[vcasb], unit, memo=args.scan_memo, args=args
+        )
         if result.is_err():
-            failed_once = True
-            # If we jumped multiple settings: go one back
-            if vcasb_next - vcasb_previous > 1:
-                vcasb_next -= 1
-            # If not, try one more time
-            else:
-                logger.info("Trying one more time...")
-                result, fhr = run_and_analyse_scan(FakeHitRateScan, timestamp, tmp_config_path, unit)
-                if not result.is_err():
-                    logger.info("FHR of {unit} r{region} VCASB {vcasb_next}: {fhr[region]}")
-                    out_dict[unit][region]["VCASB_max"] = vcasb_next
-                    out_dict[unit][region]["FHR_max"] = fhr[region]
-                    vcasb_previous = vcasb_next
-                    vcasb_next += 1
-                    break
-
-                vcasb_next -= 1
-                break
-
-        else:
-            logger.info(f"FHR of {unit} r{region} VCASB {vcasb_next}: {fhr[region]}")
-            out_dict[unit][region]["VCASB_max"] = vcasb_next
-            out_dict[unit][region]["FHR_max"] = fhr[region]
-            if fhr[region] >= args.fhr_limit:
-                break
-            if failed_once:
-                logger.warning(f"FHR limit not reached. Last successful scan at VCASB {vcasb_next}")
-                break
-
-            # for every order of magnitude we are below our limit, move two VCASB up
-            if fhr[region] <= 1e-10:  # Handle 0 FHR
-                vcasb_step = 10
-            else:
-                vcasb_step = 2 * int(np.log10(args.fhr_limit / fhr[region]))
-
-            if vcasb_step == 0:
-                vcasb_step += 2
-            vcasb_previous = vcasb_next
-            vcasb_next += vcasb_step
-
-        pbar.set_description(f"FHR approaching limit (VCASB={vcasb_next})")
+            return False, math.nan
+        logger.info(f"FHR of {unit} r{region} VCASB {vcasb}: {fhr[region]}")
+        pbar.set_description(f"FHR approaching limit (VCASB={vcasb})")
         pbar.update(fhr[region])
+        return True, fhr[region]
 
+    search = SEARCHES[args.search](measure, args.vcasb_initial, args.fhr_limit)
     pbar.close()
 
-    return tmp_config_path, vcasb_next
+    if not search.reached:
+        logger.warning(f"FHR limit not reached. Last successful scan at VCASB {search.vcasb}")
+    if not math.isnan(search.fhr):
+        out_dict[unit][region]["VCASB_max"] = search.vcasb
+        out_dict[unit][region]["FHR_max"] = search.fhr
+    out_dict[unit][region]["FHR_scans"] = search.n_scans
+    logger.info(
+        f"{unit} r{region}: VCASB_max {search.vcasb} (FHR {search.fhr}) after {search.n_scans} FHR scans"
+        f" ({args.search} search)"
+    )
+
+    return tmp_configs[search.vcasb], search.vcasb
 
 
-def create_tmp_config(args: argparse.Namespace, ts_path: str, unit: str, region: int, vcasb: int) -> str:
-    """Create a config file for each scan, and save it to the output directory"""
+def create_tmp_config(
+    args: argparse.Namespace, ts_path: str, unit: str, region: int | None, vcasb: int | list[int]
+) -> TmpConfig:
+    """Create a config for each scan from the base config parsed once in main(), and save it to the
+    output directory in the background.
+    vcasb is either the setting of region (others at vcasb_default) or a list with all 4 regions."""
 
-    tmp_config_path = args.output_dir_path + f"/config/{unit}_r{region}_{vcasb}_config.json5"
-    tmp_config = load_json(args.scan_config_file)
+    start = time.perf_counter()
+    if isinstance(vcasb, list):
+        tmp_config_path = args.output_dir_path + f"/config/{unit}_vcasb_{'_'.join(map(str, vcasb))}_config.json5"
+    else:
+        tmp_config_path = args.output_dir_path + f"/config/{unit}_r{region}_{vcasb}_config.json5"
+    tmp_config = copy.deepcopy(args.base_config)
 
     # Make ts_config global for all sub scans
     tmp_config["ts_config"] = ts_path
@@ -190,7 +353,10 @@ def create_tmp_config(args: argparse.Namespace, ts_path: str, unit: str, region:
     tmp_config["enabled_units"] = [unit]
 
     # Define VCASB list
-    vcasb_list = [vcasb if vcasb_list == region else args.vcasb_default for vcasb_list in range(4)]
+    if isinstance(vcasb, list):
+        vcasb_list = vcasb
+    else:
+        vcasb_list = [vcasb if vcasb_list == region else args.vcasb_default for vcasb_list in range(4)]
 
     # Find where VCASB is defined in tmp_config config file.
     units = list(tmp_config["moss_dac_settings"].keys())
@@ -198,44 +364,115 @@ def create_tmp_config(args: argparse.Namespace, ts_path: str, unit: str, region:
         if "VCASB" in tmp_config["moss_dac_settings"][key].keys():
             tmp_config["moss_dac_settings"][key]["VCASB"] = vcasb_list  # Write list
 
-    write_json(tmp_config_path, tmp_config)
-    return tmp_config_path
+    timing = {"config_s": time.perf_counter() - start, "io_s": 0.0}
+    args.provenance.write_json(tmp_config_path, tmp_config, timing)
+    return TmpConfig(tmp_config_path, tmp_config, timing)
+
+
+# Scan classes that take the config as a dict declare it with this class attribute; all others
+# (the current moss_scans classes) get the path of the written config file.
+ACCEPTS_CONFIG_DICT = "accepts_config_dict"
+
+
+def takes_config_dict(scan_class: type) -> bool:
+    return getattr(scan_class, ACCEPTS_CONFIG_DICT, False) is True
 
 
-def run_and_analyse_scan(
-    scan_class: BaseReadoutScan, timestamp: str, conf: dict, unit: str
+def run_and_analyse_scan(  # pylint: disable=too-many-arguments
+    scan_class: BaseReadoutScan,
+    timestamp: str,
+    conf: TmpConfig,
+    unit: str,
+    memo: ScanMemo | None = None,
+    args: argparse.Namespace | None = None,
 ) -> tuple[Result, float]:
-    """Run and analyse automatically, then return the result"""
+    """Run and analyse automatically, then return the result.
+    The config is handed to the scan as a copy of the dict if the scan class opts in
+    (accepts_config_dict), else as the written file; the analysis values are taken from the return
+    value of the analysis (analysis_result.json5 is only read if it returns nothing usable).
+    With a memo, a scan of an identical config that already succeeded is not run again.
+    The stage timing is appended to args.scan_timing if given."""
 
     logger = logging.getLogger(__name__)
+    # the config time of a TmpConfig used by several scans (FHR and THR) is counted with the first one
+    stages = {"config_s": 0.0, "io_s": 0.0} if conf.timing.get("counted") else conf.timing
+    conf.timing["counted"] = True
+    timing = {"scan": scan_class.__name__, "config": conf.path, "cached": False, "stages": stages}
+    if args is not None:
+        args.scan_timing.append(timing)
+    # key of the config as generated, before the scan gets to see it
+    memo_key = config_key(scan_class.__name__, conf.config)
+    if memo is not None:
+        value = memo.get(scan_class.__name__, key=memo_key)
+        if value is not None:
+            logger.info(f"{scan_class.__name__} of {conf.path}: stored result {value}")
+            timing["cached"] = True
+            return Ok(None), value
+
+    start = time.perf_counter()
+    if takes_config_dict(scan_class):
+        scan_config = copy.deepcopy(conf.config)
+    else:
+        if args is not None:
+            args.provenance.wait(conf.path)
+        scan_config = conf.path
     runscan: BaseReadoutScan = scan_class(
-        conf, intermediate_dir_name=f"Range_finder_{timestamp}/", setup_stream_handler=False
+        scan_config, intermediate_dir_name=f"Range_finder_{timestamp}/", setup_stream_handler=False
     )
     scan_result = runscan.run()
-    print(type(scan_result))
+    timing["acquisition_s"] = time.perf_counter() - start
 
+    start = time.perf_counter()
     if scan_class == FakeHitRateScan:
         analysis = FakeHitRateAnalysis(top_scan_dir=Path(runscan.output_dir_path), quiet=True)
-        analysis.run()
-        analysis_result = load_json(
-            os.path.join(runscan.output_dir_path, "analysis", "analysis_result.json5")
-        )
-        value = analysis_result[unit[:2]]["FakeHitRate"]
+        key = "FakeHitRate"
     elif scan_class == ThresholdScan:
         analysis = ThresholdScanAnalysis(top_scan_dir=Path(runscan.output_dir_path), quiet=True)
-        analysis.run()
-        analysis_result = load_json(
-            os.path.join(runscan.output_dir_path, "analysis", "analysis_result.json5")
-        )
-        value = analysis_result[unit[:2]]["Threshold average per region"]
+        key = "Threshold average per region"
     else:
         logger.error(f"Something went wrong during scan {scan_class.__name__}. Aborting...")
         sys.exit(TestExitCode.TEST_FAILED)
+    analysis_result = analysis.run()
+    timing["analysis_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if not isinstance(analysis_result, dict) or key not in analysis_result.get(unit[:2], {}):
+        analysis_result = load_json(os.path.join(runscan.output_dir_path, "analysis", "analysis_result.json5"))
+    value = analysis_result[unit[:2]][key]
+
+    if memo is not None and not scan_result.is_err():
+        memo.put(scan_class.__name__, conf.config, value, conf.path, str(runscan.output_dir_path), key=memo_key)
+    timing["io_s"] = time.perf_counter() - start
 
     del runscan, analysis
     return scan_result, value
 
 
+def write_scan_timing(args: argparse.Namespace) -> None:
+    """Appends the stage timing of every scan to scan_timing.csv (kept across --resume), plus a summary
+    of this run in the log"""
+    columns = ["scan", "config", "cached", "config_s", "acquisition_s", "analysis_s", "io_s", "config_io_s"]
+    rows = []
+    for timing in args.scan_timing:
+        row = {key: value for key, value in timing.items() if key != "stages"}
+        row["config_s"] = timing["stages"]["config_s"]
+        row["config_io_s"] = timing["stages"]["io_s"]
+        rows.append(row)
+    timing_file = os.path.join(args.output_dir_path, "scan_timing.csv")
+    new_file = not os.path.exists(timing_file) or os.path.getsize(timing_file) == 0
+    with open(timing_file, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+    totals = {column: sum(row.get(column, 0.0) for row in rows) for column in columns[3:]}
+    logging.getLogger(__name__).info(
+        f"{len(rows)} scans ({sum(row['cached'] for row in rows)} stored): "
+        + ", ".join(f"{column[:-2]} {total:.1f} s" for column, total in totals.items())
+    )
+
+
 def main() -> None:
     """Execute range_finder"""
     parser = argparse.ArgumentParser(
@@ -270,13 +507,59 @@ effectively defining the lower limit for determining the VCASB range.",
         "-c", "--scan_config_file", type=str, required=True, help="Name or path of the config file"
     )
     parser.add_argument("-f", "--fhr_limit", type=float, default=1e-3, help="FHR limit to look for")
+    parser.add_argument(
+        "--search",
+        choices=list(SEARCHES),
+        default="model",
+        help="VCASB search: 'step' (+2 VCASB per decade below the limit) or 'model' (log(FHR) fit and bisection)",
+    )
+    parser.add_argument(
+        "--parallel_regions",
+        action="store_true",
+        help="Search all enabled regions of a unit at once, each scan setting a VCASB per region (model search)",
+    )
+    parser.add_argument(
+        "--max_spread",
+        type=int,
+        default=None,
+        help="With --parallel_regions: largest VCASB difference between regions advanced in the same scan "
+        "(crosstalk limit, default: vcasb_max_spread from the scan config, else unlimited)",
+    )
+
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        help="Output directory of an interrupted session: continue there, skipping scans already done",
+    )
+    parser.add_argument(
+        "--reuse_hours",
+        type=float,
+        default=None,
+        help="Also reuse scan results of other sessions of this chip that are at most this old",
+    )
+    parser.add_argument(
+        "--no_memo", action="store_true", help="Run every scan, do not store or reuse scan results"
+    )
+
+    parser.add_argument(
+        "--simulate",
+        type=int,
+        default=None,
+        metavar="SEED",
+        help="Run on a simulated chip (moss_scan_sim.py) with this random seed instead of the hardware",
+    )
 
     arguments = parser.parse_args()
+    if arguments.simulate is None and HARDWARE_ERROR is not None:
+        parser.error(f"{HARDWARE_ERROR}: only --simulate works without the test system")
 
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
 
     config = load_json(arguments.scan_config_file)
+    # parsed once, every scan config is a copy of it
+    arguments.base_config = config
     top_result_dir = config["top_result_dir"]
 
     # Make ts_path global for all sub scans
@@ -285,16 +568,35 @@ effectively defining the lower limit for determining the VCASB range.",
         sw_path = os.path.join(__file__, "../../../")
         ts_path = os.path.join(sw_path, config["ts_config"])
 
-    ts_config = load_json(ts_path)
-    moss_chip_id = ts_config["moss_chip_id"]
-
-    # Create a working directory with timestamp
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    local_path = f"{moss_chip_id}/RangeFinder"
-    folder = f"{moss_chip_id}_RangeFinder_{timestamp}"
-    arguments.output_dir_path = os.path.join(top_result_dir, local_path, folder)
-    os.makedirs(arguments.output_dir_path)
-    os.makedirs(os.path.join(arguments.output_dir_path, "config"))
+    sim_chip = None
+    if arguments.simulate is not None:
+        # No hardware: scans and analyses are replaced by moss_scan_sim
+        sim_chip = moss_scan_sim.install(sys.modules[__name__], seed=arguments.simulate)
+        moss_chip_id = f"babyMOSS-sim_{arguments.simulate}"
+    else:
+        ts_config = load_json(ts_path)
+        moss_chip_id = ts_config["moss_chip_id"]
+
+    if arguments.resume:
+        # Continue in the working directory of an interrupted session
+        arguments.output_dir_path = os.path.normpath(arguments.resume)
+        timestamp = arguments.output_dir_path.split("_RangeFinder_")[-1]
+        os.makedirs(os.path.join(arguments.output_dir_path, "config"), exist_ok=True)
+    else:
+        # Create a working directory with timestamp
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        local_path = f"{moss_chip_id}/RangeFinder"
+        folder = f"{moss_chip_id}_RangeFinder_{timestamp}"
+        arguments.output_dir_path = os.path.join(top_result_dir, local_path, folder)
+        os.makedirs(arguments.output_dir_path)
+        os.makedirs(os.path.join(arguments.output_dir_path, "config"))
+
+    arguments.scan_memo = None
+    if not arguments.no_memo:
+        arguments.scan_memo = ScanMemo.for_session(
+            arguments.output_dir_path,
+            reuse_max_age_s=arguments.reuse_hours * 3600 if arguments.reuse_hours is not None else None,
+        )
 
     with logging_redirect_tqdm():
         tqdm_logger = logger.handlers[-1]
@@ -303,8 +605,18 @@ effectively defining the lower limit for determining the VCASB range.",
                 "[%(asctime)s]    %(levelname)-10s %(name)-55s %(funcName)s:%(lineno)d %(message)s"
             )
         )
-        range_finder(arguments, ts_path, timestamp, config)
-
+        arguments.provenance = ProvenanceWriter()
+        arguments.scan_timing = []
+        try:
+            range_finder(arguments, ts_path, timestamp, config)
+        finally:
+            arguments.provenance.close()
+            write_scan_timing(arguments)
+
+    if arguments.scan_memo is not None:
+        print(f"{arguments.scan_memo.hits} scan(s) taken from stored results")
+    if sim_chip is not None:
+        print(f"Simulated: {sim_chip.n_scans} scans, {sim_chip.clock / 60:.1f} min of scan time")
     print(f"Done. Results written to {arguments.output_dir_path}/results.json")
 
 
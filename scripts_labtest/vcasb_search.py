@@ -0,0 +1,232 @@
+"""
+VCASB search strategies for the FHR limit of one region
+
+Both strategies only see a measure(vcasb) callable returning (ok, fhr), ok being False when the
+scan failed (in practice: the region is too noisy to be read out), so they can be driven by
+real FakeHitRateScans (vcasb_range_finder.py) or by a simulation.
+
+    step_search    the original vcasb_range_finder walk: +2 VCASB per decade below the limit,
+                   one step back / one retry on failed scans
+    model_search   fits log10(FHR) vs VCASB to the points measured so far, jumps to the
+                   predicted crossing and closes the bracket with interpolation / bisection
+
+Both return the VCASB at which the FHR limit is reached (the lowest such VCASB for model_search).
+parallel_search runs model_search for all regions of a unit from the same scans.
+"""
+import logging
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+FHR_ZERO = 1e-10
+
+
+class SearchResult(NamedTuple):
+    vcasb: int        # VCASB_max: setting at which the limit is reached (else the last good setting)
+    fhr: float        # FHR measured there
+    reached: bool     # fhr >= fhr_limit
+    n_scans: int      # number of measure() calls
+    points: list      # [(vcasb, ok, fhr)] in measurement order
+
+
+def legacy_step(fhr, fhr_limit):
+    """for every order of magnitude we are below our limit, move two VCASB up"""
+    if fhr <= FHR_ZERO:  # Handle 0 FHR
+        return 10
+    return max(2 * int(np.log10(fhr_limit / fhr)), 2)
+
+
+def step_search(measure, vcasb_initial, fhr_limit):
+    """The original find_fhr_limit walk"""
+    points = []
+    vcasb_next, vcasb_previous = vcasb_initial, vcasb_initial - 1
+    failed_once = False
+    best = None
+    while True:
+        ok, fhr = measure(vcasb_next)
+        points.append((vcasb_next, ok, fhr))
+        if not ok:
+            failed_once = True
+            # If we jumped multiple settings: go one back
+            if vcasb_next - vcasb_previous > 1:
+                vcasb_next -= 1
+                continue
+            # If not, try one more time
+            ok, fhr = measure(vcasb_next)
+            points.append((vcasb_next, ok, fhr))
+            if ok:
+                best = (vcasb_next, fhr)
+            break
+
+        best = (vcasb_next, fhr)
+        if fhr >= fhr_limit or failed_once:
+            break
+        vcasb_previous = vcasb_next
+        vcasb_next += legacy_step(fhr, fhr_limit)
+
+    if best is None:
+        return SearchResult(vcasb_initial, math.nan, False, len(points), points)
+    return SearchResult(best[0], best[1], best[1] >= fhr_limit, len(points), points)
+
+
+def predict_crossing(points, fhr_limit, n_last=4):
+    """VCASB where a straight line through log10(FHR) of the last good points crosses the limit,
+    None if there is no rising trend to extrapolate"""
+    good = sorted((vcasb, fhr) for vcasb, ok, fhr in points if ok and fhr > FHR_ZERO)[-n_last:]
+    if len({vcasb for vcasb, _ in good}) < 2:
+        return None
+    slope, intercept = np.polyfit([vcasb for vcasb, _ in good], [np.log10(fhr) for _, fhr in good], deg=1)
+    if slope <= 0:
+        return None
+    return (np.log10(fhr_limit) - intercept) / slope
+
+
+def model_search_steps(vcasb_initial, fhr_limit, vcasb_limit=255, max_jump=20):
+    """model_search as a generator: yields the next VCASB to scan, is sent (ok, fhr) back and
+    returns the SearchResult. Lets one measurement drive several regions (parallel_search)."""
+    logger = logging.getLogger(__name__)
+    points = []
+    good = {}        # vcasb -> fhr of successful scans
+    retried = set()
+
+    def record(vcasb, ok, fhr):
+        points.append((vcasb, ok, fhr))
+        if ok:
+            good[vcasb] = fhr
+
+    ok, fhr = yield vcasb_initial
+    record(vcasb_initial, ok, fhr)
+    if not ok:
+        ok, fhr = yield vcasb_initial
+        record(vcasb_initial, ok, fhr)
+    if not ok or fhr >= fhr_limit:
+        reached = ok and fhr >= fhr_limit
+        return SearchResult(vcasb_initial, fhr if ok else math.nan, reached, len(points), points)
+
+    low, high = vcasb_initial, None   # low: below the limit, high: above the limit or failed
+    slow_steps = 0   # consecutive steps that did not halve the bracket
+    while high is None or high - low > 1 or (high not in good and high not in retried):
+        if high is not None and high - low <= 1:
+            # the bracket closes on a failed scan: try it once more
+            logger.info(f"Trying VCASB {high} one more time...")
+            retried.add(high)
+            vcasb = high
+        elif high is None:
+            # no bracket yet: extrapolate, or fall back to the original step
+            prediction = predict_crossing(points, fhr_limit)
+            step = legacy_step(good[low], fhr_limit) if prediction is None else math.ceil(prediction) - low
+            vcasb = min(low + min(max(step, 1), max_jump), vcasb_limit)
+            if vcasb == low:
+                break
+        elif slow_steps >= 2 or high not in good or good[low] <= FHR_ZERO:
+            vcasb = (low + high) // 2
+        else:
+            # interpolate log10(FHR) between the bracket ends
+            log_low, log_high = np.log10(good[low]), np.log10(good[high])
+            vcasb = low + (np.log10(fhr_limit) - log_low) / (log_high - log_low) * (high - low)
+            vcasb = min(max(math.ceil(vcasb), low + 1), high - 1)
+        width = None if high is None else high - low
+
+        ok, fhr = yield vcasb
+        record(vcasb, ok, fhr)
+        if ok and fhr < fhr_limit:
+            low = vcasb
+            if high is not None and high <= low:
+                high = None
+        else:
+            high = vcasb
+        # bisect if interpolation twice in a row did not halve the bracket
+        slow_steps = slow_steps + 1 if width and high is not None and (high - low) > width / 2 else 0
+
+    if high is not None and high in good:
+        return SearchResult(high, good[high], True, len(points), points)
+    return SearchResult(low, good[low], False, len(points), points)
+
+
+def model_search(measure, vcasb_initial, fhr_limit, vcasb_limit=255, max_jump=20):
+    """Lowest VCASB with FHR >= fhr_limit (failed scans count as above the limit).
+    Starts at vcasb_initial like step_search and, as step_search, does not search below it."""
+    steps = model_search_steps(vcasb_initial, fhr_limit, vcasb_limit, max_jump)
+    try:
+        vcasb = next(steps)
+        while True:
+            vcasb = steps.send(measure(vcasb))
+    except StopIteration as stop:
+        return stop.value
+
+
+def hold_within_spread(measured, held, max_spread=None):
+    """{region: vcasb} of one scan: the measured regions at their settings, every held region moved
+    as little as possible into the window that keeps the whole vector within max_spread (crosstalk).
+    A held region may be raised above its last setting; its FHR is not used."""
+    if max_spread is None or not measured or not held:
+        return {**held, **measured}
+    # window [low, low + max_spread] around the measured settings, as low as the held ones allow
+    low = min(max(min(held.values()), max(measured.values()) - max_spread), min(measured.values()))
+    return {**{region: min(max(vcasb, low), low + max_spread) for region, vcasb in held.items()}, **measured}
+
+
+def group_by_spread(vcasb_per_region, max_spread=None):
+    """Split {region: vcasb} into groups spanning at most max_spread each, lowest settings first"""
+    if max_spread is None:
+        return [dict(vcasb_per_region)]
+    groups = []
+    for region, vcasb in sorted(vcasb_per_region.items(), key=lambda item: item[1]):
+        if groups and vcasb - min(groups[-1].values()) <= max_spread:
+            groups[-1][region] = vcasb
+        else:
+            groups.append({region: vcasb})
+    return groups
+
+
+def parallel_search(measure_all, regions, vcasb_initial, fhr_limit, max_spread=None, held=None, **kwargs):
+    """model_search of several regions of one unit at once.
+
+    measure_all({region: vcasb}) runs one scan with these VCASBs and returns (ok, fhr) with fhr
+    indexed by region. Every scan advances all regions that are still searching. A failed scan
+    is attributed by re-scanning its regions one at a time, the others parked at their last
+    setting below the limit. held ({region: vcasb}) are regions of the scan that are not searched.
+    With max_spread, only regions whose next VCASB is within max_spread of the lowest one are
+    advanced together, and all other regions (waiting, finished or held) are moved into the same
+    window (hold_within_spread), so no scan spans more than max_spread (crosstalk).
+    Returns ({region: SearchResult}, number of scans)."""
+    searches = {region: model_search_steps(vcasb_initial, fhr_limit, **kwargs) for region in regions}
+    requests = {region: next(steps) for region, steps in searches.items()}
+    parked = {**(held or {}), **{region: vcasb_initial for region in regions}}
+    results = {}
+    n_scans = 0
+
+    def scan(measured):
+        others = {region: vcasb for region, vcasb in parked.items() if region not in measured}
+        return measure_all(hold_within_spread(measured, others, max_spread))
+
+    while requests:
+        batch = requests
+        if max_spread is not None:
+            batch = group_by_spread(requests, max_spread)[0]
+
+        ok, fhr = scan(batch)
+        n_scans += 1
+        if ok or len(batch) == 1:
+            responses = {region: (ok, fhr[region] if ok else math.nan) for region in batch}
+        else:
+            responses = {}
+            for region, vcasb in batch.items():
+                ok, fhr = scan({region: vcasb})
+                n_scans += 1
+                responses[region] = (ok, fhr[region] if ok else math.nan)
+
+        requests = dict(requests)
+        for region, (ok, fhr) in responses.items():
+            if ok and fhr < fhr_limit:
+                parked[region] = batch[region]
+            try:
+                requests[region] = searches[region].send((ok, fhr))
+            except StopIteration as stop:
+                results[region] = stop.value
+                del requests[region]
+    return results, n_scans
+
+
+SEARCHES = {"step": step_search, "model": model_search}